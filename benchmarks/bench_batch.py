@@ -0,0 +1,87 @@
+"""Page summaries one call per URL vs batched, calls, tokens and time.
+
+Runs the async summarize step of the web research chain over `--pages`
+fresh pages per run, with SUMMARY_BATCH off ("per page", one summary call
+per URL as the chain used to make) and on ("batched", several pages per
+structured output call, see ra_batch). The fake model answers after
+`--model-latency` seconds and generates `--summary-words` words per page
+at `--tokens-per-second`. With `--rpm` the calls also go through the rate
+limit scheduler with that many requests per minute, where every call
+saved is time saved; a minute lasts `--minute` seconds.
+
+Prints the mean time per request, chat model calls and prompt and
+completion tokens per request.
+
+    python benchmarks/bench_batch.py --pages 10 --runs 5 [--rpm 30]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import stubs
+import ra_metrics
+from ra_ratelimit import RateLimitScheduler
+
+
+class CountingChatModel(stubs.FakeChatModel):
+    calls: int = 0
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        return await super()._agenerate(messages, stop, run_manager, **kwargs)
+
+
+async def run(app, chain, model, search, server, pages, runs, first, rate_limits):
+    latencies = []
+    for run in range(runs):
+        offset = first + run * pages
+        # Fresh URLs and question every run so no cache helps
+        search.urls = [server.url("page", offset + i) for i in range(pages)]
+        start = time.perf_counter()
+        await chain.ainvoke({"question": f"Benchmark question {offset}", "results_per_query": pages},
+                            config=app.model_config(model, rate_limits))
+        latencies.append(time.perf_counter() - start)
+    return statistics.mean(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--model-latency", type=float, default=0.3)
+    parser.add_argument("--tokens-per-second", type=float, default=750)
+    parser.add_argument("--summary-words", type=int, default=60)
+    parser.add_argument("--rpm", type=float, default=0, help="schedule calls at this many requests per minute")
+    parser.add_argument("--minute", type=float, default=6.0, help="seconds in a rate limit minute")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["CACHE_DIR"] = tmp
+        app = stubs.load_app_module()
+        chain = app.get_web_search_chain()
+        with stubs.PageServer(delay=0.05) as server:
+            search = stubs.FakeSearch([], latency=0.0)
+            stubs.install_stubs(app, search)
+            for n, (name, batch) in enumerate((("per page", 0), ("batched", 1))):
+                model = CountingChatModel(latency=args.model_latency, tokens_per_second=args.tokens_per_second,
+                                          response=" ".join(f"fact{i}" for i in range(args.summary_words)))
+                rate_limits = None
+                if args.rpm:
+                    rate_limits = RateLimitScheduler(rpm=args.rpm, tpm=10 ** 9, minute=args.minute).get("benchmark-key")
+                app.SUMMARY_BATCH = batch
+                ra_metrics.llm_tokens._values.clear()
+                seconds = asyncio.run(run(app, chain, model, search, server, args.pages, args.runs,
+                                          n * args.pages * args.runs, rate_limits))
+                tokens = {kind: sum(v for (_, _, t), v in ra_metrics.llm_tokens._values.items() if t == kind)
+                          for kind in ("prompt", "completion")}
+                print(f"{name:>8}: {seconds:6.2f}s per request  {model.calls / args.runs:5.1f} calls  "
+                      f"{tokens['prompt'] / args.runs:7.0f} prompt tokens  "
+                      f"{tokens['completion'] / args.runs:6.0f} completion tokens")
+            print(f"batching: {app.batch_stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Per-request model/chain setup cost and LLM connection counts.
+
+"before" builds a ChatGroq client and the research chain for every request,
+as the old handler did. "after" takes the clients from `model_router` and runs
+the shared `research_chain`. ChatGroq talks to a local fake Groq endpoint
+that counts distinct TCP connections, search and page fetches are stubbed.
+
+    python benchmarks/bench_clients.py --requests 50
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from stubs import FakeGroqServer, FakeSearch, PageServer, load_app_module
+
+
+async def run(mode: str, app_module, n: int, concurrency: int, groq: FakeGroqServer):
+    groq.connections.clear()
+    requests_before = groq.requests
+    setup = []
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with limit:
+            return await request(i)
+
+    async def request(i):
+        start = time.perf_counter()
+        if mode == "before":
+            model = app_module.get_model("benchmark-key")
+            chain = app_module.get_chain(model)
+            config = None
+        else:
+            model = app_module.model_router.get("benchmark-key")
+            chain = app_module.research_chain
+            config = app_module.model_config(model)
+        setup.append(time.perf_counter() - start)
+        return await chain.ainvoke({"question": f"{mode} question {i}"}, config=config)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    elapsed = time.perf_counter() - start
+    print(f"{mode:>6}: {n} requests in {elapsed:6.2f}s  "
+          f"setup {sum(setup) / len(setup) * 1000:7.2f} ms/request  "
+          f"{groq.requests - requests_before} LLM calls over {len(groq.connections)} connections")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--model-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    with FakeGroqServer(latency=args.model_latency) as groq, PageServer() as pages:
+        os.environ["GROQ_API_BASE"] = groq.base_url
+        app_module = load_app_module()
+        app_module.ddg_search = FakeSearch([pages.url("page", i) for i in range(args.pages)], latency=0)
+        for mode in ("before", "after"):
+            # Keep the caches from hiding the LLM calls
+            app_module.summary_cache.clear()
+            asyncio.run(run(mode, app_module, args.requests, args.concurrency, groq))
+
+
+if __name__ == "__main__":
+    main()
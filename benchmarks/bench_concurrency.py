@@ -0,0 +1,66 @@
+"""Concurrent research throughput, blocking `invoke` vs `ainvoke`.
+
+Runs N research chains at once against stubbed search, HTTP and LLM
+backends. "before" calls `final_chain.invoke` inside a coroutine the way the
+old `/research` handler did, "after" awaits `final_chain.ainvoke`. A probe
+task measures how long the event loop is blocked, which is what every other
+request (like `GET /`) would see.
+
+    python benchmarks/bench_concurrency.py --requests 20
+"""
+import argparse
+import asyncio
+import time
+
+from stubs import FakeSearch, PageServer, install_stubs, load_app_module
+
+
+async def probe_loop(stop: asyncio.Event, lags: list, interval: float = 0.01):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def run(mode: str, chain, n: int):
+    stop = asyncio.Event()
+    lags = []
+    probe = asyncio.create_task(probe_loop(stop, lags))
+
+    async def one(i):
+        payload = {"question": f"question {i}"}
+        if mode == "before":
+            return chain.invoke(payload)
+        return await chain.ainvoke(payload)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+    max_lag = max(lags) if lags else elapsed
+    print(f"{mode:>6}: {n} requests in {elapsed:6.2f}s  "
+          f"{n / elapsed:7.2f} req/s  max loop stall {max_lag * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--model-latency", type=float, default=0.2)
+    parser.add_argument("--search-latency", type=float, default=0.1)
+    parser.add_argument("--page-delay", type=float, default=0.1)
+    args = parser.parse_args()
+
+    app_module = load_app_module()
+    with PageServer(delay=args.page_delay) as server:
+        search = FakeSearch([server.url("page", i) for i in range(args.pages)],
+                            latency=args.search_latency)
+        model = install_stubs(app_module, search, model_latency=args.model_latency)
+        chain = app_module.get_chain(model)
+        for mode in ("before", "after"):
+            asyncio.run(run(mode, chain, args.requests))
+
+
+if __name__ == "__main__":
+    main()
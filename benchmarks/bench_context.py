@@ -0,0 +1,60 @@
+"""Tokens saved by context packing on recorded pipeline runs.
+
+Each line of the runs file is a JSON object with the `question` and the
+per-URL `summaries` of one research run. Record real runs by starting the
+app with RECORD_RUNS=/path/to/runs.jsonl; `data/recorded_runs.jsonl` is a
+small sample with the kind of overlap multi-source summaries have.
+
+For every run this prints the report prompt's `research_summary` size with
+the old plain concatenation and with `pack_context`, plus how many passages
+were dropped as near duplicates and the packing time.
+
+    python benchmarks/bench_context.py --runs runs.jsonl --budget 2000
+"""
+import argparse
+import json
+import os
+import time
+
+import stubs  # noqa: F401  (puts the repo on sys.path)
+from ra_context import TOKEN_BUDGET, count_tokens, pack_context
+
+DEFAULT_RUNS = os.path.join(os.path.dirname(__file__), "data", "recorded_runs.jsonl")
+
+
+def load_runs(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", default=DEFAULT_RUNS)
+    parser.add_argument("--budget", type=int, default=TOKEN_BUDGET)
+    args = parser.parse_args()
+
+    app = stubs.load_app_module()
+    runs = load_runs(args.runs)
+    print(f"{len(runs)} runs, budget {args.budget} tokens")
+
+    total_before = total_after = 0
+    for run in runs:
+        # The summaries joined as they were before packing
+        before = count_tokens("\n\n".join(run["summaries"]))
+        start = time.perf_counter()
+        packed, stats = pack_context(run["question"], app.summary_sources(run["summaries"]), args.budget)
+        elapsed = time.perf_counter() - start
+        after = count_tokens(packed)
+        total_before += before
+        total_after += after
+        print(f"{run['question'][:50]:<50}  {before:6d} -> {after:6d} tokens "
+              f"({1 - after / before:6.1%} saved)  {stats['duplicates_removed']:3d}/{stats['passages']:3d} "
+              f"duplicate passages  {elapsed * 1000:6.1f} ms")
+
+    if total_before:
+        print(f"{'total':<50}  {total_before:6d} -> {total_after:6d} tokens "
+              f"({1 - total_after / total_before:6.1%} saved)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Throughput and peak memory of the HTML-to-text extractors.
+
+Runs every engine in `ra_extract.EXTRACTORS` (`soup` is the old
+BeautifulSoup get_text path) over a directory of saved HTML pages and
+prints input chars/sec and peak traced memory per extractor. Without
+`--corpus` a synthetic corpus of boilerplate-heavy pages is generated.
+
+    python benchmarks/bench_extract.py --corpus ~/saved-pages
+"""
+import argparse
+import glob
+import os
+import time
+import tracemalloc
+
+import stubs  # noqa: F401  (puts the repo on sys.path)
+from ra_extract import EXTRACTORS, MAX_CHARS
+
+
+def synthetic_corpus(count: int = 20):
+    script = "<script>" + "var data = {'k': [1, 2, 3]};" * 2000 + "</script>"
+    style = "<style>" + ".cls { color: red; margin: 0 }" * 1000 + "</style>"
+    nav = "<nav><ul>" + "".join(f"<li><a href='/{i}'>Link {i}</a></li>" for i in range(300)) + "</ul></nav>"
+    pages = []
+    for n in range(count):
+        paragraphs = "".join(
+            f"<p>Section {n}.{i}: the measured value was {i * 7} units, up {i}% on last year.</p>"
+            for i in range(400 + 50 * n)
+        )
+        pages.append(
+            f"<html><head><title>Doc {n}</title>{style}{script}</head><body>{nav}"
+            f"<header>Site header</header><main><article><h1>Doc {n}</h1>{paragraphs}"
+            f"</article></main><footer>{nav}</footer>{script}</body></html>"
+        )
+    return pages
+
+
+def load_corpus(path):
+    pages = []
+    for name in sorted(glob.glob(os.path.join(path, "*.htm*"))):
+        with open(name, encoding="utf-8", errors="replace") as f:
+            pages.append(f.read())
+    return pages
+
+
+def measure(name, extractor, pages, max_chars, repeat):
+    total_chars = sum(len(p) for p in pages) * repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            extractor(page, max_chars)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    for page in pages:
+        extractor(page, max_chars)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{name:>10}: {total_chars / elapsed / 1e6:8.2f} M chars/s  "
+          f"{elapsed / (len(pages) * repeat) * 1000:8.2f} ms/page  peak {peak / 1e6:7.2f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", help="directory of saved .html pages")
+    parser.add_argument("--max-chars", type=int, default=MAX_CHARS)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pages = load_corpus(args.corpus) if args.corpus else synthetic_corpus()
+    if not pages:
+        parser.error(f"no .html files found in {args.corpus}")
+    print(f"{len(pages)} pages, {sum(len(p) for p in pages) / 1e6:.1f} M chars, budget {args.max_chars}")
+
+    for name, extractor in EXTRACTORS.items():
+        measure(name, extractor, pages, args.max_chars, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Page fetch latency against slow and very large pages.
+
+Compares the old approach (a fresh `requests.get` per URL, no timeout, full
+body download) with the shared `PageFetcher` (pooled connections, timeouts,
+byte cap, concurrency limit) on a local server mixing normal, slow and huge
+pages.
+
+    python benchmarks/bench_fetcher.py --normal 30 --slow 3 --large 3
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import requests
+
+from stubs import PageServer
+
+from ra_fetch import PageFetcher
+
+
+def naive_fetch(url: str) -> int:
+    response = requests.get(url=url)
+    return len(response.content)
+
+
+async def run_naive(urls):
+    async def one(url):
+        start = time.perf_counter()
+        size = await asyncio.to_thread(naive_fetch, url)
+        return time.perf_counter() - start, size
+
+    return await asyncio.gather(*(one(u) for u in urls))
+
+
+async def run_fetcher(urls, fetcher: PageFetcher):
+    async def one(url):
+        start = time.perf_counter()
+        try:
+            page = await fetcher.fetch(url)
+            size = page.bytes_read
+        except Exception:
+            size = 0
+        return time.perf_counter() - start, size
+
+    try:
+        return await asyncio.gather(*(one(u) for u in urls))
+    finally:
+        await fetcher.aclose()
+
+
+def report(name, results, elapsed):
+    latencies = sorted(r[0] for r in results)
+    total_bytes = sum(r[1] for r in results)
+    p95 = latencies[int(0.95 * (len(latencies) - 1))]
+    print(f"{name:>8}: wall {elapsed:6.2f}s  p50 {statistics.median(latencies) * 1000:8.1f} ms  "
+          f"p95 {p95 * 1000:8.1f} ms  max {latencies[-1] * 1000:8.1f} ms  "
+          f"read {total_bytes / 1e6:7.2f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--normal", type=int, default=30)
+    parser.add_argument("--slow", type=int, default=3)
+    parser.add_argument("--large", type=int, default=3)
+    parser.add_argument("--slow-delay", type=float, default=3.0)
+    parser.add_argument("--large-bytes", type=int, default=20_000_000)
+    parser.add_argument("--read-timeout", type=float, default=1.0)
+    # every page lives on one local host, so the per-host cap dominates p50
+    parser.add_argument("--per-host", type=int, default=6)
+    args = parser.parse_args()
+
+    with PageServer(slow_delay=args.slow_delay, large_bytes=args.large_bytes) as server:
+        urls = ([server.url("page", i) for i in range(args.normal)]
+                + [server.url("slow", i) for i in range(args.slow)]
+                + [server.url("large", i) for i in range(args.large)])
+
+        start = time.perf_counter()
+        results = asyncio.run(run_naive(urls))
+        report("naive", results, time.perf_counter() - start)
+
+        fetcher = PageFetcher(max_per_host=args.per_host, read_timeout=args.read_timeout,
+                              total_timeout=args.read_timeout * 2)
+        start = time.perf_counter()
+        results = asyncio.run(run_fetcher(urls, fetcher))
+        report("fetcher", results, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
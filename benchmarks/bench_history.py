@@ -0,0 +1,102 @@
+"""Report history: storage size, and the time to archive, list, search and re-read.
+
+Fills a ReportHistory with `--entries` reports of about `--words` words of
+markdown for `--owners` users, each with `--sources` source summaries.
+The words are drawn from a Zipf-like vocabulary so the text compresses and
+indexes roughly like English. Prints the stored size against the raw JSON,
+and the p50 and p95 of archiving a report, reading one back, listing a
+page and searching.
+
+Reading a report back is what replaces running the pipeline again, which
+takes seconds (see replay.py).
+
+    python benchmarks/bench_history.py --entries 5000
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import stubs  # noqa: F401
+from ra_history import ReportHistory
+from ra_jobs import owner_id
+
+
+def vocabulary(size: int, rng: random.Random):
+    letters = "etaoinshrdlucmfwypvbgkqjxz"
+    words = {"".join(rng.choice(letters[:12 + n % 14]) for _ in range(rng.randint(2, 10))) for n in range(size * 2)}
+    return sorted(words)[:size]
+
+
+def text(words, weights, count: int, rng: random.Random) -> str:
+    return " ".join(rng.choices(words, weights, k=count))
+
+
+def report(words, weights, count: int, rng: random.Random) -> str:
+    paragraphs = [f"## {text(words, weights, 4, rng).title()}\n\n{text(words, weights, 120, rng)}."
+                  for _ in range(max(1, count // 124))]
+    return f"# {text(words, weights, 6, rng).title()}\n\n" + "\n\n".join(paragraphs)
+
+
+def timed(fn, runs: int):
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - start)
+    seconds.sort()
+    return statistics.median(seconds) * 1000, seconds[int(len(seconds) * 0.95)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=5000)
+    parser.add_argument("--owners", type=int, default=50)
+    parser.add_argument("--words", type=int, default=1500)
+    parser.add_argument("--sources", type=int, default=5)
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    words = vocabulary(5000, rng)
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    # Owners are hashes of API keys, as in the app
+    owners = [owner_id(f"benchmark-key-{n}") for n in range(args.owners)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "history.sqlite3")
+        history = ReportHistory(path)
+        ids = []
+        add_seconds = []
+        for n in range(args.entries):
+            sources = [{"url": f"https://example.com/{n}/{i}", "summary": text(words, weights, 80, rng)}
+                       for i in range(args.sources)]
+            question = text(words, weights, 8, rng) + "?"
+            body = report(words, weights, args.words, rng)
+            start = time.perf_counter()
+            ids.append((history.add(rng.choice(owners), question, body, "search", sources)))
+            add_seconds.append(time.perf_counter() - start)
+        add_seconds.sort()
+        stats = history.stats()
+        file_bytes = sum(os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp))
+        print(f"{stats['entries']} reports: {stats['bytes'] / 2 ** 20:.1f} MB of JSON stored in "
+              f"{stats['stored_bytes'] / 2 ** 20:.1f} MB ({stats['compression_ratio']:.1f}x), "
+              f"{file_bytes / 2 ** 20:.1f} MB on disk with the index")
+
+        entries = history.list(owners[0], args.entries)["entries"]
+        targets = [(e["id"], owners[0]) for e in entries]
+        queries = [text(words, weights[:200] + [0] * (len(words) - 200), 2, rng) for _ in range(20)]
+        rows = [
+            ("archive", statistics.median(add_seconds) * 1000, add_seconds[int(len(add_seconds) * 0.95)] * 1000),
+            ("read", *timed(lambda: history.get(*rng.choice(targets)), args.runs)),
+            ("list page", *timed(lambda: history.list(rng.choice(owners), 10, 0), args.runs)),
+            ("search", *timed(lambda: history.search(rng.choice(owners), rng.choice(queries), 10, 0), args.runs)),
+        ]
+        for name, p50, p95 in rows:
+            print(f"{name:>10}: p50 {p50:7.3f}ms  p95 {p95:7.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Latency and token cost per stage, one model for everything vs per-stage routing.
+
+Two fake chat models stand in for Groq's large and small models, each with
+its own time to first token and generation speed. "one model" sends every
+stage to the large model, as the app used to. "routed" uses the ra_models
+defaults, which send page summaries to the small model. Each run writes a
+web research report with generated queries and a sectioned report. The
+LLM metrics give calls, latency and tokens per stage, and tokens are
+priced with `--prices`, in dollars per million input and output tokens.
+
+    python benchmarks/bench_models.py --runs 3
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import stubs
+import ra_metrics
+from ra_models import DEFAULT_MODEL, SMALL_MODEL, STAGE_SETTINGS, ModelRouter
+
+# Groq list prices when this was written, $ per million input/output tokens
+PRICES = {DEFAULT_MODEL: (0.59, 0.79), SMALL_MODEL: (0.05, 0.08)}
+
+
+class StageChatModel(stubs.FakeChatModel):
+    """Short answers to summarize prompts, long ones to everything else"""
+
+    summary_words: int = 150
+    report_words: int = 800
+
+    def _content(self, messages):
+        prompt = messages[-1].content if messages else ""
+        summary = " ".join(f"fact{i}" for i in range(self.summary_words))
+        if '<page id="' in prompt:
+            return self._page_summaries(prompt, summary)
+        if "answer in short" in prompt:
+            return summary
+        if "google search queries" in prompt:
+            return super()._content(messages)
+        return " ".join(f"word{i}" for i in range(self.report_words))
+
+
+def stage_table(prices):
+    """Per (model, stage): calls, mean seconds, prompt and completion tokens, cost"""
+    rows = {}
+    for (model, stage), (_, count, total) in ra_metrics.llm_seconds._values.items():
+        prompt = ra_metrics.llm_tokens._values.get((model, stage, "prompt"), 0)
+        completion = ra_metrics.llm_tokens._values.get((model, stage, "completion"), 0)
+        price_in, price_out = prices.get(model, (0.0, 0.0))
+        cost = (prompt * price_in + completion * price_out) / 1e6
+        rows[(stage, model)] = (count, total / count, prompt, completion, cost)
+    return rows
+
+
+async def run(app, runs):
+    latencies = {"search": [], "sections": []}
+    for i in range(runs):
+        for engine in latencies:
+            start = time.perf_counter()
+            await app.run_research_job(f"Benchmark question {engine} {i}", "benchmark-key", num_queries=3,
+                                       results_per_query=5, engine=engine, fresh=True)
+            latencies[engine].append(time.perf_counter() - start)
+    return {engine: statistics.mean(values) for engine, values in latencies.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--large-latency", type=float, default=0.4)
+    parser.add_argument("--large-tokens-per-second", type=float, default=250)
+    parser.add_argument("--small-latency", type=float, default=0.15)
+    parser.add_argument("--small-tokens-per-second", type=float, default=1000)
+    parser.add_argument("--prices", nargs=4, type=float, metavar=("LARGE_IN", "LARGE_OUT", "SMALL_IN", "SMALL_OUT"),
+                        default=[*PRICES[DEFAULT_MODEL], *PRICES[SMALL_MODEL]])
+    args = parser.parse_args()
+
+    prices = {DEFAULT_MODEL: tuple(args.prices[:2]), SMALL_MODEL: tuple(args.prices[2:])}
+    fakes = {
+        DEFAULT_MODEL: StageChatModel(model_name=DEFAULT_MODEL, latency=args.large_latency,
+                                      tokens_per_second=args.large_tokens_per_second),
+        SMALL_MODEL: StageChatModel(model_name=SMALL_MODEL, latency=args.small_latency,
+                                    tokens_per_second=args.small_tokens_per_second),
+    }
+    setups = {
+        "one model": {stage: s._replace(model=DEFAULT_MODEL) for stage, s in STAGE_SETTINGS.items()},
+        "routed": STAGE_SETTINGS,
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["CACHE_DIR"] = tmp
+        os.environ["CHECKPOINT_DB"] = os.path.join(tmp, "checkpoints.sqlite3")
+        app = stubs.load_app_module()
+        # Not at the top: ra_langgraph reads CACHE_DIR when imported
+        import ra_langgraph
+        stubs.paid_tier_limits(app)
+        with stubs.PageServer() as server:
+            app.ddg_search = stubs.FakeSearch([server.url("page", i) for i in range(40)], latency=0.0, spread=True)
+            for name, settings in setups.items():
+                app.model_router = ModelRouter(lambda api_key, s, http_client: fakes[s.model], settings)
+                # Every section at once, so the limiter warming up does not skew the comparison
+                ra_langgraph.section_limiter = ra_langgraph.AdaptiveLimiter(
+                    initial=ra_langgraph.MAX_SECTIONS, maximum=ra_langgraph.MAX_SECTIONS)
+                ra_metrics.llm_seconds._values.clear()
+                ra_metrics.llm_tokens._values.clear()
+                latencies = asyncio.run(run(app, args.runs))
+                rows = stage_table(prices)
+                print(f"{name}: web research report {latencies['search']:5.2f}s, "
+                      f"sectioned report {latencies['sections']:5.2f}s, "
+                      f"${sum(r[4] for r in rows.values()) / args.runs / 2:.5f} per report")
+                for (stage, model), (count, seconds, prompt, completion, cost) in sorted(rows.items()):
+                    print(f"  {stage:>9} {model:>24}: {count:4d} calls {seconds:6.2f}s each  "
+                          f"{prompt:7d} in {completion:7d} out  ${cost:.5f}")
+
+
+if __name__ == "__main__":
+    main()
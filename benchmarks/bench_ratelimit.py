@@ -0,0 +1,136 @@
+"""Reports written under a Groq-like rate limit, retries only vs the scheduler.
+
+A fake chat model enforces requests and tokens per minute for the API key
+like Groq does: a call that does not fit is answered with a 429 and a
+retry-after, and the client sleeps that long and retries up to twice, like
+the groq client, before the error reaches the app. "retries only" sends
+every call as soon as the pipeline gets to it, which is how the app used
+to behave. "scheduled" has calls wait for the key's budget in
+ra_ratelimit, with the report ahead of the page summaries.
+
+`--reports` reports of `--pages` sources each are started at once for one
+API key. A minute lasts `--minute` seconds so a run takes seconds, not
+minutes; the limits are per such minute. Prints the time to write all of
+them, how many failed, how many sources were dropped, the 429s the model
+sent and the mean time from submitting a report to having it.
+
+    python benchmarks/bench_ratelimit.py --reports 6 --pages 8
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import stubs
+import ra_metrics
+from ra_ratelimit import RateLimitScheduler, TokenBucket
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after: float):
+        super().__init__("Rate limit reached")
+        self.response = type("Response", (), {"status_code": 429, "headers": {"retry-after": f"{retry_after:.3f}"}})
+
+
+class LimitedChatModel(stubs.FakeChatModel):
+    """Fake model behind per-minute request and token limits"""
+
+    rpm: float = 30
+    tpm: float = 6000
+    minute: float = 60.0
+    max_retries: int = 2
+    attempts: int = 0
+    rejected: int = 0
+    tokens_used: int = 0
+
+    def model_post_init(self, __context):
+        self._limits = (TokenBucket(self.rpm, self.minute), TokenBucket(self.tpm, self.minute))
+
+    def _admit(self, messages) -> float:
+        """Take the call's share of the limits, or return the retry-after"""
+        requests, tokens = self._limits
+        usage = self._usage(messages, self._content(messages))
+        now = time.monotonic()
+        wait = max(requests.wait(1, now), tokens.wait(usage["total_tokens"], now))
+        if wait <= 0:
+            requests.level -= 1
+            tokens.level -= usage["total_tokens"]
+            self.tokens_used += usage["total_tokens"]
+        return wait
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self.attempts += 1
+            wait = self._admit(messages)
+            if wait <= 0:
+                return await super()._agenerate(messages, stop, run_manager, **kwargs)
+            self.rejected += 1
+            if attempt == self.max_retries:
+                raise RateLimitError(wait)
+            await asyncio.sleep(wait)
+
+
+async def run(app, reports: int, pages: int, first: int):
+    latencies, failures = [], 0
+
+    async def report(n):
+        nonlocal failures
+        start = time.perf_counter()
+        try:
+            await app.run_research_job(f"Benchmark question {first + n}", "benchmark-key",
+                                       results_per_query=pages, fresh=True)
+        except Exception:
+            failures += 1
+        else:
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(report(n) for n in range(reports)))
+    return time.perf_counter() - start, latencies, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reports", type=int, default=6)
+    parser.add_argument("--pages", type=int, default=8)
+    parser.add_argument("--rpm", type=float, default=30)
+    parser.add_argument("--tpm", type=float, default=12000)
+    parser.add_argument("--minute", type=float, default=6.0, help="seconds in a rate limit minute")
+    parser.add_argument("--model-latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["CACHE_DIR"] = tmp
+        os.environ["CHECKPOINT_DB"] = os.path.join(tmp, "checkpoints.sqlite3")
+        app = stubs.load_app_module()
+        with stubs.PageServer(delay=0.05) as server:
+            search = stubs.FakeSearch([], latency=0.0)
+            stubs.install_stubs(app, search)
+            for n, (name, scheduled) in enumerate((("retries only", False), ("scheduled", True))):
+                model = LimitedChatModel(rpm=args.rpm, tpm=args.tpm, minute=args.minute,
+                                         latency=args.model_latency, response=" ".join(["fact"] * 150))
+                app.get_model = lambda api_key, settings=None, http_client=None, model=model: model
+                app.model_router.clear()
+                app.RATE_LIMIT = int(scheduled)
+                app.rate_limiter = RateLimitScheduler(rpm=args.rpm, tpm=args.tpm, minute=args.minute)
+                # Fresh pages every run so no cache helps
+                first = n * args.reports * args.pages
+                search.urls = [server.url("page", first + i) for i in range(args.reports * args.pages)]
+                search.spread = True
+                ra_metrics.sources_dropped._values.clear()
+                elapsed, latencies, failures = asyncio.run(run(app, args.reports, args.pages, first))
+                dropped = sum(ra_metrics.sources_dropped._values.values())
+                print(f"{name:>12}: {args.reports} reports in {elapsed:6.2f}s  {failures} failed  "
+                      f"{dropped:3.0f} sources dropped  {model.rejected:4d} 429s in {model.attempts:4d} calls  "
+                      f"{model.tokens_used * args.minute / elapsed:6.0f} tokens per minute  "
+                      f"report latency {statistics.mean(latencies) if latencies else float('nan'):6.2f}s")
+                if scheduled:
+                    print(f"{'':>12}  scheduler: {app.rate_limiter.stats()}")
+
+
+if __name__ == "__main__":
+    main()
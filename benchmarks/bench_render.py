@@ -0,0 +1,77 @@
+"""Report rendering cost and event loop stalls, inline vs MarkdownRenderer.
+
+"inline" converts each report with `markdown.markdown` on the event loop,
+as the job page used to. "renderer" awaits `MarkdownRenderer.arender`,
+which converts in worker threads with reused Markdown instances, and
+"cached" renders the same reports again. A probe task measures how long
+the loop is blocked, which is what every other request would see.
+
+    python benchmarks/bench_render.py --reports 20 --words 3000
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import markdown
+
+import stubs  # noqa: F401  (puts the repo on sys.path)
+from ra_render import EXTENSIONS, MarkdownRenderer
+
+
+def make_report(n: int, words: int) -> str:
+    rng = random.Random(n)
+    parts = [f"# Report {n}"]
+    while sum(len(p.split()) for p in parts) < words:
+        section = len(parts)
+        body = " ".join(rng.choice(("growth", "**rate**", "`code`", "data", "value", "study")) for _ in range(80))
+        parts.append(f"## Section {section}\n\n{body}\n\n| metric | value |\n|---|---|\n| a | {section} |\n\n"
+                     f"- first point\n- second point\n\n```\nexample {section}\n```")
+    return "\n\n".join(parts)
+
+
+async def probe_loop(stop: asyncio.Event, lags: list, interval: float = 0.005):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def run(name: str, render, reports):
+    stop = asyncio.Event()
+    lags = []
+    probe = asyncio.create_task(probe_loop(stop, lags))
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    await asyncio.gather(*(render(r) for r in reports))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+    print(f"{name:>9}: {len(reports)} reports in {elapsed * 1000:8.1f} ms  "
+          f"max loop stall {max(lags) * 1000:7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reports", type=int, default=20)
+    parser.add_argument("--words", type=int, default=3000)
+    args = parser.parse_args()
+
+    reports = [make_report(n, args.words) for n in range(args.reports)]
+    renderer = MarkdownRenderer()
+
+    async def inline(text):
+        return markdown.markdown(text, extensions=list(EXTENSIONS))
+
+    async def main_async():
+        await run("inline", inline, reports)
+        await run("renderer", renderer.arender, reports)
+        await run("cached", renderer.arender, reports)
+
+    asyncio.run(main_async())
+    renderer.shutdown()
+    print(f"renderer: {renderer.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Cost of retrying a failed sectioned report, with and without checkpoints.
+
+The fake model fails the last section of the plan once, after the other
+sections are written. The report is then retried: without a thread id the
+whole graph runs again, with one the checkpointed run is resumed. Prints
+model calls and wall-clock time of each retry.
+
+    python benchmarks/bench_resume.py --sections 8 --model-latency 0.5
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import stubs
+import ra_langgraph
+from ra_langgraph import AdaptiveLimiter, arun_report
+
+
+class FlakyChatModel(stubs.FakeChatModel):
+    """Fails the section named `fail_section` once, after twice the usual latency"""
+
+    fail_section: str = ""
+    calls: int = 0
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        if self.fail_section and self.fail_section in messages[-1].content:
+            self.fail_section = ""
+            await asyncio.sleep(self.latency * 2)
+            raise RuntimeError("section failed")
+        return await super()._agenerate(messages, stop, run_manager, **kwargs)
+
+    def with_structured_output(self, schema, **kwargs):
+        planner = super().with_structured_output(schema, **kwargs)
+
+        def count(x):
+            self.calls += 1
+            return x
+
+        return count | planner
+
+
+async def retry(sections, latency, thread_id):
+    model = FlakyChatModel(latency=latency, sections=sections, fail_section=f"Section {sections} ")
+    limiter = AdaptiveLimiter(initial=sections, maximum=sections)
+    try:
+        await arun_report("Benchmark topic", model, limiter, thread_id=thread_id)
+    except RuntimeError:
+        pass
+    model.calls = 0
+    start = time.perf_counter()
+    await arun_report("Benchmark topic", model, limiter, thread_id=thread_id)
+    return model.calls, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", type=int, default=8)
+    parser.add_argument("--model-latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    ra_langgraph.MAX_SECTIONS = args.sections
+    with tempfile.TemporaryDirectory() as tmp:
+        ra_langgraph.CHECKPOINT_DB = os.path.join(tmp, "checkpoints.sqlite3")
+        for name, thread_id in (("rerun", None), ("resume", "bench")):
+            calls, elapsed = asyncio.run(retry(args.sections, args.model_latency, thread_id))
+            print(f"{name:>6}: {calls:3d} model calls  {elapsed:6.2f}s")
+
+
+if __name__ == "__main__":
+    main()
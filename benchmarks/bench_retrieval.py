@@ -0,0 +1,86 @@
+"""Relevance and cost of chunk retrieval against plain truncation.
+
+Builds long synthetic pages where the facts that answer the question sit
+at a random depth among filler paragraphs, then compares what reaches the
+summarizer with the old `text[:5000]` truncation and with
+`ChunkIndex.select`: how many answer facts are included, and how long
+embedding a page takes cold and when its vectors are reused.
+
+    python benchmarks/bench_retrieval.py --pages 50 --page-chars 40000
+"""
+import argparse
+import random
+import tempfile
+import time
+
+import stubs  # noqa: F401  (puts the repo on sys.path)
+from ra_cache import TieredCache
+from ra_retrieval import ChunkIndex
+
+QUESTION = "What battery capacity and charging speed does the new electric truck have?"
+FACTS = [
+    "The new electric truck has a battery capacity of 210 kWh.",
+    "Its charging speed reaches 350 kW, adding 200 miles of range in 20 minutes.",
+    "The truck battery retains 90% capacity after 1,500 charging cycles.",
+]
+FILLER = [
+    "The company was founded in {n} and has offices in several countries.",
+    "Readers can subscribe to the newsletter for weekly updates on industry events.",
+    "The annual conference in year {n} featured talks on logistics and supply chains.",
+    "Weather conditions affected regional shipping routes during quarter {n}.",
+    "The design team interviewed {n} drivers about cabin comfort and seating.",
+]
+
+
+def make_page(rng, chars):
+    sentences = []
+    size = 0
+    while size < chars:
+        sentence = rng.choice(FILLER).format(n=rng.randint(1900, 2024))
+        sentences.append(sentence)
+        size += len(sentence) + 1
+    position = rng.randint(len(sentences) // 4, len(sentences) - 1)
+    sentences[position:position] = FACTS
+    return " ".join(sentences)
+
+
+def facts_found(text):
+    return sum(fact in text for fact in FACTS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--page-chars", type=int, default=40000)
+    parser.add_argument("--budget", type=int, default=5000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    pages = [(f"https://example.test/{i}", make_page(rng, args.page_chars)) for i in range(args.pages)]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        index = ChunkIndex(cache=TieredCache("chunks", cache_dir=cache_dir))
+
+        truncated = sum(facts_found(text[: args.budget]) for _, text in pages)
+
+        start = time.perf_counter()
+        selected = [index.select(QUESTION, url, text, args.budget) for url, text in pages]
+        cold = time.perf_counter() - start
+        retrieved = sum(facts_found(text) for text in selected)
+
+        start = time.perf_counter()
+        for url, text in pages:
+            index.select(QUESTION, url, text, args.budget)
+        warm = time.perf_counter() - start
+
+        total = len(FACTS) * len(pages)
+        print(f"{args.pages} pages of {args.page_chars} chars, budget {args.budget} chars, "
+              f"embedder {index.embedder.name}")
+        print(f"truncation: {truncated:4d}/{total} answer facts reach the summarizer")
+        print(f" retrieval: {retrieved:4d}/{total} answer facts reach the summarizer")
+        print(f"cold: {cold / len(pages) * 1000:7.2f} ms/page "
+              f"({index.chunks_embedded / cold:8.0f} chunks/s embedded)")
+        print(f"warm: {warm / len(pages) * 1000:7.2f} ms/page (vectors reused)")
+
+
+if __name__ == "__main__":
+    main()
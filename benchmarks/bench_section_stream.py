@@ -0,0 +1,79 @@
+"""When streamed sectioned reports become visible.
+
+Sections take a random time to write, so they finish out of order.
+`astream_report` sends each section once every section before it in the
+plan is done; before that the client got the whole report only after the
+slowest section. Prints when the first section, half the report and the
+full report reached the client, and checks the streamed text is the
+report in plan order.
+
+    python benchmarks/bench_section_stream.py --sections 8 --runs 5
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import stubs
+import ra_langgraph
+from ra_langgraph import AdaptiveLimiter, astream_report
+
+
+class VariableLatencyModel(stubs.FakeChatModel):
+    """Each section takes a random time between `latency` and `max_latency`"""
+
+    max_latency: float = 2.0
+    seed: int = 0
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = messages[-1].content
+        await asyncio.sleep(random.Random(f"{self.seed}:{prompt}").uniform(self.latency, self.max_latency))
+        return self._respond(messages)
+
+    def _respond(self, messages):
+        result = super()._respond(messages)
+        # Label the text so the order can be checked
+        result.generations[0].message.content = messages[-1].content.split(" and ")[0]
+        return result
+
+
+async def run(sections, seed, min_latency, max_latency):
+    model = VariableLatencyModel(latency=min_latency, max_latency=max_latency, sections=sections, seed=seed)
+    limiter = AdaptiveLimiter(initial=sections, maximum=sections)
+    start = time.perf_counter()
+    arrivals = []
+    text = ""
+    async for event, data in astream_report("Benchmark topic", model, limiter):
+        if event == "token":
+            text += data["text"]
+            arrivals.append(time.perf_counter() - start)
+    expected = ra_langgraph.SECTION_SEPARATOR.join(
+        f"Here is the section name: Section {i + 1}" for i in range(sections)
+    )
+    assert text == expected, "sections streamed out of plan order"
+    return arrivals[0], arrivals[(len(arrivals) - 1) // 2], arrivals[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", type=int, default=8)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--min-latency", type=float, default=0.2)
+    parser.add_argument("--max-latency", type=float, default=2.0)
+    args = parser.parse_args()
+
+    ra_langgraph.MAX_SECTIONS = args.sections
+    results = [
+        asyncio.run(run(args.sections, seed, args.min_latency, args.max_latency))
+        for seed in range(args.runs)
+    ]
+    first, half, full = (statistics.mean(r[i] for r in results) for i in range(3))
+    print(f"{args.sections} sections, {args.min_latency}-{args.max_latency}s each, {args.runs} runs")
+    print(f"whole report at the end: first text at {full:5.2f}s")
+    print(f"    sections in order:   first section at {first:5.2f}s, "
+          f"half the report at {half:5.2f}s, all at {full:5.2f}s")
+
+
+if __name__ == "__main__":
+    main()
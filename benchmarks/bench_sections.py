@@ -0,0 +1,55 @@
+"""Wall-clock time of the sectioned report engine across section counts.
+
+Runs `ra_langgraph.arun_report` against the fake chat model for each
+section count with three section worker policies: one at a time, no limit,
+and the adaptive (AIMD) limiter. With `--rate-limit N` the fake model
+answers 429 once more than N calls are in flight, like Groq does under
+load, and the 429 count shows how much each policy hammers the backend.
+
+    python benchmarks/bench_sections.py --sections 2 4 8 12 --rate-limit 4
+"""
+import argparse
+import asyncio
+import time
+
+import stubs
+import ra_langgraph
+from ra_langgraph import AdaptiveLimiter, arun_report
+
+POLICIES = {
+    "serial": lambda: AdaptiveLimiter(initial=1, maximum=1),
+    "unbounded": lambda: AdaptiveLimiter(initial=10 ** 6, maximum=10 ** 6),
+    "adaptive": lambda: AdaptiveLimiter(),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", type=int, nargs="+", default=[2, 4, 8, 12])
+    parser.add_argument("--model-latency", type=float, default=0.5)
+    parser.add_argument("--rate-limit", type=int, default=0,
+                        help="concurrent calls the fake backend allows, 0 for no limit")
+    args = parser.parse_args()
+
+    ra_langgraph.MAX_SECTIONS = max(args.sections)
+    print(f"model latency {args.model_latency}s, "
+          f"rate limit {args.rate_limit or 'none'} concurrent calls")
+    print(f"{'sections':>8}  " + "  ".join(f"{name:>20}" for name in POLICIES))
+    for count in args.sections:
+        row = []
+        for make_limiter in POLICIES.values():
+            model = stubs.FakeChatModel(latency=args.model_latency, sections=count,
+                                        max_concurrent=args.rate_limit)
+            limiter = make_limiter()
+            start = time.perf_counter()
+            try:
+                asyncio.run(arun_report("Benchmark topic", model, limiter))
+                elapsed = f"{time.perf_counter() - start:6.2f}s"
+            except ra_langgraph.SectionFailed:
+                elapsed = "failed"
+            row.append(f"{elapsed:>8} {limiter.rate_limited:4d} x 429")
+        print(f"{count:8d}  " + "  ".join(f"{cell:>20}" for cell in row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Cold start: import time of the app and time to the first served request.
+
+"imports" runs `python -X importtime` on a fresh interpreter that loads
+research-assistant.py and sums the self time of every module it imports,
+then lists the heaviest top-level imports with their cumulative time.
+"first request" starts `python research-assistant.py` on a free port with
+an empty cache directory and polls `GET /` until it answers, which is what
+a deploy health check or a newly spawned worker waits for. The warm-up
+hook runs after startup, so it does not count towards either number.
+
+    python benchmarks/bench_startup.py --runs 5
+"""
+import argparse
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import stubs  # noqa: F401  (puts the repo on sys.path)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, "research-assistant.py")
+LOAD_APP = (
+    "import importlib.util\n"
+    f"spec = importlib.util.spec_from_file_location('research_assistant', {APP!r})\n"
+    "spec.loader.exec_module(importlib.util.module_from_spec(spec))\n"
+)
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def isolated_env(tmp: str) -> dict:
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    env.update(CACHE_DIR=tmp, JOBS_DB=os.path.join(tmp, "jobs.sqlite3"),
+               CHECKPOINT_DB=os.path.join(tmp, "checkpoints.sqlite3"))
+    return env
+
+
+def import_times(env: dict):
+    """(total seconds, [(cumulative seconds, module)] for top-level imports)"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", LOAD_APP], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    total, top = 0, []
+    for match in IMPORT_LINE.finditer(result.stderr):
+        self_us, cumulative_us, indent, module = match.groups()
+        total += int(self_us)
+        if len(indent) == 1:
+            top.append((int(cumulative_us) / 1e6, module))
+    return total / 1e6, sorted(top, reverse=True)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def first_request(env: dict, timeout: float = 60.0) -> float:
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, APP], cwd=ROOT, env=dict(env, PORT=str(port)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"server exited with {server.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.01)
+        raise TimeoutError(f"no response within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = isolated_env(tmp)
+        totals, tops = [], []
+        for _ in range(args.runs):
+            total, top = import_times(env)
+            totals.append(total)
+            tops.append(top)
+        print(f"imports: median {statistics.median(totals):.3f}s over {args.runs} runs")
+        for seconds, module in tops[totals.index(statistics.median_low(totals))][:args.top]:
+            print(f"  {seconds:6.3f}s  {module}")
+
+        starts = [first_request(env) for _ in range(args.runs)]
+        print(f"first request: median {statistics.median(starts):.3f}s "
+              f"(min {min(starts):.3f}s, max {max(starts):.3f}s)")
+
+
+if __name__ == "__main__":
+    main()
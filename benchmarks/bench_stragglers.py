@@ -0,0 +1,81 @@
+"""Report latency when one source is slow, with and without early exit.
+
+Each run searches N pages, one of which is slow: a `slow` site answers
+only after `--slow-delay` seconds, a `stalled` one does so only the first
+time it is requested, like a connection that hangs. Runs the async report
+chain under three policies:
+
+- "wait for all" waits for every summary, which is how it used to behave.
+- "quorum" writes the report once SUMMARY_QUORUM of the summaries are
+  ready and the rest had SUMMARY_GRACE more seconds.
+- "quorum + hedging" also re-fetches pages slower than the recent p95.
+
+Prints the mean and worst report latency and how many sources made it
+into the report.
+
+    python benchmarks/bench_stragglers.py --pages 10 --runs 5 --slow-delay 8
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import stubs
+
+POLICIES = {
+    "wait for all": {"SUMMARY_QUORUM": 1.0, "SUMMARY_DEADLINE": 10 ** 6, "FETCH_HEDGE": 0},
+    "quorum": {"FETCH_HEDGE": 0},
+    "quorum + hedging": {"FETCH_HEDGE": 1},
+}
+
+
+async def run(app, chain, model, search, server, kind, pages, first):
+    # Fresh URLs and question every run so no cache helps
+    search.urls = [server.url(kind, first)] + [server.url("page", first + i) for i in range(1, pages)]
+    start = time.perf_counter()
+    summaries = await chain.ainvoke(
+        {"question": f"Benchmark question {first}", "results_per_query": pages},
+        config=app.model_config(model),
+    )
+    return time.perf_counter() - start, len(summaries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--slow-delay", type=float, default=8.0)
+    parser.add_argument("--page-delay", type=float, default=0.1)
+    parser.add_argument("--model-latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["CACHE_DIR"] = tmp
+        app = stubs.load_app_module()
+        defaults = {name: getattr(app, name) for name in ("SUMMARY_QUORUM", "SUMMARY_DEADLINE", "FETCH_HEDGE")}
+        with stubs.PageServer(delay=args.page_delay, slow_delay=args.slow_delay) as server:
+            search = stubs.FakeSearch([], latency=0.0)
+            model = stubs.install_stubs(app, search, args.model_latency)
+            chain = app.get_research_search_chain()
+            print(f"{args.pages} pages, one {args.slow_delay}s straggler, "
+                  f"quorum {app.SUMMARY_QUORUM:.0%}, grace {app.SUMMARY_GRACE}s, {args.runs} runs")
+            first = 0
+            for kind, label in (("slow", "slow site"), ("flaky", "stalled")):
+                for policy, settings in POLICIES.items():
+                    for name, value in {**defaults, **settings}.items():
+                        setattr(app, name, value)
+                    results = []
+                    for _ in range(args.runs):
+                        first += args.pages
+                        results.append(asyncio.run(run(app, chain, model, search, server, kind, args.pages, first)))
+                    latencies = [r[0] for r in results]
+                    sources = statistics.mean(r[1] for r in results)
+                    print(f"{label:>9} {policy:>16}: mean {statistics.mean(latencies):6.2f}s  "
+                          f"worst {max(latencies):6.2f}s  {sources:4.1f}/{args.pages} sources")
+            print(f"hedging: {app.fetch_hedger.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Rate limits and in-flight searches across worker processes.
+
+Starts `--workers` processes that act like the app's workers, each with its
+own ra_state backend handle, for each way of sharing state:
+
+- "per process": no shared backend, how the app ran before it had one
+- "sqlite": SQLiteState on one file, the default
+- "redis stand-in": RedisState on a FakeRedis served to every process
+
+Rate limits: every process spends the budget of one API key with
+`--tasks` concurrent calls of `--tokens` tokens for `--seconds` seconds,
+with a limit of `--tpm` tokens per minute and a minute of `--minute`
+seconds. Prints the tokens granted as a share of what the key allows in
+that time (the full bucket plus the refill): more than 100% is what Groq
+would answer with 429s.
+
+Searches: every process searches the same `--queries` queries at once,
+through the search cache and SingleFlight like the app, against a search
+that takes `--search-latency` seconds. Prints the upstream searches made.
+
+    python benchmarks/bench_workers.py --workers 4
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+
+import stubs
+from ra_cache import SingleFlight, TieredCache, make_key
+from ra_ratelimit import RateLimitScheduler
+from ra_state import RedisState, SQLiteState
+
+
+def open_backend(kind: str, tmp: str, redis_server):
+    if kind == "sqlite":
+        return SQLiteState(os.path.join(tmp, "state.sqlite3"))
+    if kind == "redis stand-in":
+        return RedisState(redis_server.connect())
+    return None
+
+
+async def spend(state, args) -> int:
+    budget = RateLimitScheduler(tpm=args.tpm, rpm=10 ** 6, minute=args.minute, state=state) \
+        .get("benchmark-key").budget("benchmark-model")
+    deadline = time.monotonic() + args.seconds
+    granted = 0
+
+    async def task():
+        nonlocal granted
+        while True:
+            # A grant that comes after the deadline no longer counts
+            await budget.acquire(args.tokens)
+            if time.monotonic() >= deadline:
+                return
+            granted += args.tokens
+
+    tasks = [asyncio.create_task(task()) for _ in range(args.tasks)]
+    await asyncio.sleep(args.seconds)
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return granted
+
+
+async def search(state, args, tmp: str, upstream) -> None:
+    cache = TieredCache("search", ttl=3600, cache_dir=tmp,
+                        shared=state if getattr(state, "distributed", False) else None)
+    flight = SingleFlight(state)
+
+    def upstream_search(query):
+        with upstream.get_lock():
+            upstream.value += 1
+        time.sleep(args.search_latency)
+        links = [f"https://example.com/{query}/{i}" for i in range(3)]
+        cache.set(make_key("search", query), links)
+        return links
+
+    async def one(query):
+        key = make_key("search", query)
+        cached = await cache.aget(key)
+        if cached is not None:
+            return cached
+        return await flight.do(key, lambda: asyncio.to_thread(upstream_search, query), lambda: cache.aget(key))
+
+    await asyncio.gather(*(one(f"query {i}") for i in range(args.queries)))
+
+
+def worker(kind, tmp, redis_server, args, barrier, granted, upstream):
+    state = open_backend(kind, tmp, redis_server)
+    barrier.wait()
+    tokens = asyncio.run(spend(state, args))
+    with granted.get_lock():
+        granted.value += tokens
+    barrier.wait()
+    asyncio.run(search(state, args, tmp, upstream))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--tasks", type=int, default=4)
+    parser.add_argument("--tokens", type=int, default=500)
+    parser.add_argument("--tpm", type=float, default=6000)
+    parser.add_argument("--minute", type=float, default=2.0, help="seconds in a rate limit minute")
+    parser.add_argument("--seconds", type=float, default=4.0)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--search-latency", type=float, default=0.3)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("fork")
+    allowed = args.tpm + args.tpm * args.seconds / args.minute
+    with stubs.RedisStandIn() as redis_server:
+        for kind in ("per process", "sqlite", "redis stand-in"):
+            with tempfile.TemporaryDirectory() as tmp:
+                barrier = context.Barrier(args.workers)
+                granted = context.Value("q", 0)
+                upstream = context.Value("i", 0)
+                processes = [context.Process(target=worker, args=(kind, tmp, redis_server, args, barrier,
+                                                                  granted, upstream))
+                             for _ in range(args.workers)]
+                for p in processes:
+                    p.start()
+                for p in processes:
+                    p.join()
+                print(f"{kind:>14}: {granted.value:7d} tokens granted, {granted.value / allowed:5.0%} of the limit  "
+                      f"{upstream.value:3d} upstream searches for {args.queries} queries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""Replay a recorded workload against the app with stubbed backends.
+
+Starts the FastAPI app under uvicorn on a local port with DuckDuckGo, the
+scraped websites and Groq replaced by the stand-ins in `stubs`, replays
+the workload and reports latency percentiles, throughput and memory.
+Caches, jobs and checkpoints live in a temporary directory, so every run
+starts cold.
+
+Each workload line is a JSON object with a `question` (or a `title`, so
+the repo's requests.jsonl works too) and optionally `engine`, `fresh`,
+`num_queries`, `results_per_query` and `mode`: `stream` posts to
+/research/stream and reads the SSE stream to the end, `job` submits to
+/research and waits on /jobs/{id}.
+
+Use it as a pre-deploy check by saving a baseline and comparing against it:
+
+    python benchmarks/replay.py --save baseline.json
+    python benchmarks/replay.py --baseline baseline.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import stubs
+
+DEFAULT_WORKLOAD = os.path.join(os.path.dirname(__file__), "data", "workload.jsonl")
+
+
+def load_workload(path, repeat):
+    with open(path, encoding="utf-8") as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    workload = []
+    for item in items:
+        question = item.get("question") or item.get("title")
+        if question:
+            workload.append({**item, "question": question})
+    return workload * repeat
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class AppServer:
+    """Runs the app under uvicorn in a background thread"""
+
+    def __init__(self, app):
+        import uvicorn
+
+        self.socket = socket.socket()
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(("127.0.0.1", 0))
+        self.server = uvicorn.Server(uvicorn.Config(app, log_level="warning", lifespan="on"))
+        self.thread = threading.Thread(target=self.server.run, kwargs={"sockets": [self.socket]}, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.socket.getsockname()
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def request_form(item):
+    form = {"question": item["question"]}
+    for name in ("engine", "num_queries", "results_per_query", "fresh"):
+        if name in item:
+            form[name] = str(item[name])
+    return form
+
+
+async def run_stream(client, item):
+    """Returns (seconds to first report text, error)"""
+    start = time.perf_counter()
+    first_token = None
+    error = None
+    async with client.stream("POST", "/research/stream", data=request_form(item)) as response:
+        if response.status_code != 200:
+            return None, f"HTTP {response.status_code}"
+        event = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: "):
+                if event == "token" and first_token is None:
+                    first_token = time.perf_counter() - start
+                elif event == "error":
+                    error = json.loads(line[6:])["message"]
+    return first_token, error
+
+
+async def run_job(client, item):
+    response = await client.post("/research", data=request_form(item), headers={"Accept": "application/json"})
+    if response.status_code != 202:
+        return None, f"HTTP {response.status_code}"
+    status_url = response.json()["status_url"]
+    while True:
+        job = (await client.get(status_url, params={"wait": 30})).json()
+        if job["status"] == "done":
+            return None, None
+        if job["status"] == "failed":
+            return None, job["error"]
+
+
+async def replay(base_url, workload, concurrency, default_mode):
+    import httpx
+
+    queue = asyncio.Queue()
+    for item in workload:
+        queue.put_nowait(item)
+    results = []
+
+    async def user(n):
+        limits = httpx.Limits(max_connections=4)
+        async with httpx.AsyncClient(base_url=base_url, timeout=None, limits=limits) as client:
+            await client.post("/api-key", data={"api_key": f"replay-user-{n}"})
+            while not queue.empty():
+                item = queue.get_nowait()
+                mode = item.get("mode", default_mode)
+                start = time.perf_counter()
+                try:
+                    runner = run_stream if mode == "stream" else run_job
+                    first_token, error = await runner(client, item)
+                except Exception as e:
+                    first_token, error = None, repr(e)
+                results.append({"mode": mode, "seconds": time.perf_counter() - start,
+                                "first_token": first_token, "error": error})
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(n) for n in range(concurrency)))
+    return results, time.perf_counter() - start
+
+
+def summarize(results, elapsed, rss_before):
+    # Not at the top: ra_jobs reads CACHE_DIR when imported, main sets it first
+    from ra_jobs import percentile
+
+    ok = [r for r in results if not r["error"]]
+    latencies = sorted(r["seconds"] for r in ok) or [0.0]
+    first_tokens = sorted(r["first_token"] for r in ok if r["first_token"] is not None) or [0.0]
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "throughput": len(ok) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "first_token_p50": percentile(first_tokens, 0.50),
+        "first_token_p95": percentile(first_tokens, 0.95),
+        "rss_before_mb": rss_before,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def compare(summary, baseline, tolerance):
+    """Names of the numbers that got worse than `baseline` by more than `tolerance`"""
+    regressions = []
+    for name in ("p50", "p95", "p99"):
+        if baseline.get(name) and summary[name] > baseline[name] * (1 + tolerance):
+            regressions.append(f"{name} {baseline[name]:.3f}s -> {summary[name]:.3f}s")
+    if baseline.get("throughput") and summary["throughput"] < baseline["throughput"] * (1 - tolerance):
+        regressions.append(f"throughput {baseline['throughput']:.2f} -> {summary['throughput']:.2f} req/s")
+    if summary["errors"] > baseline.get("errors", 0):
+        regressions.append(f"errors {baseline.get('errors', 0)} -> {summary['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workload", default=DEFAULT_WORKLOAD)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=8, help="simulated users")
+    parser.add_argument("--mode", choices=("stream", "job"), default="stream",
+                        help="for workload lines without a mode")
+    parser.add_argument("--pages-dir", help="directory of recorded .html pages to serve")
+    parser.add_argument("--urls", type=int, default=30, help="distinct pages the fake search returns")
+    parser.add_argument("--search-latency", type=float, default=0.3)
+    parser.add_argument("--page-delay", type=float, default=0.1)
+    parser.add_argument("--model-latency", type=float, default=0.3, help="seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=400)
+    parser.add_argument("--response-tokens", type=int, default=300)
+    parser.add_argument("--save", help="write the summary to this JSON file")
+    parser.add_argument("--baseline", help="JSON summary of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    workload = load_workload(args.workload, args.repeat)
+    if not workload:
+        parser.error(f"no questions in {args.workload}")
+    pages = stubs.load_pages(args.pages_dir) if args.pages_dir else None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Must be set before the app modules are imported
+        os.environ["CACHE_DIR"] = tmp
+        os.environ["JOBS_DB"] = os.path.join(tmp, "jobs.sqlite3")
+        os.environ["CHECKPOINT_DB"] = os.path.join(tmp, "checkpoints.sqlite3")
+        app = stubs.load_app_module()
+        with stubs.PageServer(delay=args.page_delay, pages=pages) as page_server:
+            urls = [page_server.url("page", n) for n in range(args.urls)]
+            search = stubs.FakeSearch(urls, latency=args.search_latency, spread=True)
+            response = " ".join(f"word{i}" for i in range(args.response_tokens))
+            stubs.install_stubs(app, search, args.model_latency, response, args.tokens_per_second)
+            rss_before = peak_rss_mb()
+            with AppServer(app.app) as server:
+                results, elapsed = asyncio.run(replay(server.base_url, workload, args.concurrency, args.mode))
+            summary = summarize(results, elapsed, rss_before)
+            summary["bytes_served"] = page_server.bytes_sent
+
+    print(f"{summary['requests']} requests, {args.concurrency} users, {elapsed:.2f}s, "
+          f"{summary['errors']} errors")
+    print(f"latency     p50 {summary['p50']:7.3f}s  p95 {summary['p95']:7.3f}s  p99 {summary['p99']:7.3f}s")
+    print(f"first token p50 {summary['first_token_p50']:7.3f}s  p95 {summary['first_token_p95']:7.3f}s")
+    print(f"throughput  {summary['throughput']:.2f} req/s")
+    print(f"memory      peak RSS {summary['peak_rss_mb']:.0f} MB (startup {summary['rss_before_mb']:.0f} MB)")
+    for error in sorted({r["error"] for r in results if r["error"]})[:5]:
+        print(f"error: {error}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(summary, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(summary, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,442 @@
+"""Local stand-ins for DuckDuckGo, the scraped websites and Groq.
+
+The benchmarks swap these in so they can run offline and give repeatable
+numbers.
+"""
+import asyncio
+import functools
+import importlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+from pydantic import PrivateAttr
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+def load_app_module():
+    """Import research-assistant.py the same way uvicorn does"""
+    # The app mounts ./static, which is not tracked in git
+    os.makedirs(os.path.join(ROOT_DIR, "static"), exist_ok=True)
+    return importlib.import_module("research-assistant")
+
+
+class FakeRateLimitError(Exception):
+    status_code = 429
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that sleeps for `latency` seconds and returns `response`.
+
+    With `tokens_per_second` set, the response (one token per word) also
+    takes as long as generating it at that rate would, and streams at that
+    rate. Responses carry usage metadata with the prompt size estimated at
+    4 characters per token.
+
+    Prompts asking for search queries get a JSON list of queries instead,
+    batched summary prompts get `response` for every page, and
+    `with_structured_output` parses those or plans a report of `sections`
+    sections.
+    With `max_concurrent` set, calls beyond that many in flight fail with
+    a 429 like Groq's rate limiter.
+    """
+
+    model_name: str = "fake-chat"
+    latency: float = 0.05
+    response: str = "This is a fake answer with some facts and numbers: 42."
+    tokens_per_second: float = 0.0
+    sections: int = 5
+    max_concurrent: int = 0
+    _in_flight: int = PrivateAttr(default=0)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    @property
+    def _identifying_params(self):
+        return {"model_name": self.model_name}
+
+    def _content(self, messages) -> str:
+        prompt = messages[-1].content if messages else ""
+        if "google search queries" in prompt:
+            return json.dumps([f"generated query {i}" for i in range(5)])
+        if '<page id="' in prompt:
+            return self._page_summaries(prompt)
+        return self.response
+
+    def _page_summaries(self, prompt: str, summary: Optional[str] = None) -> str:
+        """JSON answer to a batched summary prompt with `summary` (default `response`) for every page"""
+        pages = re.findall(r'<page id="(\d+)">', prompt)
+        return json.dumps({"summaries": [{"page": int(n), "summary": summary or self.response} for n in pages]})
+
+    def _usage(self, messages, content: str) -> dict:
+        prompt_tokens = sum(len(str(m.content)) for m in messages) // 4
+        completion_tokens = len(content.split())
+        return {"input_tokens": prompt_tokens, "output_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    def _generation_time(self, content: str) -> float:
+        if not self.tokens_per_second:
+            return self.latency
+        return self.latency + len(content.split()) / self.tokens_per_second
+
+    def _respond(self, messages) -> ChatResult:
+        content = self._content(messages)
+        message = AIMessage(content=content, usage_metadata=self._usage(messages, content))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._generation_time(self._content(messages)))
+        return self._respond(messages)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        content = self._content(messages)
+        await asyncio.sleep(self.latency)
+        for i, word in enumerate(content.split(" ")):
+            if i and self.tokens_per_second:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=" " + word if i else word))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, content)))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.max_concurrent and self._in_flight >= self.max_concurrent:
+            await asyncio.sleep(0.01)
+            raise FakeRateLimitError("Rate limit reached")
+        self._in_flight += 1
+        try:
+            await asyncio.sleep(self._generation_time(self._content(messages)))
+        finally:
+            self._in_flight -= 1
+        return self._respond(messages)
+
+    def with_structured_output(self, schema, include_raw: bool = False, **kwargs):
+        if "sections" not in schema.model_fields:
+            def parse(message):
+                parsed = schema.model_validate_json(message.content)
+                return {"raw": message, "parsed": parsed, "parsing_error": None} if include_raw else parsed
+
+            return self | RunnableLambda(parse)
+
+        async def plan(_):
+            await asyncio.sleep(self.latency)
+            return schema(sections=[
+                {"name": f"Section {i + 1}", "description": f"Part {i + 1} of the report."}
+                for i in range(self.sections)
+            ])
+
+        return RunnableLambda(lambda x: asyncio.run(plan(x)), afunc=plan)
+
+
+class FakeSearch:
+    """Drop-in for DuckDuckGoSearchAPIWrapper.results.
+
+    With `spread`, each query gets its own window of `urls` (shifted by a
+    hash of the query) so different queries overlap only partly.
+    """
+
+    def __init__(self, urls: List[str], latency: float = 0.05, spread: bool = False):
+        self.urls = urls
+        self.latency = latency
+        self.spread = spread
+        self.calls = 0
+
+    def results(self, query: str, max_results: int, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        urls = self.urls
+        if self.spread and urls:
+            offset = sum(query.encode()) % len(urls)
+            urls = urls[offset:] + urls[:offset]
+        return [{"link": u, "title": u, "snippet": query} for u in urls[:max_results]]
+
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html><head><title>Page {n}</title><script>var x = {n};</script></head>
+<body><nav>Home | About</nav><article><h1>Page {n}</h1>{body}</article>
+<footer>Copyright</footer></body></html>"""
+
+
+@functools.lru_cache(maxsize=256)
+def make_page(n: int, paragraphs: int = 20) -> bytes:
+    body = "".join(
+        f"<p>Paragraph {i} of page {n} has a fact: value {i * n} grew by {i}%.</p>"
+        for i in range(paragraphs)
+    )
+    return PAGE_TEMPLATE.format(n=n, body=body).encode()
+
+
+def load_pages(path: str) -> List[bytes]:
+    """Saved .html pages from a directory, in name order"""
+    pages = []
+    for name in sorted(os.listdir(path)):
+        if name.endswith((".html", ".htm")):
+            with open(os.path.join(path, name), "rb") as f:
+                pages.append(f.read())
+    return pages
+
+
+class PageServer:
+    """Threaded local HTTP server.
+
+    `/page/<n>` serves a small article, `/slow/<n>` waits `slow_delay` seconds
+    first, `/flaky/<n>` does so only the first time it is requested, like a
+    stalled connection, and `/large/<n>` serves roughly `large_bytes` of HTML. Given
+    `pages`, a list of recorded HTML pages, `/page/<n>` serves page n
+    (modulo their number) instead.
+    """
+
+    def __init__(self, delay: float = 0.0, slow_delay: float = 2.0, large_bytes: int = 5_000_000,
+                 pages: Optional[List[bytes]] = None):
+        self.delay = delay
+        self.slow_delay = slow_delay
+        self.large_bytes = large_bytes
+        self.pages = pages
+        self.requests = 0
+        self.bytes_sent = 0
+        self._flaky_seen = set()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server.requests += 1
+                kind, _, n = self.path.strip("/").partition("/")
+                n = int(n or 0)
+                if kind == "flaky" and n not in server._flaky_seen:
+                    server._flaky_seen.add(n)
+                    time.sleep(server.slow_delay)
+                elif kind == "slow":
+                    time.sleep(server.slow_delay)
+                elif server.delay:
+                    time.sleep(server.delay)
+                if kind == "large":
+                    body = make_page(n, paragraphs=max(1, server.large_bytes // 80))
+                elif kind == "page" and server.pages:
+                    body = server.pages[n % len(server.pages)]
+                elif kind in ("page", "slow", "flaky"):
+                    body = make_page(n)
+                else:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                    server.bytes_sent += len(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            # the default listen backlog of 5 drops bursts of connections
+            request_queue_size = 256
+
+        self.httpd = Server(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, kind: str, n: int) -> str:
+        return f"{self.base_url}/{kind}/{n}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeGroqServer:
+    """OpenAI-compatible chat completions endpoint that counts TCP connections.
+
+    Point ChatGroq at it with GROQ_API_BASE=server.base_url.
+    """
+
+    def __init__(self, latency: float = 0.05, response: str = "Fake completion."):
+        self.latency = latency
+        self.response = response
+        self.requests = 0
+        self.connections = set()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                server.requests += 1
+                server.connections.add(self.client_address)
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                time.sleep(server.latency)
+                body = json.dumps({
+                    "id": f"chatcmpl-{server.requests}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "fake"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": server.response},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 256
+
+        self.httpd = Server(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeRedis:
+    """The redis-py commands ra_state.RedisState uses, on a dict"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+        self.commands = 0
+
+    def _live(self, name, now):
+        item = self._data.get(name)
+        if item is not None and item[1] is not None and item[1] <= now:
+            del self._data[name]
+            return None
+        return item
+
+    def get(self, name):
+        with self._lock:
+            self.commands += 1
+            item = self._live(name, time.time())
+        return item[0] if item is not None else None
+
+    def set(self, name, value, px=None, nx=False):
+        now = time.time()
+        with self._lock:
+            self.commands += 1
+            if nx and self._live(name, now) is not None:
+                return None
+            value = value if isinstance(value, bytes) else str(value).encode()
+            self._data[name] = (value, now + px / 1000 if px else None)
+            return True
+
+    def delete(self, *names):
+        with self._lock:
+            self.commands += 1
+            return sum(self._data.pop(name, None) is not None for name in names)
+
+    def scan_iter(self, match="*"):
+        import fnmatch
+        with self._lock:
+            self.commands += 1
+            # A list, not a generator, so it also works through RedisStandIn
+            return [name for name in self._data if fnmatch.fnmatchcase(name, match)]
+
+
+_fake_redis = None
+
+
+def _serve_fake_redis():
+    global _fake_redis
+    if _fake_redis is None:
+        _fake_redis = FakeRedis()
+    return _fake_redis
+
+
+class RedisStandIn:
+    """One `FakeRedis` served to several processes, in place of a Redis server.
+
+    `connect()` in any process, also forked ones, returns a client that
+    RedisState accepts.
+    """
+
+    def __init__(self):
+        from multiprocessing.managers import BaseManager
+
+        class Manager(BaseManager):
+            pass
+
+        Manager.register("redis", callable=_serve_fake_redis)
+        self._manager_class = Manager
+        self._manager = Manager(address=("127.0.0.1", 0), authkey=b"stand-in")
+
+    def connect(self):
+        manager = self._manager_class(address=self._manager.address, authkey=b"stand-in")
+        manager.connect()
+        return manager.redis()
+
+    def __enter__(self):
+        self._manager.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._manager.shutdown()
+
+
+def paid_tier_limits(module, rpm: float = 1000, tpm: float = 300_000):
+    """The fake models have no rate limit of their own, so give the app's
+    scheduler a paid Groq tier's budget instead of the free tier's"""
+    from ra_ratelimit import RateLimitScheduler
+    module.rate_limiter = RateLimitScheduler(rpm=rpm, tpm=tpm, state=module.shared_state)
+
+
+def install_stubs(module, search: FakeSearch, model_latency: float = 0.05,
+                  response: Optional[str] = None, tokens_per_second: float = 0.0):
+    """Point the app module at the fakes and return the fake chat model"""
+    module.ddg_search = search
+    model = FakeChatModel(latency=model_latency, tokens_per_second=tokens_per_second)
+    if response is not None:
+        model.response = response
+    module.get_model = lambda api_key, settings=None, http_client=None: model
+    paid_tier_limits(module)
+    return model
@@ -0,0 +1,27 @@
+"""Gunicorn settings for running the app in several worker processes.
+
+    gunicorn research-assistant:app -c gunicorn.conf.py
+
+WEB_CONCURRENCY sets the number of workers, one per CPU by default. The
+workers share the session secret, rate limits, in-flight searches, caches
+and job store through ra_state and the SQLite files in CACHE_DIR; set
+SESSION_SECRET so sessions also survive a new deploy, and STATE_URL to a
+Redis server to share them between nodes. `uvicorn research-assistant:app
+--workers N` works too, without gunicorn's restarting of failed workers.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn_worker.UvicornWorker"
+# Every worker imports the app itself: forking after the import would
+# share the SQLite connections the modules open between processes
+preload_app = False
+# How long a worker may go without checking in, not a request timeout;
+# reports stream for longer than this
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+# Render terminates TLS in front of the app
+forwarded_allow_ips = "*"
@@ -0,0 +1,166 @@
+"""Summarize several pages in one chat model call.
+
+Each per-page summary call repeats the question and the prompt and pays a
+full round trip to the model, which for short page excerpts is most of its
+cost. `SummaryBatcher` collects pages as their scrapes finish and sends
+them as one structured output call that returns a summary per page. A
+batch holds at most SUMMARY_BATCH_PAGES pages and SUMMARY_BATCH_TOKENS
+tokens of page text, and is sent once it is full, once every page of the
+request has arrived, or SUMMARY_BATCH_LINGER seconds after its first page
+so one slow site does not hold up the rest. Pages bigger than half the
+token budget, pages the model leaves out of its answer and pages of a
+batch whose call fails get one call each, like without batching.
+
+Batching trades latency for calls: one answer with four summaries takes
+longer to generate than four answers in parallel, so it is off by default.
+Turn it on with SUMMARY_BATCH=1 when requests per minute are what runs out
+first, as with Groq's free tier.
+"""
+import asyncio
+import logging
+import os
+from typing import List
+
+from pydantic import BaseModel, Field
+
+from ra_context import count_tokens
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_BATCH = int(os.environ.get("SUMMARY_BATCH", 0))
+SUMMARY_BATCH_PAGES = int(os.environ.get("SUMMARY_BATCH_PAGES", 4))
+SUMMARY_BATCH_TOKENS = int(os.environ.get("SUMMARY_BATCH_TOKENS", 6000))
+SUMMARY_BATCH_LINGER = float(os.environ.get("SUMMARY_BATCH_LINGER", 0.5))
+
+BATCH_TEMPLATE = """{pages}
+-----------
+Above are {count} web pages, each between <page id="..."> and </page>. For every page, answer in short the following question using only the text of that page:
+> {question}
+-----------
+If the question cannot be answered using a page, simply summarize that page. Include all factual information, numbers, stats etc if available. Return one summary for every page id."""
+
+batch_stats = {"batches": 0, "pages": 0, "fallbacks": 0, "failed": 0}
+
+
+class PageSummary(BaseModel):
+    page: int = Field(description="The id of the page.")
+    summary: str = Field(description="The answer or summary for this page.")
+
+
+class PageSummaries(BaseModel):
+    summaries: List[PageSummary] = Field(description="One summary for every page.")
+
+
+def format_pages(pages) -> str:
+    return "\n\n".join(f'<page id="{i}">\n{x["context"]}\n</page>' for i, x in enumerate(pages, 1))
+
+
+def match_summaries(parsed: PageSummaries, count: int) -> list:
+    """Summaries in page order, None for pages the model left out"""
+    summaries = [None] * count
+    for item in getattr(parsed, "summaries", None) or ():
+        if 1 <= item.page <= count and item.summary.strip():
+            summaries[item.page - 1] = item.summary
+    return summaries
+
+
+class SummaryBatcher:
+    """Batches the pages of one request.
+
+    `summarize_batch(pages)` returns a summary or None per page and
+    `summarize_page(x)` summarizes a single page; `expected` is how many
+    pages the request has.
+    """
+
+    def __init__(self, summarize_batch, summarize_page, expected: int,
+                 max_pages: int = SUMMARY_BATCH_PAGES, max_tokens: int = SUMMARY_BATCH_TOKENS,
+                 linger: float = SUMMARY_BATCH_LINGER):
+        self.summarize_batch = summarize_batch
+        self.summarize_page = summarize_page
+        self.expected = expected
+        self.max_pages = max_pages
+        self.max_tokens = max_tokens
+        self.linger = linger
+        self._pending = []
+        self._pending_tokens = 0
+        self._arrived = 0
+        self._timer = None
+        self._tasks = set()
+
+    async def summarize(self, x) -> str:
+        self._arrived += 1
+        tokens = count_tokens(x["context"])
+        if tokens > self.max_tokens // 2:
+            self._flush_if_complete()
+            batch_stats["fallbacks"] += 1
+            return await self.summarize_page(x)
+        if self._pending and self._pending_tokens + tokens > self.max_tokens:
+            self._flush()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((x, future))
+        self._pending_tokens += tokens
+        if len(self._pending) >= self.max_pages:
+            self._flush()
+        elif not self._flush_if_complete() and self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.linger, self._flush)
+        return await future
+
+    def skip(self):
+        """A page that will not be sent (its summary was cached), so the last batch need not wait for it"""
+        self._arrived += 1
+        self._flush_if_complete()
+
+    def _flush_if_complete(self) -> bool:
+        if self._arrived < self.expected:
+            return False
+        self._flush()
+        return True
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._pending_tokens = self._pending, [], 0
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        summaries = [None] * len(batch)
+        # A batch of one is cheaper as a plain per-page call
+        if len(batch) > 1:
+            try:
+                summaries = await self.summarize_batch([x for x, _ in batch])
+            except Exception:
+                logger.warning("Batched summary of %d pages failed, summarizing them one by one",
+                               len(batch), exc_info=True)
+                batch_stats["failed"] += 1
+            batch_stats["batches"] += 1
+            batch_stats["pages"] += len(batch)
+        fallbacks = []
+        for (x, future), summary in zip(batch, summaries):
+            if summary is None:
+                fallbacks.append(self._fallback(x, future))
+            elif not future.done():
+                future.set_result(summary)
+        await asyncio.gather(*fallbacks)
+
+    async def _fallback(self, x, future):
+        batch_stats["fallbacks"] += 1
+        try:
+            summary = await self.summarize_page(x)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(summary)
+
+    def close(self):
+        """Cancel batches nobody waits for any more, e.g. of dropped stragglers"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for task in list(self._tasks):
+            task.cancel()
@@ -0,0 +1,370 @@
+"""Two-level cache: an in-process LRU in front of a SQLite store.
+
+Used for extracted page text (keyed by URL), per-URL summaries (keyed by
+URL, question, prompt version and model) and search results (keyed by the
+normalized query). Entries expire after a TTL; the memory tier is bounded
+by entry count and the disk tier by total bytes, evicting least recently
+used rows first. Values must be JSON serializable. The SQLite files are
+shared by the worker processes of a node; with a Redis backend (see
+ra_state) a `StateCache` takes the place of SQLite so workers on every node
+share the entries.
+
+`SingleFlight` coalesces concurrent calls for the same key so that only
+one of them does the work, across processes when given a shared backend.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+CACHE_DIR = os.environ.get("CACHE_DIR", os.path.join(BASE_DIR, ".cache"))
+
+
+def make_key(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+class LRUCache:
+    def __init__(self, max_entries: int = 1024, ttl: float = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024, ttl: float = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.evictions = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " expires_at REAL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed_at)")
+        self._size = self._total_size()
+
+    def _total_size(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def set(self, key, value, ttl: float = None):
+        ttl = ttl if ttl is not None else self.ttl
+        now = time.time()
+        data = json.dumps(value)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, expires_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now + ttl if ttl else None, now),
+            )
+            self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        self._size = self._total_size()
+        # Evict down to 90% so we don't evict again on the very next write
+        target = int(self.max_bytes * 0.9)
+        while self._size > target:
+            rows = self._conn.execute(
+                "SELECT key, size FROM cache ORDER BY accessed_at LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            self._conn.executemany("DELETE FROM cache WHERE key = ?", [(k,) for k, _ in rows])
+            self._size -= sum(size for _, size in rows)
+            self.evictions += len(rows)
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._size = 0
+
+
+class StateCache:
+    """The second tier in a ra_state backend; the backend evicts on its own"""
+
+    def __init__(self, state, name: str, ttl: float = None):
+        self.state = state
+        self.prefix = f"cache:{name}:"
+        self.ttl = ttl
+        self.evictions = 0
+
+    def get(self, key):
+        value = self.state.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl: float = None):
+        self.state.set(self.prefix + key, json.dumps(value), ttl if ttl is not None else self.ttl)
+
+    def delete(self, key):
+        self.state.delete(self.prefix + key)
+
+    def clear(self):
+        self.state.clear(self.prefix)
+
+
+class TieredCache:
+    def __init__(
+        self,
+        name: str,
+        ttl: float = None,
+        memory_entries: int = 1024,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+        cache_dir: str = CACHE_DIR,
+        shared=None,
+    ):
+        """With a `shared` ra_state backend the second tier lives there instead of in a SQLite file"""
+        self.name = name
+        self.memory = LRUCache(max_entries=memory_entries, ttl=ttl)
+        if shared is not None:
+            self.disk = StateCache(shared, name, ttl)
+        else:
+            self.disk = SQLiteCache(os.path.join(cache_dir, f"{name}.sqlite3"),
+                                    max_bytes=max_disk_bytes, ttl=ttl)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.sets = 0
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+        value = self.disk.get(key)
+        if value is not None:
+            self.disk_hits += 1
+            self.memory.set(key, value)
+            return value
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        self.sets += 1
+        self.memory.set(key, value)
+        self.disk.set(key, value)
+
+    async def aget(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key, value):
+        await asyncio.to_thread(self.set, key, value)
+
+    def delete(self, key):
+        self.memory.delete(key)
+        self.disk.delete(key)
+
+    def clear(self):
+        self.memory.clear()
+        self.disk.clear()
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "sets": self.sets,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "memory_evictions": self.memory.evictions,
+            "disk_evictions": self.disk.evictions,
+        }
+
+
+class SingleFlight:
+    """Run at most one call per key at a time, concurrent callers share its result.
+
+    Within a process callers wait for the call's future. With a `state`
+    backend (ra_state) and a `lookup` the call also claims the key there
+    for `lease` seconds; other processes then poll `lookup`, typically the
+    cache the call fills, until the result shows up or the claim is gone.
+    """
+
+    def __init__(self, state=None, lease: float = 30.0, poll: float = 0.05):
+        self.state = state
+        self.lease = lease
+        self.poll = poll
+        self._calls = {}
+        self._sync_calls = {}
+        self._lock = threading.Lock()
+        self._owner = uuid.uuid4().hex
+        self.coalesced = 0
+        self.shared_coalesced = 0
+
+    def _claim(self, key) -> bool:
+        return self.state.add(f"flight:{key}", self._owner, self.lease)
+
+    def _claimed(self, key) -> bool:
+        return self.state.get(f"flight:{key}") is not None
+
+    def _release(self, key):
+        self.state.delete(f"flight:{key}")
+
+    async def _shared(self, key, fn, lookup):
+        """Run `fn` once across processes, or return what `lookup` finds after another process ran it"""
+        waited = False
+        while not await asyncio.to_thread(self._claim, key):
+            if not waited:
+                waited = True
+                self.shared_coalesced += 1
+            while await asyncio.to_thread(self._claimed, key):
+                await asyncio.sleep(self.poll)
+            # Done or given up: it is in the cache, or we try to claim it
+            value = await lookup()
+            if value is not None:
+                return value
+        try:
+            # Another process may have finished it between our cache miss and the claim
+            value = await lookup()
+            return value if value is not None else await fn()
+        finally:
+            await asyncio.to_thread(self._release, key)
+
+    def _shared_sync(self, key, fn, lookup):
+        waited = False
+        while not self._claim(key):
+            if not waited:
+                waited = True
+                self.shared_coalesced += 1
+            while self._claimed(key):
+                time.sleep(self.poll)
+            value = lookup()
+            if value is not None:
+                return value
+        try:
+            value = lookup()
+            return value if value is not None else fn()
+        finally:
+            self._release(key)
+
+    async def do(self, key, fn, lookup=None):
+        """`fn` and `lookup` are zero-argument coroutine functions.
+
+        The call runs in a task of its own that every caller, the first
+        included, waits on through a shield: a caller that is cancelled
+        stops waiting without cancelling the call for the others. The call
+        is cancelled only once no caller is left waiting for it.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            if self.state is not None and lookup is not None:
+                task = asyncio.ensure_future(self._shared(key, fn, lookup))
+            else:
+                task = asyncio.ensure_future(fn())
+            call = self._calls[key] = {"task": task, "waiters": 0}
+            task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            self.coalesced += 1
+        call["waiters"] += 1
+        try:
+            return await asyncio.shield(call["task"])
+        finally:
+            call["waiters"] -= 1
+            if call["waiters"] == 0 and not call["task"].done():
+                # Later callers start a new call instead of joining this one
+                self._forget(key, call)
+                call["task"].cancel()
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def do_sync(self, key, fn, lookup=None):
+        with self._lock:
+            call = self._sync_calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._sync_calls[key] = {"done": threading.Event()}
+            else:
+                self.coalesced += 1
+        if not leader:
+            call["done"].wait()
+            if "error" in call:
+                raise call["error"]
+            return call["result"]
+        try:
+            if self.state is not None and lookup is not None:
+                call["result"] = self._shared_sync(key, fn, lookup)
+            else:
+                call["result"] = fn()
+            return call["result"]
+        except BaseException as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._sync_calls[key]
+            call["done"].set()
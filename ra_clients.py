@@ -0,0 +1,128 @@
+"""Pool of chat model clients keyed by API key.
+
+Building a ChatGroq client creates fresh HTTP clients with their own
+connection pools, so creating one per request means a new TLS handshake to
+the LLM endpoint every time. The pool keeps one client per API key (keyed by
+its SHA-256, the key itself is not kept as a dict key), evicts the least
+recently used client once `max_size` is reached and drops clients that have
+been idle for `idle_ttl` seconds. Given `close`, dropped clients are closed
+`close_delay` seconds later, as requests that got them before may still
+be using them.
+"""
+import asyncio
+import hashlib
+import inspect
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class ModelPool:
+    def __init__(self, factory, max_size: int = 256, idle_ttl: float = 30 * 60, close=None,
+                 close_delay: float = 300.0):
+        """`factory(api_key)` builds a new client, `close(client)` closes one and may be a coroutine function"""
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.close = close
+        self.close_delay = close_delay
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self._closing = set()
+        self.hits = 0
+        self.created = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def key(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode()).hexdigest()
+
+    def get(self, api_key: str):
+        key = self.key(api_key)
+        now = time.monotonic()
+        with self._lock:
+            dropped = self._expire(now)
+            entry = self._clients.get(key)
+            if entry is not None:
+                self.hits += 1
+                entry[1] = now
+                self._clients.move_to_end(key)
+        self._dispose(dropped)
+        if entry is not None:
+            return entry[0]
+        # Build outside the lock, client construction is not free
+        client = self.factory(api_key)
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is not None:
+                # Someone else built one meanwhile, keep theirs
+                dropped = [client]
+                client = entry[0]
+            else:
+                self.created += 1
+                self._clients[key] = [client, now]
+                while len(self._clients) > self.max_size:
+                    dropped.append(self._clients.popitem(last=False)[1][0])
+                    self.evictions += 1
+        self._dispose(dropped)
+        return client
+
+    def _expire(self, now: float) -> list:
+        dropped = []
+        # Entries are in last-used order, so idle ones are at the front
+        while self._clients:
+            key, (client, last_used) = next(iter(self._clients.items()))
+            if now - last_used < self.idle_ttl:
+                break
+            del self._clients[key]
+            dropped.append(client)
+            self.expirations += 1
+        return dropped
+
+    def _dispose(self, clients):
+        """Close the clients the pool dropped, once requests are done with them"""
+        if self.close is None or not clients:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        for client in clients:
+            if loop is not None:
+                task = loop.create_task(self._close_later(client, self.close_delay))
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+            else:
+                asyncio.run(self._close_later(client, 0))
+
+    async def _close_later(self, client, delay: float):
+        await asyncio.sleep(delay)
+        try:
+            result = self.close(client)
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            logger.exception("Closing a pooled client failed")
+
+    def values(self) -> list:
+        with self._lock:
+            return [client for client, _ in self._clients.values()]
+
+    def clear(self):
+        with self._lock:
+            dropped = [client for client, _ in self._clients.values()]
+            self._clients.clear()
+        self._dispose(dropped)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._clients),
+            "hits": self.hits,
+            "created": self.created,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,173 @@
+"""Pack per-URL summaries into the report prompt under a token budget.
+
+Summaries are split into passages, near-duplicate passages are dropped
+(MinHash over word shingles), the rest are ranked by BM25 relevance to the
+question and added best-first until the budget is full. The kept passages
+are emitted grouped by source, in the original source and passage order, so
+the report prompt still lists every URL it cites.
+
+Token counts use tiktoken when it is installed and a characters-per-token
+estimate otherwise.
+"""
+import hashlib
+import math
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 6000))
+DUPLICATE_THRESHOLD = 0.7
+SHINGLE_SIZE = 3
+NUM_PERM = 64
+# Passages longer than this are split on sentence boundaries
+MAX_PASSAGE_TOKENS = 60
+
+_MERSENNE = (1 << 61) - 1
+_PERMUTATIONS = [
+    (int.from_bytes(hashlib.blake2b(b"a%d" % i, digest_size=8).digest(), "big") % _MERSENNE | 1,
+     int.from_bytes(hashlib.blake2b(b"b%d" % i, digest_size=8).digest(), "big") % _MERSENNE)
+    for i in range(NUM_PERM)
+]
+_WORD_RE = re.compile(r"\w+")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # Roughly 4 characters per token for English text
+    return max(1, len(text) // 4) if text else 0
+
+
+def words(text: str):
+    return _WORD_RE.findall(text.lower())
+
+
+@dataclass
+class Passage:
+    source: int
+    order: int
+    text: str
+    tokens: int
+    score: float = 0.0
+
+
+def split_passages(text: str):
+    passages = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = " ".join(paragraph.split())
+        if not paragraph:
+            continue
+        if count_tokens(paragraph) <= MAX_PASSAGE_TOKENS:
+            passages.append(paragraph)
+            continue
+        current = ""
+        for sentence in _SENTENCE_RE.split(paragraph):
+            candidate = f"{current} {sentence}".strip()
+            if current and count_tokens(candidate) > MAX_PASSAGE_TOKENS:
+                passages.append(current)
+                current = sentence
+            else:
+                current = candidate
+        if current:
+            passages.append(current)
+    return passages
+
+
+def minhash(text: str):
+    tokens = words(text)
+    shingles = {
+        " ".join(tokens[i:i + SHINGLE_SIZE])
+        for i in range(max(1, len(tokens) - SHINGLE_SIZE + 1))
+    }
+    hashes = [
+        int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big")
+        for s in shingles
+    ]
+    return [min((a * h + b) % _MERSENNE for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def similarity(sig_a, sig_b) -> float:
+    """Estimated Jaccard similarity of two MinHash signatures"""
+    return sum(a == b for a, b in zip(sig_a, sig_b)) / len(sig_a)
+
+
+def bm25_scores(question: str, passages, k1: float = 1.5, b: float = 0.75):
+    docs = [words(p.text) for p in passages]
+    if not docs:
+        return []
+    avg_len = sum(len(d) for d in docs) / len(docs) or 1
+    df = Counter(term for d in docs for term in set(d))
+    query = set(words(question))
+    scores = []
+    for doc in docs:
+        tf = Counter(doc)
+        score = 0.0
+        for term in query:
+            if term not in tf:
+                continue
+            idf = math.log(1 + (len(docs) - df[term] + 0.5) / (df[term] + 0.5))
+            score += idf * tf[term] * (k1 + 1) / (tf[term] + k1 * (1 - b + b * len(doc) / avg_len))
+        scores.append(score)
+    return scores
+
+
+def pack_context(question: str, sources, budget: int = TOKEN_BUDGET):
+    """Pack `sources`, a list of (header, text) pairs, into at most `budget` tokens.
+
+    Returns the packed text and a dict of stats.
+    """
+    passages = []
+    for i, (_, text) in enumerate(sources):
+        for j, passage in enumerate(split_passages(text)):
+            # +1 for the separator between passages
+            passages.append(Passage(i, j, passage, count_tokens(passage) + 1))
+
+    # Drop near duplicates, keeping the first occurrence
+    unique = []
+    signatures = []
+    for passage in passages:
+        signature = minhash(passage.text)
+        if any(similarity(signature, seen) >= DUPLICATE_THRESHOLD for seen in signatures):
+            continue
+        signatures.append(signature)
+        unique.append(passage)
+
+    for passage, score in zip(unique, bm25_scores(question, unique)):
+        passage.score = score
+
+    header_tokens = {i: count_tokens(header) + 1 for i, (header, _) in enumerate(sources)}
+    used = 0
+    kept = []
+    kept_sources = set()
+    for passage in sorted(unique, key=lambda p: (-p.score, p.source, p.order)):
+        cost = passage.tokens + (0 if passage.source in kept_sources else header_tokens[passage.source])
+        if used + cost > budget:
+            continue
+        used += cost
+        kept.append(passage)
+        kept_sources.add(passage.source)
+
+    blocks = []
+    for i, (header, _) in enumerate(sources):
+        texts = [p.text for p in sorted(kept, key=lambda p: p.order) if p.source == i]
+        if texts:
+            blocks.append(header + "\n\n".join(texts))
+    packed = "\n\n".join(blocks)
+
+    original = "\n\n".join(header + text for header, text in sources)
+    stats = {
+        "passages": len(passages),
+        "duplicates_removed": len(passages) - len(unique),
+        "passages_kept": len(kept),
+        "tokens_before": count_tokens(original),
+        "tokens_after": count_tokens(packed),
+    }
+    return packed, stats
@@ -0,0 +1,194 @@
+"""HTML to text extraction engines.
+
+`stream` is an incremental extractor built on the stdlib HTMLParser. It can
+be fed the page chunk by chunk while it downloads, skips boilerplate
+elements (scripts, styles, navigation, headers, footers, forms), prefers
+text inside <main>/<article> and stops as soon as the character budget is
+filled. `soup` is the original BeautifulSoup path and is used as the
+fallback whenever the streaming extractor comes back empty or fails.
+
+EXTRACTOR picks the engine. `make_extractor` gives the one to feed while a
+page downloads; an engine that parses whole documents keeps the chunks and
+parses them once the page is read.
+"""
+import os
+from html.parser import HTMLParser
+
+
+MAX_CHARS = 5000
+DEFAULT_ENGINE = os.environ.get("EXTRACTOR", "stream")
+
+SKIP_TAGS = {
+    "script", "style", "noscript", "template", "svg", "canvas", "iframe",
+    "head", "nav", "header", "footer", "aside", "form", "button", "select",
+}
+SKIP_ROLES = {"navigation", "banner", "contentinfo", "complementary", "search"}
+MAIN_TAGS = {"main", "article"}
+VOID_TAGS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link",
+    "meta", "param", "source", "track", "wbr",
+}
+
+# How much page text to collect before giving up on finding a main content
+# element, as a multiple of the budget.
+LOOKAHEAD = 3
+
+
+class _Done(Exception):
+    pass
+
+
+class StreamingExtractor(HTMLParser):
+    # Parses as it is fed, so `text` is quick
+    incremental = True
+
+    def __init__(self, max_chars: int = MAX_CHARS):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.done = False
+        self._all = []
+        self._all_size = 0
+        self._main = []
+        self._main_size = 0
+        self._skip_tag = None
+        self._skip_depth = 0
+        self._main_depth = 0
+        # Text since the last tag: HTMLParser hands it over in pieces split
+        # wherever a fed chunk ends, even in the middle of a word
+        self._data = []
+
+    def feed(self, data: str) -> bool:
+        """Feed a chunk of HTML, returns True once enough text was collected"""
+        if self.done:
+            return True
+        try:
+            super().feed(data)
+        except _Done:
+            self.done = True
+        return self.done
+
+    def close(self):
+        if not self.done:
+            try:
+                super().close()
+                self._flush()
+            except _Done:
+                self.done = True
+
+    def text(self) -> str:
+        # A <main>/<article> holding only a title is not the main content
+        if self._main_size and self._main_size >= min(self.max_chars, self._all_size) // 2:
+            return " ".join(self._main)[: self.max_chars]
+        return " ".join(self._all)[: self.max_chars]
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if tag in VOID_TAGS:
+            return
+        if self._skip_tag is not None:
+            if tag == self._skip_tag:
+                self._skip_depth += 1
+            return
+        if tag in SKIP_TAGS or dict(attrs).get("role") in SKIP_ROLES:
+            self._skip_tag = tag
+            self._skip_depth = 1
+        elif tag in MAIN_TAGS:
+            self._main_depth += 1
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if self._skip_tag is not None:
+            if tag == self._skip_tag:
+                self._skip_depth -= 1
+                if self._skip_depth == 0:
+                    self._skip_tag = None
+            return
+        if tag in MAIN_TAGS and self._main_depth:
+            self._main_depth -= 1
+
+    def handle_data(self, data):
+        self._data.append(data)
+
+    def _flush(self):
+        if not self._data:
+            return
+        data = "".join(self._data)
+        self._data = []
+        if self._skip_tag is not None:
+            return
+        data = " ".join(data.split())
+        if not data:
+            return
+        if self._all_size < self.max_chars * LOOKAHEAD:
+            self._all.append(data)
+            self._all_size += len(data) + 1
+        if self._main_depth:
+            self._main.append(data)
+            self._main_size += len(data) + 1
+            if self._main_size >= self.max_chars:
+                raise _Done()
+        elif self._all_size >= self.max_chars * LOOKAHEAD and not self._main_size:
+            raise _Done()
+
+
+def extract_stream(html: str, max_chars: int = MAX_CHARS) -> str:
+    extractor = StreamingExtractor(max_chars)
+    extractor.feed(html)
+    extractor.close()
+    return extractor.text()
+
+
+def extract_soup(html: str, max_chars: int = MAX_CHARS) -> str:
+    # Only needed when the streaming parser comes up empty, keep it out of startup
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    return soup.get_text(separator=" ", strip=True)[:max_chars]
+
+
+EXTRACTORS = {
+    "stream": extract_stream,
+    "soup": extract_soup,
+}
+
+
+class DocumentExtractor:
+    """The feed/close/text interface of StreamingExtractor for an engine that
+    parses whole documents: it keeps the chunks and parses them in `text`"""
+
+    incremental = False
+
+    def __init__(self, extract, max_chars: int = MAX_CHARS):
+        self.extract = extract
+        self.max_chars = max_chars
+        self._chunks = []
+
+    def feed(self, data: str) -> bool:
+        self._chunks.append(data)
+        return False
+
+    def close(self):
+        pass
+
+    def text(self) -> str:
+        return self.extract("".join(self._chunks), self.max_chars)
+
+
+def make_extractor(engine: str = DEFAULT_ENGINE, max_chars: int = MAX_CHARS):
+    """An extractor of the `engine` engine to feed a page as it downloads"""
+    if engine not in EXTRACTORS:
+        raise ValueError(f"Unknown extractor {engine!r}, expected one of {', '.join(EXTRACTORS)}")
+    if engine == "stream":
+        return StreamingExtractor(max_chars)
+    return DocumentExtractor(EXTRACTORS[engine], max_chars)
+
+
+def extract_text(html: str, max_chars: int = MAX_CHARS, engine: str = DEFAULT_ENGINE) -> str:
+    if engine != "soup":
+        try:
+            text = EXTRACTORS[engine](html, max_chars)
+            if text:
+                return text
+        except Exception:
+            pass
+    return extract_soup(html, max_chars)
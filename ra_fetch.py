@@ -0,0 +1,270 @@
+"""Shared page fetcher used by scrapeText.
+
+One pooled HTTP client per process with keep-alive, connect/read timeouts,
+a per-host and a global concurrency limit, and a byte cap: bodies are
+streamed and reading stops once `max_bytes` have arrived, since only the
+first few thousand characters of a page are ever used. Callers can also
+pass `on_text`, which receives the decoded body as it streams in and stops
+the download early by returning True.
+"""
+import asyncio
+import codecs
+import contextlib
+import os
+import threading
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+USER_AGENT = "Mozilla/5.0 (compatible; ResearchAssistant/1.0)"
+
+MAX_CONNECTIONS = int(os.environ.get("FETCH_MAX_CONNECTIONS", 100))
+MAX_PER_HOST = int(os.environ.get("FETCH_MAX_PER_HOST", 6))
+MAX_CONCURRENCY = int(os.environ.get("FETCH_MAX_CONCURRENCY", 32))
+CONNECT_TIMEOUT = float(os.environ.get("FETCH_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.environ.get("FETCH_READ_TIMEOUT", 10))
+TOTAL_TIMEOUT = float(os.environ.get("FETCH_TOTAL_TIMEOUT", 20))
+MAX_BYTES = int(os.environ.get("FETCH_MAX_BYTES", 512 * 1024))
+CHUNK_SIZE = 16 * 1024
+
+TEXT_CONTENT_TYPES = ("text/", "application/xhtml", "application/xml")
+
+
+@dataclass
+class Page:
+    url: str
+    status_code: int
+    text: str
+    bytes_read: int
+    truncated: bool
+
+
+class UnsupportedContentType(Exception):
+    pass
+
+
+def _host(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+def _check_content_type(content_type: str):
+    content_type = (content_type or "").lower()
+    if content_type and not content_type.startswith(TEXT_CONTENT_TYPES):
+        raise UnsupportedContentType(f"Unsupported content type: {content_type}")
+
+
+class HostLimits:
+    """A semaphore per host, kept only while fetches to that host hold or
+    wait for it, so a crawl over many domains does not keep one per host"""
+
+    def __init__(self, new_semaphore):
+        self._new_semaphore = new_semaphore
+        self._lock = threading.Lock()
+        # host -> [semaphore, fetches holding or waiting for it]
+        self._hosts = {}
+
+    def __len__(self):
+        return len(self._hosts)
+
+    def _enter(self, host: str):
+        with self._lock:
+            entry = self._hosts.get(host)
+            if entry is None:
+                entry = self._hosts[host] = [self._new_semaphore(), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def _exit(self, host: str):
+        with self._lock:
+            entry = self._hosts[host]
+            entry[1] -= 1
+            if not entry[1]:
+                del self._hosts[host]
+
+    @contextlib.asynccontextmanager
+    async def hold(self, host: str):
+        semaphore = self._enter(host)
+        try:
+            async with semaphore:
+                yield
+        finally:
+            self._exit(host)
+
+    @contextlib.contextmanager
+    def hold_sync(self, host: str):
+        semaphore = self._enter(host)
+        try:
+            with semaphore:
+                yield
+        finally:
+            self._exit(host)
+
+
+async def _close_with_loop(client):
+    """Closes `client` when finalized, which asyncio.run does before closing its loop"""
+    try:
+        yield
+    finally:
+        await client.aclose()
+
+
+async def _close_on_loop(client, loop):
+    """Close a client made on another loop, on that loop"""
+    if client.is_closed or loop.is_closed():
+        # Closed with its loop, or nothing can close it any more
+        return
+    if loop.is_running():
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(client.aclose(), loop))
+    else:
+        await asyncio.to_thread(loop.run_until_complete, client.aclose())
+
+
+class PageFetcher:
+    def __init__(
+        self,
+        max_connections: int = MAX_CONNECTIONS,
+        max_per_host: int = MAX_PER_HOST,
+        max_concurrency: int = MAX_CONCURRENCY,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        total_timeout: float = TOTAL_TIMEOUT,
+        max_bytes: int = MAX_BYTES,
+    ):
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.max_concurrency = max_concurrency
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_timeout = total_timeout
+        self.max_bytes = max_bytes
+
+        self._client = None
+        self._closer = None
+        self._loop = None
+        self._global_limit = None
+        self._host_limits = None
+
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._sync_global_limit = threading.BoundedSemaphore(max_concurrency)
+        self._sync_host_limits = HostLimits(lambda: threading.BoundedSemaphore(max_per_host))
+
+    # async path
+
+    async def _ensure_client(self):
+        # Created lazily so the client and semaphores bind to the running loop,
+        # and rebuilt if a different loop is running now (e.g. repeated asyncio.run)
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            stale, stale_loop = self._client, self._loop
+            self._loop = loop
+            self._client = httpx.AsyncClient(
+                follow_redirects=True,
+                headers={"User-Agent": USER_AGENT},
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+            # Its connections can only be closed while the loop is open:
+            # asyncio.run finalizes async generators before closing the loop
+            self._closer = _close_with_loop(self._client)
+            await self._closer.asend(None)
+            self._global_limit = asyncio.Semaphore(self.max_concurrency)
+            self._host_limits = HostLimits(lambda: asyncio.Semaphore(self.max_per_host))
+            if stale is not None:
+                # After the swap, so concurrent callers don't build clients too
+                await _close_on_loop(stale, stale_loop)
+        return self._client
+
+    async def fetch(self, url: str, on_text=None) -> Page:
+        client = await self._ensure_client()
+        # Host first: requests queued behind a busy host must not hold
+        # global slots that fetches to idle hosts could use
+        async with self._host_limits.hold(_host(url)), self._global_limit:
+            return await asyncio.wait_for(self._read(client, url, on_text), self.total_timeout)
+
+    async def _read(self, client, url: str, on_text) -> Page:
+        async with client.stream("GET", url) as response:
+            if response.status_code != 200:
+                return Page(url, response.status_code, "", 0, False)
+            _check_content_type(response.headers.get("content-type"))
+            encoding = response.encoding or "utf-8"
+            decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+            chunks = []
+            size = 0
+            truncated = False
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                chunks.append(chunk)
+                size += len(chunk)
+                if on_text is not None and on_text(decoder.decode(chunk)):
+                    truncated = True
+                    break
+                if size >= self.max_bytes:
+                    truncated = True
+                    break
+            body = b"".join(chunks)[: self.max_bytes]
+            text = body.decode(encoding, errors="replace")
+            return Page(url, response.status_code, text, size, truncated)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._closer = None
+
+    # sync path, for callers that still use Runnable.invoke
+
+    def _ensure_session(self):
+        with self._session_lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.max_connections,
+                                      pool_maxsize=self.max_per_host)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers["User-Agent"] = USER_AGENT
+                self._session = session
+            return self._session
+
+    def fetch_sync(self, url: str, on_text=None) -> Page:
+        session = self._ensure_session()
+        with self._sync_host_limits.hold_sync(_host(url)), self._sync_global_limit:
+            with session.get(url, stream=True,
+                             timeout=(self.connect_timeout, self.read_timeout)) as response:
+                if response.status_code != 200:
+                    return Page(url, response.status_code, "", 0, False)
+                content_type = response.headers.get("content-type", "")
+                _check_content_type(content_type)
+                # requests assumes latin-1 for text/* without a charset, prefer utf-8
+                encoding = (response.encoding if "charset" in content_type else None) or "utf-8"
+                decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+                chunks = []
+                size = 0
+                truncated = False
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if on_text is not None and on_text(decoder.decode(chunk)):
+                        truncated = True
+                        break
+                    if size >= self.max_bytes:
+                        truncated = True
+                        break
+                body = b"".join(chunks)[: self.max_bytes]
+                text = body.decode(encoding, errors="replace")
+                return Page(url, response.status_code, text, size, truncated)
+
+
+_fetcher = None
+
+
+def get_fetcher() -> PageFetcher:
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = PageFetcher()
+    return _fetcher
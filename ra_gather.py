@@ -0,0 +1,145 @@
+"""Deadline-driven gathering and hedged calls, to keep stragglers off the tail.
+
+A report is written from the summaries of every search result, so one
+unresponsive website or one slow summary used to hold up the whole report.
+`gather_quorum` runs the per-URL work concurrently and returns early: once
+`quorum` calls have succeeded it waits at most `grace` seconds more for the
+rest, and after `deadline` seconds it stops waiting as soon as it has
+anything. Calls still running are cancelled and left out.
+
+`Hedger` runs a call and, if it is still running after the recent p95
+latency of such calls, starts a second copy and takes whichever finishes
+first. A page fetch stuck on a bad connection or an overloaded backend
+instance usually finishes quickly when retried, while only about one call
+in twenty pays for a duplicate.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+
+from ra_jobs import percentile
+from ra_metrics import fetch_hedges, sources_dropped
+
+HEDGE_DELAY = float(os.environ.get("FETCH_HEDGE_DELAY", 2.0))
+HEDGE_MIN_DELAY = float(os.environ.get("FETCH_HEDGE_MIN_DELAY", 0.5))
+HEDGE_QUANTILE = float(os.environ.get("FETCH_HEDGE_QUANTILE", 0.95))
+HEDGE_MIN_SAMPLES = 20
+
+
+async def _cancel(tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _error(task):
+    """The exception of a done task, or None; a cancelled task failed with CancelledError"""
+    # task.exception() raises on a cancelled task, e.g. a call whose
+    # shared SingleFlight task was cancelled by its leader
+    return asyncio.CancelledError() if task.cancelled() else task.exception()
+
+
+async def gather_quorum(calls, quorum: int, deadline: float = None, grace: float = 0.0):
+    """Run the zero-argument coroutine functions `calls` concurrently, returning early.
+
+    Returns `(results, stats)`; `results` is in the order of `calls` with None
+    for calls that failed or were cancelled as stragglers. Waits for every
+    call, except that it stops `grace` seconds after `quorum` calls have
+    succeeded, or at `deadline` seconds once at least one has. If every call
+    fails the first error is raised.
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    tasks = [asyncio.ensure_future(call()) for call in calls]
+    pending = set(tasks)
+    hard_stop = start + deadline if deadline is not None else None
+    soft_stop = None
+    succeeded = 0
+    errors = []
+    try:
+        while pending:
+            stops = [t for t in (hard_stop, soft_stop) if t is not None]
+            # Without a single result there is nothing to write a report from
+            timeout = max(0.0, min(stops) - loop.time()) if stops and succeeded else None
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                error = _error(task)
+                if error is not None:
+                    errors.append(error)
+                else:
+                    succeeded += 1
+            if soft_stop is None and succeeded >= quorum:
+                soft_stop = loop.time() + grace
+    finally:
+        await _cancel(pending)
+    if not succeeded and errors:
+        raise errors[0]
+    stats = {
+        "total": len(tasks),
+        "succeeded": succeeded,
+        "failed": len(errors),
+        "dropped": len(pending),
+        "seconds": loop.time() - start,
+    }
+    sources_dropped.inc(len(pending), reason="straggler")
+    sources_dropped.inc(len(errors), reason="error")
+    results = [task.result() if task.done() and _error(task) is None else None for task in tasks]
+    return results, stats
+
+
+class Hedger:
+    """Start a second copy of a slow call and keep whichever finishes first"""
+
+    def __init__(self, initial_delay: float = HEDGE_DELAY, min_delay: float = HEDGE_MIN_DELAY,
+                 quantile: float = HEDGE_QUANTILE, window: int = 256):
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.quantile = quantile
+        self._latencies = deque(maxlen=window)
+        self.calls = 0
+        self.hedged = 0
+        self.hedges_won = 0
+
+    def delay(self) -> float:
+        if len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return self.initial_delay
+        return max(self.min_delay, percentile(sorted(self._latencies), self.quantile))
+
+    async def run(self, call):
+        """`call` is a zero-argument coroutine function, safe to run twice at once"""
+        self.calls += 1
+        start = time.perf_counter()
+        first = asyncio.ensure_future(call())
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.delay())
+            if not done:
+                self.hedged += 1
+                fetch_hedges.inc(result="launched")
+                tasks.append(asyncio.ensure_future(call()))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if _error(task) is None:
+                        self._latencies.append(time.perf_counter() - start)
+                        if task is not first:
+                            self.hedges_won += 1
+                            fetch_hedges.inc(result="won")
+                        return task.result()
+                    error = error or _error(task)
+            raise error
+        finally:
+            await _cancel([task for task in tasks if not task.done()])
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedges_won": self.hedges_won,
+            "delay": self.delay(),
+        }
@@ -0,0 +1,176 @@
+"""Archive of the reports each user got, with full-text search.
+
+Every finished report, from the web research chain or the sectioned
+report graph, is kept with its question, engine and sources (the URL and
+per-URL summary the report was written from), so reading it again is a
+disk read instead of another run of the pipeline. History is per owner,
+the SHA-256 of the API key like for jobs.
+
+A record is stored as zlib-compressed JSON, a fraction of the size of the
+markdown. The question, report and sources are also indexed in a
+contentless FTS5 table, which keeps the terms but not a second copy of the
+text. The owner is indexed too, so a search only walks that user's
+reports. Listing is newest first and search, for whole words after Porter
+stemming, is ranked by bm25 with the question weighted above the report;
+both are paged by limit and offset.
+"""
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+
+from ra_cache import CACHE_DIR
+
+HISTORY_DB = os.environ.get("HISTORY_DB", os.path.join(CACHE_DIR, "history.sqlite3"))
+HISTORY_COMPRESSION = int(os.environ.get("HISTORY_COMPRESSION", 6))
+
+# bm25 weights of the owner, question, report and sources columns
+RANK_WEIGHTS = (0.0, 5.0, 1.0, 0.5)
+
+_TERM_RE = re.compile(r"\w+")
+
+
+def fts_query(owner: str, text: str):
+    """`owner`'s entries with every word of `text`, each word quoted so user
+    input never reaches the query syntax. None without words"""
+    terms = _TERM_RE.findall(text)
+    if not terms:
+        return None
+    # No prefix matching: a short prefix of a common word walks most of the index
+    return f'owner : "{owner}" AND ' + " ".join(f'"{term}"' for term in terms)
+
+
+def source_text(sources) -> str:
+    return "\n".join(f"{s['url']}\n{s['summary']}" for s in sources)
+
+
+class ReportHistory:
+    def __init__(self, path: str = HISTORY_DB, level: int = HISTORY_COMPRESSION):
+        self.level = level
+        self.stores = 0
+        self.reads = 0
+        self.searches = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS history ("
+            " seq INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, owner TEXT NOT NULL, question TEXT NOT NULL,"
+            " engine TEXT NOT NULL, sources INTEGER NOT NULL, created_at REAL NOT NULL,"
+            " size INTEGER NOT NULL, data BLOB NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS history_owner ON history (owner, created_at)")
+        # Rows match history.seq
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5("
+            " owner, question, report, sources, content='', tokenize='porter unicode61')"
+        )
+
+    def add(self, owner: str, question: str, report: str, engine: str = "search", sources=()) -> str:
+        """Archive a report; `sources` are {"url", "summary"} dicts"""
+        sources = [{"url": s["url"], "summary": s["summary"]} for s in sources]
+        data = json.dumps({"question": question, "engine": engine, "report": report, "sources": sources})
+        blob = zlib.compress(data.encode(), self.level)
+        entry_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                seq = self._conn.execute(
+                    "INSERT INTO history (id, owner, question, engine, sources, created_at, size, data)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (entry_id, owner, question, engine, len(sources), time.time(), len(data), blob),
+                ).lastrowid
+                self._conn.execute(
+                    "INSERT INTO history_fts (rowid, owner, question, report, sources) VALUES (?, ?, ?, ?, ?)",
+                    (seq, owner, question, report, source_text(sources)),
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            self.stores += 1
+        return entry_id
+
+    def get(self, entry_id: str, owner: str):
+        """The archived report if it belongs to `owner`"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, created_at, data FROM history WHERE id = ? AND owner = ?", (entry_id, owner)
+            ).fetchone()
+            self.reads += 1
+        if row is None:
+            return None
+        entry = json.loads(zlib.decompress(row["data"]))
+        return {"id": row["id"], "created_at": row["created_at"], **entry}
+
+    @staticmethod
+    def _summaries(rows) -> list:
+        return [{"id": row["id"], "question": row["question"], "engine": row["engine"],
+                 "sources": row["sources"], "created_at": row["created_at"]} for row in rows]
+
+    def list(self, owner: str, limit: int = 20, offset: int = 0) -> dict:
+        """A page of `owner`'s reports, newest first, without their text"""
+        with self._lock:
+            total = self._conn.execute("SELECT COUNT(*) FROM history WHERE owner = ?", (owner,)).fetchone()[0]
+            rows = self._conn.execute(
+                "SELECT id, question, engine, sources, created_at FROM history WHERE owner = ?"
+                " ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                (owner, limit, offset),
+            ).fetchall()
+        return {"total": total, "limit": limit, "offset": offset, "entries": self._summaries(rows)}
+
+    def search(self, owner: str, query: str, limit: int = 20, offset: int = 0) -> dict:
+        """A page of `owner`'s reports matching every word of `query`, best first"""
+        match = fts_query(owner, query)
+        if match is None:
+            return self.list(owner, limit, offset)
+        weights = ", ".join(str(w) for w in RANK_WEIGHTS)
+        with self._lock:
+            # The owner is part of the match; filtering on history.owner
+            # instead would have SQLite run the match once per row of theirs
+            total = self._conn.execute(
+                "SELECT COUNT(*) FROM history_fts WHERE history_fts MATCH ?", (match,)
+            ).fetchone()[0]
+            rows = self._conn.execute(
+                "SELECT history.id, history.question, history.engine, history.sources, history.created_at"
+                " FROM history_fts JOIN history ON history.seq = history_fts.rowid"
+                f" WHERE history_fts MATCH ? ORDER BY bm25(history_fts, {weights}) LIMIT ? OFFSET ?",
+                (match, limit, offset),
+            ).fetchall()
+            self.searches += 1
+        return {"total": total, "limit": limit, "offset": offset, "query": query,
+                "entries": self._summaries(rows)}
+
+    async def aadd(self, owner: str, question: str, report: str, engine: str = "search", sources=()) -> str:
+        return await asyncio.to_thread(self.add, owner, question, report, engine, sources)
+
+    async def aget(self, entry_id: str, owner: str):
+        return await asyncio.to_thread(self.get, entry_id, owner)
+
+    async def alist(self, owner: str, limit: int = 20, offset: int = 0) -> dict:
+        return await asyncio.to_thread(self.list, owner, limit, offset)
+
+    async def asearch(self, owner: str, query: str, limit: int = 20, offset: int = 0) -> dict:
+        return await asyncio.to_thread(self.search, owner, query, limit, offset)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size, stored = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(data)), 0) FROM history"
+            ).fetchone()
+        return {
+            "entries": entries,
+            "bytes": size,
+            "stored_bytes": stored,
+            "compression_ratio": size / stored if stored else 0.0,
+            "stores": self.stores,
+            "reads": self.reads,
+            "searches": self.searches,
+        }
@@ -0,0 +1,300 @@
+"""Background research jobs.
+
+Jobs are persisted in SQLite and executed by a bounded pool of asyncio
+worker tasks. Submitting raises `QueueFull` once `max_queued` jobs are
+waiting, so the web tier can answer 429 instead of piling up work.
+
+API keys are never written to disk, they stay in process memory next to the
+job id. Jobs that were queued or running when the process stopped are put
+back in the queue on startup; if their key is gone they fail with a message
+asking the user to resubmit.
+
+Worker processes of one node share the SQLite file, and each runs the jobs
+submitted to it. Given a shared state backend (ra_state) every queue keeps
+a heartbeat there and records itself as the job's worker, so on startup,
+and every heartbeat after, a queue only takes over the unfinished jobs
+whose worker has stopped instead of those still running elsewhere.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+from ra_cache import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+JOBS_DB = os.environ.get("JOBS_DB", os.path.join(CACHE_DIR, "jobs.sqlite3"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFull(Exception):
+    pass
+
+
+def percentile(values, q: float) -> float:
+    """Nearest-rank percentile of already sorted values"""
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def owner_id(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+class JobStore:
+    def __init__(self, path: str = JOBS_DB):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, owner TEXT NOT NULL, question TEXT NOT NULL,"
+            " status TEXT NOT NULL, result TEXT, error TEXT, created_at REAL NOT NULL,"
+            " started_at REAL, finished_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        for column in ("options", "worker"):
+            try:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+            except sqlite3.OperationalError:
+                # Already there
+                pass
+
+    def insert(self, job_id: str, owner: str, question: str, options: dict = None, worker: str = None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, owner, question, options, worker, status, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, owner, question, json.dumps(options or {}), worker, QUEUED, time.time()),
+            )
+
+    def update(self, job_id: str, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["options"] = json.loads(job["options"] or "{}")
+        return job
+
+    def unfinished(self):
+        """(id, worker) of the queued and running jobs, oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, worker FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)
+            ).fetchall()
+        return [(row["id"], row["worker"]) for row in rows]
+
+
+class JobQueue:
+    def __init__(self, run_job, workers: int = 4, max_queued: int = 100, store: JobStore = None,
+                 state=None, heartbeat: float = 10.0, poll: float = 1.0):
+        """`run_job(question, api_key, **options)` is a coroutine function returning the report"""
+        self.run_job = run_job
+        self.workers = workers
+        self.max_queued = max_queued
+        self.store = store or JobStore()
+        self.state = state
+        self.heartbeat = heartbeat
+        # How often `wait` looks at the store for jobs run by other processes
+        self.poll = poll
+        self.worker_id = uuid.uuid4().hex
+        self._queue = None
+        self._tasks = []
+        self._stopping = False
+        self._api_keys = {}
+        self._finished = {}
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._wait_times = deque(maxlen=1000)
+        self._run_times = deque(maxlen=1000)
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._stopping = False
+        if self.state is not None:
+            self._beat()
+        self._recover()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self.state is not None:
+            self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def stop(self):
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.state is not None:
+            # Jobs left queued here are for the other workers to take over now
+            await asyncio.to_thread(self.state.delete, f"worker:{self.worker_id}")
+
+    def _beat(self):
+        self.state.set(f"worker:{self.worker_id}", str(time.time()), ttl=3 * self.heartbeat)
+
+    def _recover(self):
+        """Queue the unfinished jobs no live worker is running"""
+        for job_id, worker in self.store.unfinished():
+            if self.state is not None:
+                if worker == self.worker_id or (worker and self.state.get(f"worker:{worker}") is not None):
+                    continue
+                # Several workers may find the same orphan, one takes it
+                if not self.state.add(f"recover:{job_id}", self.worker_id, ttl=3 * self.heartbeat):
+                    continue
+            self.store.update(job_id, status=QUEUED, started_at=None, worker=self.worker_id)
+            self._queue.put_nowait(job_id)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                await asyncio.to_thread(self._beat)
+                await asyncio.to_thread(self._recover)
+            except Exception:
+                logger.exception("Job queue heartbeat failed")
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, question: str, api_key: str, options: dict = None) -> str:
+        if self.depth() >= self.max_queued:
+            self.rejected += 1
+            raise QueueFull(f"Too many queued jobs ({self.max_queued}), try again later")
+        job_id = uuid.uuid4().hex
+        # The store calls wait for SQLite, off the event loop like ReportHistory's
+        await asyncio.to_thread(self.store.insert, job_id, owner_id(api_key), question, options, self.worker_id)
+        self._api_keys[job_id] = api_key
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    async def get(self, job_id: str, api_key: str):
+        """Return the job if it belongs to `api_key`"""
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None or job["owner"] != owner_id(api_key):
+            return None
+        job.pop("owner")
+        if job["status"] == QUEUED:
+            job["queue_depth"] = self.depth()
+        return job
+
+    async def wait(self, job_id: str, timeout: float = None):
+        """Wait until the job finishes or `timeout` expires"""
+        event = self._finished.setdefault(job_id, asyncio.Event())
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            job = await asyncio.to_thread(self.store.get, job_id)
+            if job is None or job["status"] in (DONE, FAILED):
+                self._finished.pop(job_id, None)
+                return
+            # Jobs run by another process never set the event, so look
+            # at the store again every `poll` seconds
+            remaining = deadline - time.monotonic() if deadline is not None else self.poll
+            if remaining <= 0:
+                # Nothing here may ever set it, a job run by another
+                # process is not notified
+                self._finished.pop(job_id, None)
+                return
+            try:
+                await asyncio.wait_for(event.wait(), min(remaining, self.poll))
+                return
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        job = await asyncio.to_thread(self.store.get, job_id)
+        api_key = self._api_keys.pop(job_id, None)
+        started = time.time()
+        if job is None:
+            # Deleted from the store while it was queued
+            logger.warning("Job %s is not in the store anymore, skipping it", job_id)
+            self._notify(job_id)
+            return
+        if api_key is None:
+            self.failed += 1
+            await asyncio.to_thread(self.store.update, job_id, status=FAILED, finished_at=started,
+                                    error="The server restarted before this job ran, please resubmit it")
+            self._notify(job_id)
+            return
+        self._wait_times.append(started - job["created_at"])
+        await asyncio.to_thread(self.store.update, job_id, status=RUNNING, started_at=started)
+        self.running += 1
+        try:
+            result = await self.run_job(job["question"], api_key, **job["options"])
+        except asyncio.CancelledError:
+            if self._stopping:
+                # Shutting down, leave it for the next start. Not in a
+                # thread: this task is being cancelled and must not wait
+                self.store.update(job_id, status=QUEUED, started_at=None)
+                raise
+            # Cancelled from inside the job, e.g. a shared search that was
+            # cancelled: the job failed, the worker goes on with the next
+            self.failed += 1
+            await asyncio.to_thread(self.store.update, job_id, status=FAILED,
+                                    error="The research was cancelled, please resubmit it", finished_at=time.time())
+        except Exception as e:
+            self.failed += 1
+            await asyncio.to_thread(self.store.update, job_id, status=FAILED, error=str(e), finished_at=time.time())
+        else:
+            self.completed += 1
+            await asyncio.to_thread(self.store.update, job_id, status=DONE, result=result, finished_at=time.time())
+        finally:
+            self.running -= 1
+            self._run_times.append(time.time() - started)
+        self._notify(job_id)
+
+    def _notify(self, job_id: str):
+        event = self._finished.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    def stats(self) -> dict:
+        def summary(values):
+            values = sorted(values)
+            if not values:
+                return {"count": 0, "avg": 0.0, "p50": 0.0, "p95": 0.0}
+            return {
+                "count": len(values),
+                "avg": sum(values) / len(values),
+                "p50": percentile(values, 0.5),
+                "p95": percentile(values, 0.95),
+            }
+
+        return {
+            "queue_depth": self.depth(),
+            "max_queued": self.max_queued,
+            "workers": self.workers,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "wait_seconds": summary(self._wait_times),
+            "run_seconds": summary(self._run_times),
+        }
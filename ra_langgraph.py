@@ -1,25 +1,68 @@
-from langchain_groq import ChatGroq
-import getpass
+"""Orchestrator-worker report engine built with LangGraph.
+
+The orchestrator plans the report as a list of sections, one `llm_call`
+worker writes each section in parallel and the synthesizer joins them in
+plan order. `astream_report` streams each section as soon as the sections
+before it are done. The chat model, or a `{stage: model}` dict routing the
+`outline` and `section` stages (see ra_models), is passed per run through
+`config["configurable"]`. Importing the module has no side effects:
+langgraph is imported and the graph compiled on first use (or by
+`warm_up`), and nothing talks to the network until `arun_report` is
+awaited.
+
+Section workers share an `AdaptiveLimiter`: an AIMD concurrency limit that
+grows by one after a window of fast successful calls and halves when a
+call is rate limited (HTTP 429), times out or is slower than the target
+latency. Each section call has its own timeout and is retried with backoff
+on 429s and timeouts. Given `rate_limits` (see ra_ratelimit), the planner
+and the sections also wait for the API key's request and token budget.
+
+Runs given a `thread_id` are checkpointed to SQLite after every step. If
+one fails, the next run with the same id skips the planner and every
+section that already finished and only writes what is missing; sections
+still running when the failure happened are written again. The
+checkpoints of a thread are deleted once its report is done, and those of
+threads nobody ran for CHECKPOINT_TTL seconds (failed runs never asked
+again) are pruned. Runs of one thread are serialized, across the worker
+processes too when given a shared `state` (ra_state).
+
+Run it directly to write a report from the command line:
+
+    python ra_langgraph.py "What is langgraph"
+"""
+import asyncio
+import contextlib
+import functools
+import operator
 import os
-from langchain_core.pydantic_v1 import BaseModel, Field
-from typing_extensions import Annotated, TypedDict
+import sys
+import time
+import uuid
+from collections import deque
+from typing import Annotated, List
+
 from langchain_core.messages import HumanMessage, SystemMessage
-from langgraph.constants import Send
-from langgraph.graph import START, END, StateGraph
-
-if "GROQ_API_KEY" not in os.environ:
-    os.environ["GROQ_API_KEY"] = getpass.getpass("Enter your Groq API key: ")
-
-llm = ChatGroq(
-    model="llama-3.3-70b-versatile",
-    temperature=0,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-)
+from langchain_core.runnables import RunnableConfig
+from pydantic import BaseModel, Field
+from typing_extensions import TypedDict
+
+from ra_cache import CACHE_DIR
+from ra_metrics import llm_metrics
+from ra_models import configurable_models, stage_model
+from ra_ratelimit import is_rate_limited, retry_after, scheduled
+
+MAX_SECTIONS = int(os.environ.get("MAX_SECTIONS", 12))
+SECTION_TIMEOUT = float(os.environ.get("SECTION_TIMEOUT", 120))
+SECTION_RETRIES = int(os.environ.get("SECTION_RETRIES", 3))
+PLAN_TIMEOUT = float(os.environ.get("PLAN_TIMEOUT", 60))
+
+CHECKPOINT_DB = os.environ.get("CHECKPOINT_DB", os.path.join(CACHE_DIR, "checkpoints.sqlite3"))
+CHECKPOINT_TTL = float(os.environ.get("CHECKPOINT_TTL", 24 * 3600))
+# How often runs look for threads to prune, in seconds
+CHECKPOINT_PRUNE_EVERY = float(os.environ.get("CHECKPOINT_PRUNE_EVERY", 600))
+# A worker's claim on a thread expires unless renewed, in case it dies
+THREAD_LEASE = float(os.environ.get("THREAD_LEASE", 60))
 
-from typing import Annotated, List
-import operator
 
 class Section(BaseModel):
     name: str = Field(
@@ -35,83 +78,476 @@ class Sections(BaseModel):
         description="Sections of the report.",
     )
 
-planner = llm.with_structured_output(Sections)
+
+class SectionFailed(Exception):
+    pass
+
+
+class EmptyPlan(Exception):
+    pass
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit for calls to a rate limited backend.
+
+    Use as `async with limiter:` around a call, then report how it went
+    with `succeeded(latency)` or `overloaded()`.
+    """
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 16,
+                 target_latency: float = 30.0, cooldown: float = 2.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        # One burst of 429s from concurrent calls should halve the limit once
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._waiters = deque()
+        self._successes = 0
+        self._last_decrease = 0.0
+        self.increases = 0
+        self.decreases = 0
+        self.rate_limited = 0
+        self.timeouts = 0
+
+    async def __aenter__(self):
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return self
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # We were handed a slot just as we got cancelled
+                self._release()
+            else:
+                self._waiters.remove(waiter)
+            raise
+        return self
+
+    async def __aexit__(self, *exc):
+        self._release()
+
+    def _release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def succeeded(self, latency: float):
+        if latency > self.target_latency:
+            self.overloaded()
+            return
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < self.maximum:
+            self._successes = 0
+            self.limit = min(self.maximum, self.limit + 1)
+            self.increases += 1
+            self._wake()
+
+    def overloaded(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self._successes = 0
+        self.limit = max(self.minimum, self.limit / 2)
+        self.decreases += 1
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "rate_limited": self.rate_limited,
+            "timeouts": self.timeouts,
+        }
+
+
+section_limiter = AdaptiveLimiter(
+    initial=int(os.environ.get("SECTION_CONCURRENCY", 4)),
+    maximum=int(os.environ.get("SECTION_MAX_CONCURRENCY", 16)),
+    target_latency=float(os.environ.get("SECTION_TARGET_LATENCY", 60)),
+)
+
+
+def _configurable(config: RunnableConfig):
+    return (config or {}).get("configurable", {})
+
+
+def get_limiter(config: RunnableConfig) -> AdaptiveLimiter:
+    return _configurable(config).get("limiter") or section_limiter
+
+
+async def write_section(model, section: Section, limiter: AdaptiveLimiter, config: RunnableConfig = None) -> str:
+    messages = [
+        SystemMessage(content="Write a report section."),
+        HumanMessage(
+            content=f"Here is the section name: {section.name} and description: {section.description}"
+        ),
+    ]
+    error = None
+    for attempt in range(SECTION_RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(retry_after(error, attempt))
+        async with limiter:
+            try:
+                async with scheduled(config, "section", model, messages) as call:
+                    start = time.monotonic()
+                    result = call.used(await asyncio.wait_for(
+                        model.ainvoke(messages, config={"tags": ["stage:section"]}), SECTION_TIMEOUT
+                    ))
+            except asyncio.TimeoutError as e:
+                limiter.timeouts += 1
+                limiter.overloaded()
+                error = e
+            except Exception as e:
+                if not is_rate_limited(e):
+                    raise
+                limiter.rate_limited += 1
+                limiter.overloaded()
+                error = e
+            else:
+                limiter.succeeded(time.monotonic() - start)
+                return result.content
+    raise SectionFailed(
+        f"Section '{section.name}' failed after {SECTION_RETRIES + 1} attempts: {error!r}"
+    )
 
 
 class State(TypedDict):
-    topic: str 
-    sections: list[Section] 
+    topic: str
+    sections: list[Section]
     completed_sections: Annotated[
         list, operator.add
-    ]  
-    final_report: str 
+    ]
+    final_report: str
 
 
 class WorkerState(TypedDict):
+    index: int
     section: Section
     completed_sections: Annotated[list, operator.add]
 
 
-def orchestrator(state: State):
+async def orchestrator(state: State, config: RunnableConfig):
     """Orchestrator that generates a plan for the report"""
 
+    model = stage_model(config, "outline")
+    planner = model.with_structured_output(Sections).with_config(tags=["stage:outline"])
+    messages = [
+        SystemMessage(content="Generate a plan for the report."),
+        HumanMessage(content=f"Here is the report topic: {state['topic']}"),
+    ]
+    async with scheduled(config, "outline", model, messages):
+        report_sections = await asyncio.wait_for(planner.ainvoke(messages), PLAN_TIMEOUT)
+    if report_sections is None or not report_sections.sections:
+        # With no section to write the graph would end without a report
+        raise EmptyPlan(f"The planner returned no sections for the report on {state['topic']!r}")
 
-    report_sections = planner.invoke(
-        [
-            SystemMessage(content="Generate a plan for the report."),
-            HumanMessage(content=f"Here is the report topic: {state['topic']}"),
-        ]
-    )
-
-    return {"sections": report_sections.sections}
+    # Cap the fan-out, a runaway plan should not turn into dozens of calls
+    return {"sections": report_sections.sections[:MAX_SECTIONS]}
 
 
-def llm_call(state: WorkerState):
+async def llm_call(state: WorkerState, config: RunnableConfig):
     """Worker writes a section of the report"""
 
-    section = llm.invoke(
-        [
-            SystemMessage(content="Write a report section."),
-            HumanMessage(
-                content=f"Here is the section name: {state['section'].name} and description: {state['section'].description}"
-            ),
-        ]
-    )
+    content = await write_section(stage_model(config, "section"), state["section"], get_limiter(config), config)
+
+    return {"completed_sections": [{"index": state["index"], "content": content}]}
+
+
+SECTION_SEPARATOR = "\n\n---\n\n"
+
+
+class SectionAssembler:
+    """Puts sections that finish in any order back into plan order.
+
+    `add` returns the sections that can be emitted now: the one just added
+    and any after it, once every section before them in the plan is done.
+    """
 
-    return {"completed_sections": [section.content]}
+    def __init__(self):
+        self.next_index = 0
+        self._pending = {}
+
+    def add(self, index: int, content: str):
+        self._pending[index] = content
+        ready = []
+        while self.next_index in self._pending:
+            ready.append((self.next_index, self._pending.pop(self.next_index)))
+            self.next_index += 1
+        return ready
 
 
 def synthesizer(state: State):
     """Synthesize full report from sections"""
 
-    completed_sections = state["completed_sections"]
+    # Workers finish in any order, the report follows the plan
+    completed_sections = sorted(state["completed_sections"], key=lambda s: s["index"])
 
-    completed_report_sections = "\n\n---\n\n".join(completed_sections)
+    completed_report_sections = SECTION_SEPARATOR.join(s["content"] for s in completed_sections)
 
     return {"final_report": completed_report_sections}
 
 
 def assign_workers(state: State):
     """Assign a worker to each section in the plan"""
+    from langgraph.constants import Send
 
-    return [Send("llm_call", {"section": s}) for s in state["sections"]]
-
-orchestrator_worker_builder = StateGraph(State)
+    return [Send("llm_call", {"index": i, "section": s}) for i, s in enumerate(state["sections"])]
 
-orchestrator_worker_builder.add_node("orchestrator", orchestrator)
-orchestrator_worker_builder.add_node("llm_call", llm_call)
-orchestrator_worker_builder.add_node("synthesizer", synthesizer)
 
-orchestrator_worker_builder.add_edge(START, "orchestrator")
-orchestrator_worker_builder.add_conditional_edges(
-    "orchestrator", assign_workers, ["llm_call"]
-)
-orchestrator_worker_builder.add_edge("llm_call", "synthesizer")
-orchestrator_worker_builder.add_edge("synthesizer", END)
+@functools.lru_cache(maxsize=None)
+def graph_builder():
+    from langgraph.graph import START, END, StateGraph
 
-orchestrator_worker = orchestrator_worker_builder.compile()
+    orchestrator_worker_builder = StateGraph(State)
 
-state = orchestrator_worker.invoke({"topic": "What is langgraph"})
-from IPython.display import Markdown
+    orchestrator_worker_builder.add_node("orchestrator", orchestrator)
+    orchestrator_worker_builder.add_node("llm_call", llm_call)
+    orchestrator_worker_builder.add_node("synthesizer", synthesizer)
 
-Markdown(state["final_report"])
\ No newline at end of file
+    orchestrator_worker_builder.add_edge(START, "orchestrator")
+    orchestrator_worker_builder.add_conditional_edges(
+        "orchestrator", assign_workers, ["llm_call"]
+    )
+    orchestrator_worker_builder.add_edge("llm_call", "synthesizer")
+    orchestrator_worker_builder.add_edge("synthesizer", END)
+    return orchestrator_worker_builder
+
+
+@functools.lru_cache(maxsize=None)
+def compiled_graph():
+    return graph_builder().compile()
+
+
+def __getattr__(name):
+    # These used to be built at import time
+    if name == "orchestrator_worker_builder":
+        return graph_builder()
+    if name == "orchestrator_worker":
+        return compiled_graph()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def warm_up():
+    """Import langgraph and the checkpointer and compile the graph ahead of the first report"""
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver  # noqa: F401
+
+    compiled_graph()
+
+
+def report_config(model, limiter: AdaptiveLimiter = None, rate_limits=None):
+    configurable = configurable_models(model)
+    if limiter is not None:
+        configurable["limiter"] = limiter
+    if rate_limits is not None:
+        configurable["rate_limits"] = rate_limits
+    # Every section is its own branch, let them all be scheduled; the
+    # limiter decides how many actually call the model at once
+    return {"configurable": configurable, "max_concurrency": MAX_SECTIONS + 1, "callbacks": [llm_metrics]}
+
+
+_thread_locks = {}
+_last_prune = 0.0
+checkpoint_stats = {"resumed": 0, "sections_reused": 0, "threads_pruned": 0, "lock_waits": 0}
+
+
+def _renew(state, key: str, token: str):
+    # Only our own claim, it may have expired and been taken
+    if state.get(key) == token:
+        state.set(key, token, THREAD_LEASE)
+
+
+def _release(state, key: str, token: str):
+    if state.get(key) == token:
+        state.delete(key)
+
+
+@contextlib.asynccontextmanager
+async def _shared_thread_lock(state, thread_id: str):
+    """Claim `thread_id` in `state` so that no other worker process runs it meanwhile"""
+    key = f"report-thread:{thread_id}"
+    token = uuid.uuid4().hex
+    waited = False
+    while not await asyncio.to_thread(state.add, key, token, THREAD_LEASE):
+        if not waited:
+            waited = True
+            checkpoint_stats["lock_waits"] += 1
+        await asyncio.sleep(0.5)
+
+    async def renew():
+        while True:
+            await asyncio.sleep(THREAD_LEASE / 3)
+            await asyncio.to_thread(_renew, state, key, token)
+
+    renewing = asyncio.create_task(renew())
+    try:
+        yield
+    finally:
+        renewing.cancel()
+        await asyncio.to_thread(_release, state, key, token)
+
+
+@contextlib.asynccontextmanager
+async def _thread_lock(thread_id: str, state=None):
+    """Serialize runs of the same thread, they share one checkpoint history"""
+    entry = _thread_locks.setdefault(thread_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            if state is None:
+                yield
+            else:
+                async with _shared_thread_lock(state, thread_id):
+                    yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _thread_locks[thread_id]
+
+
+async def _touch(saver, thread_id: str):
+    """Record that `thread_id` ran now, and prune the threads nobody ran for CHECKPOINT_TTL"""
+    global _last_prune
+    await saver.setup()
+    now = time.time()
+    await saver.conn.execute(
+        "CREATE TABLE IF NOT EXISTS thread_activity (thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)"
+    )
+    await saver.conn.execute(
+        "INSERT OR REPLACE INTO thread_activity (thread_id, updated_at) VALUES (?, ?)", (thread_id, now)
+    )
+    if now - _last_prune >= CHECKPOINT_PRUNE_EVERY:
+        _last_prune = now
+        # Threads checkpointed before there was this table age from now on
+        await saver.conn.execute(
+            "INSERT OR IGNORE INTO thread_activity (thread_id, updated_at)"
+            " SELECT DISTINCT thread_id, ? FROM checkpoints", (now,)
+        )
+        async with saver.conn.execute(
+            "SELECT thread_id FROM thread_activity WHERE updated_at < ?", (now - CHECKPOINT_TTL,)
+        ) as cursor:
+            stale = [row[0] for row in await cursor.fetchall()]
+        await saver.conn.commit()
+        for stale_id in stale:
+            await saver.adelete_thread(stale_id)
+            await saver.conn.execute("DELETE FROM thread_activity WHERE thread_id = ?", (stale_id,))
+        checkpoint_stats["threads_pruned"] += len(stale)
+    await saver.conn.commit()
+
+
+async def _forget(saver, thread_id: str):
+    await saver.adelete_thread(thread_id)
+    await saver.conn.execute("DELETE FROM thread_activity WHERE thread_id = ?", (thread_id,))
+    await saver.conn.commit()
+
+
+@contextlib.asynccontextmanager
+async def _open_graph(thread_id: str = None, state=None):
+    if thread_id is None:
+        yield compiled_graph(), None
+        return
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    os.makedirs(os.path.dirname(CHECKPOINT_DB) or ".", exist_ok=True)
+    async with _thread_lock(thread_id, state), AsyncSqliteSaver.from_conn_string(CHECKPOINT_DB) as saver:
+        await _touch(saver, thread_id)
+        yield graph_builder().compile(checkpointer=saver), saver
+
+
+async def _aupdates(topic: str, model, limiter: AdaptiveLimiter = None, thread_id: str = None, rate_limits=None,
+                    state=None):
+    """Graph updates of a run, resuming the failed run of `thread_id` if there is one"""
+    config = report_config(model, limiter, rate_limits)
+    async with _open_graph(thread_id, state) as (graph, saver):
+        graph_input = {"topic": topic}
+        if saver is not None:
+            config["configurable"]["thread_id"] = thread_id
+            state = await graph.aget_state(config)
+            if state.next:
+                # The plan and the sections that finished are kept, only
+                # what is missing runs again
+                graph_input = None
+                checkpoint_stats["resumed"] += 1
+                if "sections" in state.values:
+                    yield {"orchestrator": {"sections": state.values["sections"]}}
+        async for update in graph.astream(graph_input, config=config, stream_mode="updates"):
+            if update.get("__metadata__", {}).get("cached"):
+                checkpoint_stats["sections_reused"] += 1
+            yield update
+        if saver is not None:
+            # Finished, a new run of the same thread starts from scratch
+            await _forget(saver, thread_id)
+
+
+async def arun_report(topic: str, model, limiter: AdaptiveLimiter = None, thread_id: str = None,
+                      rate_limits=None, state=None) -> str:
+    """Plan, write and join a report on `topic`.
+
+    With a `thread_id` the run is checkpointed, and a later call with the
+    same id resumes it if it failed. Given a shared `state`, runs of the
+    same thread in other worker processes wait for this one.
+    """
+    report = None
+    async for update in _aupdates(topic, model, limiter, thread_id, rate_limits, state):
+        if "synthesizer" in update:
+            report = update["synthesizer"]["final_report"]
+    if not report:
+        raise EmptyPlan(f"No report was written on {topic!r}")
+    return report
+
+
+async def astream_report(topic: str, model, limiter: AdaptiveLimiter = None, thread_id: str = None,
+                         rate_limits=None, state=None):
+    """Run the report graph, yielding (event, data) pairs like astream_research.
+
+    Each section is sent as a token event as soon as it and every section
+    before it in the plan are written, so the streamed text is the final
+    report, in plan order, without waiting for the slowest section.
+    """
+    yield "progress", {"stage": "outlining"}
+    total = 0
+    done = 0
+    assembler = SectionAssembler()
+    async for update in _aupdates(topic, model, limiter, thread_id, rate_limits, state):
+        for node, values in update.items():
+            if node == "orchestrator":
+                total = len(values["sections"])
+                yield "progress", {"stage": "planned", "sections": [s.name for s in values["sections"]]}
+            elif node == "llm_call":
+                done += 1
+                yield "progress", {"stage": "section", "done": done, "total": total}
+                for section in values["completed_sections"]:
+                    for index, content in assembler.add(section["index"], section["content"]):
+                        yield "token", {"text": (SECTION_SEPARATOR if index else "") + content}
+    yield "done", {}
+
+
+if __name__ == "__main__":
+    import getpass
+
+    from langchain_groq import ChatGroq
+
+    if "GROQ_API_KEY" not in os.environ:
+        os.environ["GROQ_API_KEY"] = getpass.getpass("Enter your Groq API key: ")
+
+    llm = ChatGroq(
+        model="llama-3.3-70b-versatile",
+        temperature=0,
+        max_tokens=None,
+        timeout=None,
+        max_retries=2,
+    )
+    print(asyncio.run(arun_report(" ".join(sys.argv[1:]) or "What is langgraph", llm)))
@@ -0,0 +1,305 @@
+"""Latency, token and error metrics, and per-request traces.
+
+`timed(stage)` times a block into the `research_stage_seconds` histogram,
+counts exceptions escaping it in `research_stage_errors_total` and adds a
+span to the current request's trace. `LLMMetricsHandler` is a LangChain
+callback that does the same for every chat model call and counts tokens
+per model and stage; the stage comes from a `stage:<name>` run tag.
+
+Metrics are rendered in the Prometheus text format by `render()`. Traces
+are kept for the last TRACE_BUFFER requests and, with TRACE_LOG set,
+appended to that file as JSON lines.
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger(__name__)
+
+TRACE_BUFFER = int(os.environ.get("TRACE_BUFFER", 100))
+TRACE_LOG = os.environ.get("TRACE_LOG")
+MAX_SPANS = 1000
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(n, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for n, v in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    def _samples(self, key, value):
+        counts, count, total = value
+        names = self.labelnames + ("le",)
+        lines = [
+            f"{self.name}_bucket{_labels(names, key + (bound,))} {n}"
+            for bound, n in zip(self.buckets, counts)
+        ]
+        lines.append(f"{self.name}_bucket{_labels(names, key + ('+Inf',))} {count}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram(
+    "research_stage_seconds", "Time spent in each pipeline stage", ["stage"])
+stage_errors = registry.counter(
+    "research_stage_errors_total", "Errors per pipeline stage", ["stage"])
+request_seconds = registry.histogram(
+    "research_request_seconds", "End to end research request time", ["kind"])
+llm_seconds = registry.histogram(
+    "llm_request_seconds", "Chat model call latency", ["model", "stage"])
+llm_tokens = registry.counter(
+    "llm_tokens_total", "Chat model tokens, by prompt or completion", ["model", "stage", "type"])
+llm_errors = registry.counter(
+    "llm_errors_total", "Failed chat model calls", ["model", "stage"])
+rate_limit_wait = registry.histogram(
+    "llm_rate_limit_wait_seconds", "Time chat model calls waited for their API key's rate limit", ["stage"])
+fetch_bytes = registry.counter(
+    "fetch_bytes_total", "Bytes downloaded from scraped pages")
+fetch_responses = registry.counter(
+    "fetch_responses_total", "Scraped page responses by status", ["status"])
+fetch_hedges = registry.counter(
+    "fetch_hedges_total", "Hedged page fetches, launched and won by the hedge", ["result"])
+sources_dropped = registry.counter(
+    "research_sources_dropped_total", "Sources left out of a report, by reason", ["reason"])
+report_cache_lookups = registry.counter(
+    "report_cache_lookups_total", "Report cache lookups by result", ["result"])
+
+
+class Trace:
+    def __init__(self, name: str, **attrs):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.error = None
+        self.spans = []
+
+    def add_span(self, stage: str, start: float, seconds: float, **attrs):
+        if len(self.spans) < MAX_SPANS:
+            self.spans.append({"stage": stage, "start": round(start - self.start, 6),
+                               "seconds": round(seconds, 6), **attrs})
+
+    def summary(self) -> dict:
+        return {"id": self.id, "name": self.name, "started_at": self.started_at,
+                "seconds": self.seconds, "error": self.error, "spans": len(self.spans), **self.attrs}
+
+    def to_dict(self) -> dict:
+        return {**self.summary(), "spans": self.spans}
+
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+traces = deque(maxlen=TRACE_BUFFER)
+_trace_log_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def start_trace(name: str, **attrs):
+    """Trace one request; spans from `timed` and LLM calls inside it are recorded"""
+    trace = Trace(name, **attrs)
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.error = repr(e)
+        raise
+    finally:
+        current_trace.reset(token)
+        trace.seconds = time.perf_counter() - trace.start
+        request_seconds.observe(trace.seconds, kind=name)
+        traces.append(trace)
+        if TRACE_LOG:
+            with _trace_log_lock, open(TRACE_LOG, "a", encoding="utf-8") as f:
+                f.write(json.dumps(trace.to_dict()) + "\n")
+
+
+def get_trace(trace_id: str):
+    for trace in traces:
+        if trace.id == trace_id:
+            return trace
+    return None
+
+
+def record(stage: str, start: float, seconds: float, error: bool = False, **attrs):
+    """Record a stage that was timed by hand"""
+    stage_seconds.observe(seconds, stage=stage)
+    if error:
+        stage_errors.inc(stage=stage)
+        attrs["error"] = True
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_span(stage, start, seconds, **attrs)
+
+
+@contextlib.contextmanager
+def timed(stage: str, **attrs):
+    start = time.perf_counter()
+    error = False
+    try:
+        yield attrs
+    except BaseException:
+        error = True
+        raise
+    finally:
+        record(stage, start, time.perf_counter() - start, error, **attrs)
+
+
+def _stage(tags) -> str:
+    for tag in tags or ():
+        if tag.startswith("stage:"):
+            return tag[6:]
+    return "other"
+
+
+def _model_name(serialized, kwargs) -> str:
+    params = kwargs.get("invocation_params") or {}
+    return params.get("model_name") or params.get("model") or (serialized or {}).get("name") or "unknown"
+
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    """Times chat model calls and counts their tokens"""
+
+    def __init__(self):
+        self._runs = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, **kwargs):
+        self._runs[run_id] = (time.perf_counter(), _model_name(serialized, kwargs), _stage(tags))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        start, model, stage = run
+        seconds = time.perf_counter() - start
+        llm_seconds.observe(seconds, model=model, stage=stage)
+        prompt, completion = self._usage(response)
+        llm_tokens.inc(prompt, model=model, stage=stage, type="prompt")
+        llm_tokens.inc(completion, model=model, stage=stage, type="completion")
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_span(f"llm:{stage}", start, seconds, model=model,
+                           prompt_tokens=prompt, completion_tokens=completion)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            llm_errors.inc(model=run[1], stage=run[2])
+
+    @staticmethod
+    def _usage(response):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        prompt = completion = 0
+        for generations in response.generations:
+            for generation in generations:
+                metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                prompt += metadata.get("input_tokens", 0)
+                completion += metadata.get("output_tokens", 0)
+        return prompt, completion
+
+
+llm_metrics = LLMMetricsHandler()
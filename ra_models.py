@@ -0,0 +1,117 @@
+"""Per-stage chat model routing.
+
+Each LLM stage of a report has its own model, completion token limit and
+temperature: `plan` writes the search queries, `summarize` answers the
+question from one page, `batch` answers it for several pages in one call
+(see ra_batch), `report` writes the final report, and `outline` and
+`section` plan and write the sectioned report. Page summaries are short
+extractive answers, so by default they go to a small, fast model with a
+tight token limit; the other stages use the large model.
+
+Every setting can be overridden per stage with MODEL_<STAGE>,
+MAX_TOKENS_<STAGE> and TEMPERATURE_<STAGE>, e.g.
+MODEL_SUMMARIZE=llama-3.3-70b-versatile. MODEL changes the large model.
+
+`ModelRouter` hands out a `{stage: model}` dict per API key from one
+`ModelPool`. Stages that are configured alike share a client, and all the
+clients of a key share one HTTP client and so its connections. Chains read
+the model for their stage from `config["configurable"]` with `stage_model`.
+"""
+import os
+from typing import Any, NamedTuple
+
+from ra_clients import ModelPool
+
+DEFAULT_MODEL = os.environ.get("MODEL", "llama-3.3-70b-versatile")
+SMALL_MODEL = "llama-3.1-8b-instant"
+
+STAGES = ("plan", "summarize", "batch", "report", "outline", "section")
+
+
+class ModelSettings(NamedTuple):
+    model: str
+    max_tokens: int
+    temperature: float
+
+
+DEFAULTS = {
+    "plan": ModelSettings(DEFAULT_MODEL, 512, 0.7),
+    "summarize": ModelSettings(SMALL_MODEL, 512, 0.2),
+    "batch": ModelSettings(SMALL_MODEL, 2048, 0.2),
+    "report": ModelSettings(DEFAULT_MODEL, 32768, 0.7),
+    "outline": ModelSettings(DEFAULT_MODEL, 4096, 0.7),
+    "section": ModelSettings(DEFAULT_MODEL, 32768, 0.7),
+}
+
+
+def stage_settings(stage: str) -> ModelSettings:
+    default = DEFAULTS[stage]
+    name = stage.upper()
+    return ModelSettings(
+        os.environ.get(f"MODEL_{name}", default.model),
+        int(os.environ.get(f"MAX_TOKENS_{name}", default.max_tokens)),
+        float(os.environ.get(f"TEMPERATURE_{name}", default.temperature)),
+    )
+
+
+STAGE_SETTINGS = {stage: stage_settings(stage) for stage in STAGES}
+
+
+def stage_model(config, stage: str):
+    """The model for `stage` from `config["configurable"]`, falling back to its `model`"""
+    configurable = (config or {}).get("configurable", {})
+    model = (configurable.get("models") or {}).get(stage) or configurable.get("model")
+    if model is None:
+        raise ValueError("No model given, pass config={'configurable': {'model': model}} "
+                         "or {'models': {stage: model}}")
+    return model
+
+
+def configurable_models(models) -> dict:
+    """`configurable` entries for one chat model or a `{stage: model}` dict"""
+    if isinstance(models, dict):
+        return {"models": models, "model": models.get("report")}
+    return {"model": models}
+
+
+class KeyModels(NamedTuple):
+    models: dict
+    http_client: Any
+
+
+class ModelRouter:
+    def __init__(self, factory, settings: dict = None, http_client=None, **pool_kwargs):
+        """`factory(api_key, settings, http_client)` builds a client for the `ModelSettings`.
+
+        `http_client(api_key)`, if given, builds the async HTTP client that
+        every model of the key shares; it is closed once the pool drops them.
+        """
+        self.factory = factory
+        self.settings = dict(settings or STAGE_SETTINGS)
+        self.http_client = http_client
+        self._pool = ModelPool(self._build, close=self._close, **pool_kwargs)
+        self.http_clients = 0
+
+    def _build(self, api_key: str) -> KeyModels:
+        http_client = self.http_client(api_key) if self.http_client is not None else None
+        if http_client is not None:
+            self.http_clients += 1
+        clients = {s: self.factory(api_key, s, http_client) for s in set(self.settings.values())}
+        return KeyModels({stage: clients[s] for stage, s in self.settings.items()}, http_client)
+
+    @staticmethod
+    async def _close(entry: KeyModels):
+        if entry.http_client is not None:
+            await entry.http_client.aclose()
+
+    def get(self, api_key: str) -> dict:
+        return self._pool.get(api_key).models
+
+    def clear(self):
+        self._pool.clear()
+
+    def stats(self) -> dict:
+        stats = self._pool.stats()
+        stats["http_clients"] = self.http_clients
+        stats["stages"] = {stage: s._asdict() for stage, s in self.settings.items()}
+        return stats
@@ -0,0 +1,438 @@
+"""Per API key scheduling of chat model calls within Groq's rate limits.
+
+Groq limits requests and tokens per minute for each API key and model. A
+report fires a burst of calls (one summary per page, the report, or one
+call per section), and without a budget the burst runs into 429s and the
+time goes to retries. Every call first reserves one request and its
+estimated tokens from two token buckets: the prompt, counted like
+ra_context counts it, plus the completion tokens its stage has been
+using. Calls that do not fit wait in a priority queue, so the report and
+its sections go ahead of page summaries that were queued earlier. When
+the call is done the reservation is settled against the tokens it
+actually used.
+
+The buckets start at RATE_LIMIT_RPM and RATE_LIMIT_TPM, Groq's free tier,
+and follow the x-ratelimit-* headers of the responses: the token limit
+replaces the TPM, the remaining tokens cap the bucket, and a 429 pauses
+every call to that key and model for its retry-after. Set RATE_LIMIT=0 to
+send calls unscheduled.
+
+Given a shared state backend (ra_state), the buckets and the pause live
+there, so the worker processes of the app draw from one budget per key
+instead of each spending the whole of it. The priority queue stays per
+process.
+
+Chains find the scheduler for the session's key in
+`config["configurable"]["rate_limits"]` and wrap each call in
+`scheduled(config, stage, model, prompt)`.
+"""
+import asyncio
+import contextlib
+import heapq
+import itertools
+import os
+import random
+import re
+import time
+
+from ra_clients import ModelPool
+from ra_context import count_tokens
+from ra_metrics import rate_limit_wait
+
+RATE_LIMIT = int(os.environ.get("RATE_LIMIT", 1))
+RATE_LIMIT_RPM = float(os.environ.get("RATE_LIMIT_RPM", 30))
+RATE_LIMIT_TPM = float(os.environ.get("RATE_LIMIT_TPM", 6000))
+
+# Lower goes first: the report the user is waiting on, then planning, then
+# the page summaries
+PRIORITIES = {"report": 0, "section": 0, "outline": 1, "plan": 1, "summarize": 2, "batch": 2}
+COMPLETION_TOKENS = 1024
+
+_DURATION_RE = re.compile(r"([\d.]+)(ms|h|m|s)")
+_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def is_rate_limited(error: Exception) -> bool:
+    # groq.RateLimitError and httpx errors both carry the status code
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429
+
+
+def retry_after(error: Exception, attempt: int) -> float:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return min(30.0, 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+
+
+def parse_duration(value: str) -> float:
+    """Seconds in a Groq reset header such as "7.66s", "2m59.56s" or "120ms" """
+    return sum(float(n) * _UNITS[unit] for n, unit in _DURATION_RE.findall(value or ""))
+
+
+def estimate_tokens(prompt) -> int:
+    """Tokens in a prompt value, a list of messages or a string"""
+    if hasattr(prompt, "to_messages"):
+        prompt = prompt.to_messages()
+    if isinstance(prompt, str):
+        return count_tokens(prompt)
+    # Plus a few tokens of chat framing per message
+    return sum(count_tokens(str(getattr(m, "content", m))) + 4 for m in prompt)
+
+
+def model_name(model) -> str:
+    return getattr(model, "model_name", None) or type(model).__name__
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, minute: float = 60.0):
+        self.minute = minute
+        self.set_limit(per_minute)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def set_limit(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / self.minute
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait(self, amount: float, now: float) -> float:
+        """Seconds until `amount` is available"""
+        self.refill(now)
+        # A call bigger than the whole bucket goes once the bucket is full
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount: float, now: float) -> float:
+        """Take `amount` if it is available, else return the seconds until it is"""
+        wait = self.wait(amount, now)
+        if wait <= 0:
+            # All of it, even past the capacity: `settle` refunds the
+            # difference with the actual usage of all of it
+            self.level -= amount
+        return wait
+
+    def give(self, amount: float):
+        """Put back `amount`, or with a negative amount charge it"""
+        self.level = min(self.capacity, self.level + amount)
+
+    def cap(self, level: float, now: float):
+        self.refill(now)
+        self.level = min(self.level, level)
+
+    def available(self, now: float) -> float:
+        self.refill(now)
+        return self.level
+
+
+class SharedTokenBucket(TokenBucket):
+    """A `TokenBucket` whose level is kept in a ra_state backend under `name`.
+
+    The level and the wall clock time it was last updated are stored as
+    one value and changed atomically; `now` is ignored since monotonic
+    clocks differ between processes. The capacity is per process and set
+    the same way everywhere.
+    """
+
+    def __init__(self, state, name: str, per_minute: float, minute: float = 60.0):
+        self.state = state
+        self.name = name
+        self.minute = minute
+        self.set_limit(per_minute)
+
+    def _level(self, value, now: float) -> float:
+        if value is None:
+            # Never used or idle long enough to have expired: full
+            return self.capacity
+        level, updated = map(float, value.split())
+        return min(self.capacity, level + (now - updated) * self.rate)
+
+    def _change(self, fn):
+        """`fn(level)` returns (new level, result); runs atomically on the shared level"""
+        def change(value):
+            now = time.time()
+            level, result = fn(self._level(value, now))
+            return f"{level:.3f} {now:.3f}", result
+        # Empty for long enough, a bucket is full again, same as no value
+        return self.state.update(self.name, change, ttl=2 * self.minute)
+
+    def take(self, amount: float, now: float = None) -> float:
+        # Like TokenBucket.take: waits for at most a full bucket, takes all of it
+        needed = min(amount, self.capacity)
+
+        def take(level):
+            if level >= needed:
+                return level - amount, 0.0
+            return level, (needed - level) / self.rate
+        return self._change(take)
+
+    def wait(self, amount: float, now: float = None) -> float:
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.available()) / self.rate)
+
+    def give(self, amount: float):
+        self._change(lambda level: (min(self.capacity, level + amount), None))
+
+    def cap(self, level: float, now: float = None):
+        self._change(lambda current: (min(current, level), None))
+
+    def available(self, now: float = None) -> float:
+        return self._level(self.state.get(self.name), time.time())
+
+
+class Reservation:
+    def __init__(self, stage: str, prompt_tokens: int, tokens: int):
+        self.stage = stage
+        self.prompt_tokens = prompt_tokens
+        self.tokens = tokens
+        self.usage = None
+
+    def used(self, message):
+        """Record the usage of a reply, or of the last chunk of a stream, and return it"""
+        usage = getattr(message, "usage_metadata", None)
+        if usage:
+            self.usage = usage
+        return message
+
+
+class ModelBudget:
+    """Requests and tokens per minute for one API key and model, kept in
+    `state` under `name` when the budget is shared between processes"""
+
+    def __init__(self, rpm: float = RATE_LIMIT_RPM, tpm: float = RATE_LIMIT_TPM, minute: float = 60.0,
+                 state=None, name: str = ""):
+        self.state = state
+        self.name = name
+        if state is not None:
+            self.requests = SharedTokenBucket(state, f"{name}:requests", rpm, minute)
+            self.tokens = SharedTokenBucket(state, f"{name}:tokens", tpm, minute)
+        else:
+            self.requests = TokenBucket(rpm, minute)
+            self.tokens = TokenBucket(tpm, minute)
+        self.paused_until = 0.0
+        self._waiters = []
+        self._seq = itertools.count()
+        # Recent completion tokens per stage, the estimate for the next call
+        self._completion = {}
+        self.granted = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self.rate_limited = 0
+        self.header_updates = 0
+
+    def completion_tokens(self, stage: str, model) -> int:
+        estimate = self._completion.get(stage)
+        if estimate is None:
+            estimate = min(getattr(model, "max_tokens", None) or COMPLETION_TOKENS, COMPLETION_TOKENS)
+        return int(estimate)
+
+    def _paused(self, now: float) -> float:
+        paused = self.paused_until - now
+        if self.state is not None:
+            until = self.state.get(f"{self.name}:paused")
+            if until is not None:
+                paused = max(paused, float(until) - time.time())
+        return paused
+
+    async def _shared(self, fn, *args):
+        """Run `fn`, in a thread when the budget is shared: its writes to the
+        state wait for a lock that other processes may hold"""
+        if self.state is None:
+            return fn(*args)
+        return await asyncio.to_thread(fn, *args)
+
+    def _take(self, tokens: int, now: float) -> float:
+        """Take one request and `tokens` if both fit, else return the seconds until they may"""
+        delay = self._paused(now)
+        if delay > 0:
+            return delay
+        delay = self.requests.take(1, now)
+        if delay > 0:
+            return delay
+        delay = self.tokens.take(tokens, now)
+        if delay > 0:
+            self.requests.give(1)
+        return delay
+
+    async def acquire(self, tokens: int, priority: int = 1) -> float:
+        """Wait until the call fits both buckets and goes before every other
+        waiting call, then take its share; returns the seconds waited"""
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        waiter = [priority, next(self._seq), None]
+        heapq.heappush(self._waiters, waiter)
+        try:
+            while True:
+                delay = None
+                if self._waiters[0] is waiter:
+                    delay = await self._shared(self._take, tokens, time.monotonic())
+                    if delay <= 0:
+                        break
+                # Woken early when this call reaches the head of the queue
+                # or the budget changes
+                waiter[2] = loop.create_future()
+                await asyncio.wait([waiter[2]], timeout=delay)
+        finally:
+            self._waiters.remove(waiter)
+            heapq.heapify(self._waiters)
+            self._wake()
+        waited = time.monotonic() - start
+        self.granted += 1
+        if waited > 0.001:
+            self.waited += 1
+            self.wait_seconds += waited
+        return waited
+
+    def _wake(self):
+        if self._waiters:
+            future = self._waiters[0][2]
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    async def settle(self, reservation: Reservation):
+        """Refund or charge the difference between the estimate and the actual usage"""
+        usage = reservation.usage
+        if not usage:
+            return
+        used = usage.get("total_tokens") or usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+        await self._shared(self.tokens.give, reservation.tokens - used)
+        completion = usage.get("output_tokens", 0)
+        previous = self._completion.get(reservation.stage)
+        self._completion[reservation.stage] = completion if previous is None else 0.8 * previous + 0.2 * completion
+        self._wake()
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        if self.state is not None and seconds > 0:
+            now = time.time()
+            until = now + seconds
+            # A longer pause already there is kept, and so is its TTL
+            self.state.update(f"{self.name}:paused",
+                              lambda value: (str(max(until, float(value or 0))), None),
+                              ttl=lambda value: float(value) - now)
+
+    async def update(self, headers):
+        """Follow the x-ratelimit-* and retry-after headers of a response"""
+        if await self._shared(self._follow, headers):
+            self._wake()
+
+    def _follow(self, headers) -> bool:
+        if not any(name in headers for name in ("x-ratelimit-limit-tokens", "x-ratelimit-remaining-tokens",
+                                                "x-ratelimit-remaining-requests", "retry-after")):
+            return False
+        try:
+            if headers.get("x-ratelimit-limit-tokens"):
+                self.tokens.set_limit(float(headers["x-ratelimit-limit-tokens"]))
+            if headers.get("x-ratelimit-remaining-tokens"):
+                self.tokens.cap(float(headers["x-ratelimit-remaining-tokens"]), time.monotonic())
+            # Groq's request headers count requests per day
+            if headers.get("x-ratelimit-remaining-requests") == "0":
+                self.pause(parse_duration(headers.get("x-ratelimit-reset-requests")))
+            if headers.get("retry-after"):
+                self.pause(float(headers["retry-after"]))
+        except ValueError:
+            return False
+        self.header_updates += 1
+        return True
+
+    async def overloaded(self, error: Exception):
+        """A call was rate limited anyway: hold every call back for its retry-after"""
+        self.rate_limited += 1
+        await self._shared(self.pause, retry_after(error, 1))
+        self._wake()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "requests_per_minute": self.requests.capacity,
+            "tokens_per_minute": self.tokens.capacity,
+            "tokens_available": int(self.tokens.available(now)),
+            "waiting": len(self._waiters),
+            "granted": self.granted,
+            "waited": self.waited,
+            "wait_seconds": self.wait_seconds,
+            "rate_limited": self.rate_limited,
+            "header_updates": self.header_updates,
+            "paused": max(0.0, self._paused(now)),
+        }
+
+
+class KeyLimits:
+    """The budgets of one API key, one per model; `key_id` names them in `state`"""
+
+    def __init__(self, rpm: float = RATE_LIMIT_RPM, tpm: float = RATE_LIMIT_TPM, minute: float = 60.0,
+                 state=None, key_id: str = ""):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.minute = minute
+        self.state = state
+        self.key_id = key_id
+        self.budgets = {}
+
+    def budget(self, model: str) -> ModelBudget:
+        budget = self.budgets.get(model)
+        if budget is None:
+            budget = self.budgets[model] = ModelBudget(self.rpm, self.tpm, self.minute, self.state,
+                                                       f"ratelimit:{self.key_id}:{model}")
+        return budget
+
+    @contextlib.asynccontextmanager
+    async def reserve(self, model, stage: str, prompt):
+        budget = self.budget(model_name(model))
+        prompt_tokens = estimate_tokens(prompt)
+        reservation = Reservation(stage, prompt_tokens, prompt_tokens + budget.completion_tokens(stage, model))
+        waited = await budget.acquire(reservation.tokens, PRIORITIES.get(stage, 1))
+        rate_limit_wait.observe(waited, stage=stage)
+        try:
+            yield reservation
+        except Exception as e:
+            if is_rate_limited(e):
+                await budget.overloaded(e)
+            raise
+        finally:
+            await budget.settle(reservation)
+
+
+class RateLimitScheduler:
+    """`KeyLimits` per API key, kept like clients in a `ModelPool`; with a
+    ra_state backend the budgets are shared with other processes"""
+
+    def __init__(self, rpm: float = RATE_LIMIT_RPM, tpm: float = RATE_LIMIT_TPM, minute: float = 60.0,
+                 state=None, **pool_kwargs):
+        """`minute` is only shortened by tests and benchmarks"""
+        # Named by a prefix of the key's hash, never the key itself
+        self._keys = ModelPool(lambda api_key: KeyLimits(rpm, tpm, minute, state, ModelPool.key(api_key)[:16]),
+                               **pool_kwargs)
+
+    def get(self, api_key: str) -> KeyLimits:
+        return self._keys.get(api_key)
+
+    def stats(self) -> dict:
+        stats = {"keys": 0, "waiting": 0, "granted": 0, "waited": 0, "wait_seconds": 0.0,
+                 "rate_limited": 0, "header_updates": 0}
+        # Copies: /stats calls this in a thread while the loop adds keys
+        for limits in list(self._keys.values()):
+            stats["keys"] += 1
+            for budget in list(limits.budgets.values()):
+                budget_stats = budget.stats()
+                for name in stats.keys() - {"keys"}:
+                    stats[name] += budget_stats[name]
+        return stats
+
+
+@contextlib.asynccontextmanager
+async def scheduled(config, stage: str, model, prompt):
+    """Reserve a call to `model` from `config["configurable"]["rate_limits"]`;
+    without one the call goes straight through"""
+    limits = (config or {}).get("configurable", {}).get("rate_limits")
+    if limits is None:
+        yield Reservation(stage, 0, 0)
+        return
+    async with limits.reserve(model, stage, prompt) as reservation:
+        yield reservation
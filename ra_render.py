@@ -0,0 +1,91 @@
+"""Markdown rendering of reports, off the event loop and cached.
+
+Converting a full report to HTML takes tens of milliseconds of pure Python,
+which used to run on the event loop and stall every other request. The
+renderer runs conversions in a small thread pool, reusing one
+`markdown.Markdown` instance per thread (instances are not thread safe and
+building one loads every extension again), and keeps the HTML of recent
+reports in an LRU keyed by a hash of the text, so showing the same or a
+cached report again costs a dictionary lookup. Concurrent requests to
+render the same text share one conversion.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import markdown
+
+from ra_cache import LRUCache, SingleFlight
+
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", 2))
+RENDER_CACHE_ENTRIES = int(os.environ.get("RENDER_CACHE_ENTRIES", 256))
+EXTENSIONS = ("fenced_code", "tables", "nl2br")
+
+
+class MarkdownRenderer:
+    def __init__(self, extensions=EXTENSIONS, workers: int = RENDER_WORKERS,
+                 cache_entries: int = RENDER_CACHE_ENTRIES):
+        self.extensions = list(extensions)
+        self.cache = LRUCache(max_entries=cache_entries)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+        self._local = threading.local()
+        self._flight = SingleFlight()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.renders = 0
+        self.render_seconds = 0.0
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _convert(self, text: str) -> str:
+        md = getattr(self._local, "markdown", None)
+        if md is None:
+            md = self._local.markdown = markdown.Markdown(extensions=self.extensions)
+        start = time.perf_counter()
+        html = md.reset().convert(text)
+        with self._stats_lock:
+            self.render_seconds += time.perf_counter() - start
+            self.renders += 1
+        return html
+
+    def _render_and_cache(self, key: str, text: str) -> str:
+        html = self._convert(text)
+        self.cache.set(key, html)
+        return html
+
+    def render(self, text: str) -> str:
+        key = self._key(text)
+        html = self.cache.get(key)
+        if html is not None:
+            self.hits += 1
+            return html
+        return self._render_and_cache(key, text)
+
+    async def arender(self, text: str) -> str:
+        key = self._key(text)
+        html = self.cache.get(key)
+        if html is not None:
+            self.hits += 1
+            return html
+        loop = asyncio.get_running_loop()
+        return await self._flight.do(
+            key, lambda: loop.run_in_executor(self._executor, self._render_and_cache, key, text)
+        )
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.renders
+        return {
+            "hits": self.hits,
+            "renders": self.renders,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "render_seconds": self.render_seconds,
+            "cached": len(self.cache),
+            "evictions": self.cache.evictions,
+        }
@@ -0,0 +1,201 @@
+"""Cache of finished research reports, keyed by the normalized question.
+
+Writing a report is the slowest and most expensive thing the app does, and
+many questions are the same question worded a little differently. A new
+question gets a cached report only when it asks the same thing: in the
+same scope (engine, models, prompt version and search options) and with
+the same normalized question.
+
+A question is normalized by lowercasing it, dropping stop words and
+crudely stemming the rest, so "What are the benefits of green tea?" and
+"benefits of green tea" match. The words keep their order: "Did Germany
+invade France?" is not "Did France invade Germany?". Words with digits are
+kept as they are, and the capitalized words after the first (names,
+mostly) are kept with their case, so questions about another year,
+quantity or entity never match.
+
+This exact key deliberately replaces matching question embeddings above a
+similarity threshold. Nothing looser is safe: the embedding scored
+"benefits of green tea" close to "risks of green tea", and "Canada" close
+to "Mexico", above any threshold that still matched real rewordings. A
+missed rewording costs a pipeline run, a wrong match serves someone the
+answer to another question.
+
+Entries expire after REPORT_CACHE_TTL seconds and the cache keeps at most
+REPORT_CACHE_MAX_ENTRIES, evicting the least recently used. Reports live
+in SQLite, looked up by an index on the scope and key, so the worker
+processes of a node share them.
+"""
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+from ra_cache import CACHE_DIR, make_key
+from ra_metrics import report_cache_lookups
+
+REPORT_CACHE_DB = os.environ.get("REPORT_CACHE_DB", os.path.join(CACHE_DIR, "reports.sqlite3"))
+REPORT_CACHE_TTL = float(os.environ.get("REPORT_CACHE_TTL", 24 * 3600))
+REPORT_CACHE_MAX_ENTRIES = int(os.environ.get("REPORT_CACHE_MAX_ENTRIES", 1000))
+
+_WORD_RE = re.compile(r"\w+")
+_NAME_RE = re.compile(r"[A-Z]\w*")
+STOP_WORDS = frozenset("""
+a an and are as at be been being by can could did do does for from had has have how i in into is it
+its me my of on or our please should so tell than that the their them there these they this those to
+us was we were what when where which who whom why will with would you your
+""".split())
+_SUFFIXES = ("ing", "ers", "ed", "es", "er", "s")
+# Part of every key: bumped when normalization changes, so that entries
+# stored under the old rules stop matching
+KEY_VERSION = 2
+
+
+def _stem(word: str) -> str:
+    if any(c.isdigit() for c in word):
+        # "1990s" is not "1990"
+        return word
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def normalize_question(question: str) -> str:
+    words = _WORD_RE.findall(question.lower())
+    content = [w for w in words if w not in STOP_WORDS]
+    # A question made only of stop words still needs something to match on
+    return " ".join(_stem(w) for w in content or words)
+
+
+def question_key(question: str) -> str:
+    """Equal for questions that ask the same thing, see the module docstring"""
+    names = _NAME_RE.findall(question)
+    if question[:1].isupper():
+        # The first word is capitalized anyway
+        names = names[1:]
+    return make_key("question", KEY_VERSION, normalize_question(question), names)
+
+
+class ReportCache:
+    def __init__(self, path: str = REPORT_CACHE_DB, ttl: float = REPORT_CACHE_TTL,
+                 max_entries: int = REPORT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.invalidations = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(reports)")}
+        if "vector" in columns:
+            # Entries matched by embedding similarity, which served wrong reports
+            self._conn.execute("DROP TABLE reports")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS reports ("
+            " id TEXT PRIMARY KEY, scope TEXT NOT NULL, key TEXT NOT NULL, question TEXT NOT NULL,"
+            " report TEXT NOT NULL, created_at REAL NOT NULL, expires_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS reports_key ON reports (scope, key)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS reports_accessed ON reports (accessed_at)")
+
+    def lookup(self, question: str, scope: str):
+        """The cached report for `question` in `scope`, or None"""
+        key = question_key(question)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, report, created_at FROM reports WHERE scope = ? AND key = ? AND expires_at > ?"
+                " ORDER BY created_at DESC LIMIT 1",
+                (scope, key, now),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                report_cache_lookups.inc(result="miss")
+                return None
+            self._conn.execute("UPDATE reports SET accessed_at = ?, hits = hits + 1 WHERE id = ?", (now, row[0]))
+            self.hits += 1
+        report_cache_lookups.inc(result="hit")
+        return {"id": row[0], "report": row[1], "created_at": row[2]}
+
+    def store(self, question: str, scope: str, report: str) -> str:
+        key = question_key(question)
+        now = time.time()
+        entry_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # A fresh report replaces the one it would have been answered from
+                self._conn.execute("DELETE FROM reports WHERE (scope = ? AND key = ?) OR expires_at <= ?",
+                                   (scope, key, now))
+                self._conn.execute(
+                    "INSERT INTO reports (id, scope, key, question, report, created_at, expires_at, accessed_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (entry_id, scope, key, question, report, now, now + self.ttl, now),
+                )
+                overflow = self._conn.execute("SELECT COUNT(*) FROM reports").fetchone()[0] - self.max_entries
+                if overflow > 0:
+                    self._conn.execute(
+                        "DELETE FROM reports WHERE id IN (SELECT id FROM reports ORDER BY accessed_at LIMIT ?)",
+                        (overflow,),
+                    )
+                    self.evictions += overflow
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            self.stores += 1
+        return entry_id
+
+    async def alookup(self, question: str, scope: str):
+        return await asyncio.to_thread(self.lookup, question, scope)
+
+    async def astore(self, question: str, scope: str, report: str) -> str:
+        return await asyncio.to_thread(self.store, question, scope, report)
+
+    def invalidate(self, entry_id: str = None, question: str = None) -> int:
+        """Drop one entry by id, the entries for `question` in every scope, or with neither, everything"""
+        with self._lock:
+            if entry_id is not None:
+                removed = self._conn.execute("DELETE FROM reports WHERE id = ?", (entry_id,)).rowcount
+            elif question is not None:
+                removed = self._conn.execute("DELETE FROM reports WHERE key = ?", (question_key(question),)).rowcount
+            else:
+                removed = self._conn.execute("DELETE FROM reports").rowcount
+            self.invalidations += removed
+        return removed
+
+    def entries(self, limit: int = 100):
+        """Cached questions, most recently used first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, question, created_at, expires_at, accessed_at, hits FROM reports"
+                " WHERE expires_at > ? ORDER BY accessed_at DESC LIMIT ?",
+                (time.time(), limit),
+            ).fetchall()
+        names = ("id", "question", "created_at", "expires_at", "accessed_at", "hits")
+        return [dict(zip(names, row)) for row in rows]
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute(
+                "SELECT COUNT(*) FROM reports WHERE expires_at > ?", (time.time(),)
+            ).fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
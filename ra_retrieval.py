@@ -0,0 +1,192 @@
+"""Pick the parts of a page that are relevant to the question.
+
+Instead of handing the summarizer the first few thousand characters of a
+page, the full extracted text is split into overlapping chunks, the chunks
+are embedded and the ones closest to the question are kept, in page order,
+until the character budget is filled.
+
+Embeddings come from a CPU-only embedder: `hashing` (default) is a
+hashed bag of words and word pairs computed in batched NumPy calls, with
+no model to download; `huggingface` uses a sentence-transformers model
+through langchain's HuggingFaceEmbeddings when that is installed. The
+`EMBEDDER` env var selects one.
+
+Chunk vectors are stored per page in a `TieredCache`, so pages seen by
+earlier requests (or before a restart) are not embedded again.
+"""
+import base64
+import hashlib
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from ra_cache import TieredCache, make_key
+
+CHUNK_CHARS = int(os.environ.get("CHUNK_CHARS", 1000))
+CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", 150))
+DEFAULT_EMBEDDER = os.environ.get("EMBEDDER", "hashing")
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+
+_WORD_RE = re.compile(r"\w+")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def chunk_text(text: str, size: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP):
+    """Split text into chunks of about `size` characters on sentence boundaries.
+
+    Consecutive chunks share up to `overlap` characters of trailing sentences
+    so a fact straddling a boundary is whole in at least one chunk.
+    """
+    sentences = []
+    for sentence in _SENTENCE_RE.split(text):
+        # Text without punctuation still has to be cut somewhere
+        while len(sentence) > size:
+            cut = sentence.rfind(" ", 0, size)
+            cut = cut if cut > 0 else size
+            sentences.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if sentence:
+            sentences.append(sentence)
+
+    chunks = []
+    current = []
+    length = 0
+    for sentence in sentences:
+        if current and length + len(sentence) > size:
+            chunks.append(" ".join(current))
+            # Carry trailing sentences over as the overlap
+            carried = []
+            carried_length = 0
+            for previous in reversed(current):
+                if carried_length + len(previous) > overlap:
+                    break
+                carried.insert(0, previous)
+                carried_length += len(previous) + 1
+            current, length = carried, carried_length
+        current.append(sentence)
+        length += len(sentence) + 1
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+class HashingEmbedder:
+    """Hashed unigram and bigram counts, log-scaled and L2 normalized"""
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str):
+        words = _WORD_RE.findall(text.lower())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        # crc32 is stable across processes, unlike hash()
+        return [zlib.crc32(f.encode()) for f in features]
+
+    def embed(self, texts):
+        rows = []
+        hashes = []
+        for row, text in enumerate(texts):
+            h = self._features(text)
+            hashes.extend(h)
+            rows.extend([row] * len(h))
+        hashes = np.asarray(hashes, dtype=np.int64)
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = hashes % self.dim
+        signs = np.where((hashes >> 31) & 1, -1.0, 1.0)
+        counts = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(counts, (rows, columns), signs)
+        vectors = np.sign(counts) * np.log1p(np.abs(counts))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+
+class HuggingFaceEmbedder:
+    def __init__(self, model_name: str = EMBEDDING_MODEL):
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+
+        self.name = model_name
+        self._model = HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs={"device": "cpu"},
+            encode_kwargs={"normalize_embeddings": True, "batch_size": 64},
+        )
+
+    def embed(self, texts):
+        return np.asarray(self._model.embed_documents(list(texts)), dtype=np.float32)
+
+
+EMBEDDERS = {
+    "hashing": HashingEmbedder,
+    "huggingface": HuggingFaceEmbedder,
+}
+
+
+def _encode(vectors) -> str:
+    return base64.b64encode(vectors.astype(np.float16).tobytes()).decode()
+
+
+def _decode(data: str, dim: int):
+    return np.frombuffer(base64.b64decode(data), dtype=np.float16).reshape(-1, dim).astype(np.float32)
+
+
+class ChunkIndex:
+    def __init__(self, embedder=None, cache: TieredCache = None):
+        self.embedder = embedder or EMBEDDERS[DEFAULT_EMBEDDER]()
+        self.cache = cache or TieredCache("chunks", ttl=float(os.environ.get("CHUNK_CACHE_TTL", 24 * 3600)),
+                                          memory_entries=256)
+        self._lock = threading.Lock()
+        self.pages_embedded = 0
+        self.chunks_embedded = 0
+        self.pages_reused = 0
+
+    @property
+    def version(self) -> str:
+        """Changes whenever chunking or the embedder changes"""
+        return make_key(self.embedder.name, CHUNK_CHARS, CHUNK_OVERLAP)[:12]
+
+    def page(self, url: str, text: str):
+        """Chunks and chunk vectors of a page, embedding it only if needed"""
+        digest = hashlib.sha256(text.encode()).hexdigest()
+        key = make_key("chunks", url, digest, self.version)
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.pages_reused += 1
+            return entry["chunks"], _decode(entry["vectors"], entry["dim"])
+        chunks = chunk_text(text)
+        vectors = self.embedder.embed(chunks)
+        self.cache.set(key, {"chunks": chunks, "vectors": _encode(vectors), "dim": vectors.shape[1]})
+        with self._lock:
+            self.pages_embedded += 1
+            self.chunks_embedded += len(chunks)
+        return chunks, vectors
+
+    def select(self, question: str, url: str, text: str, max_chars: int) -> str:
+        """The chunks of `text` most similar to `question`, within `max_chars`"""
+        if len(text) <= max_chars:
+            return text
+        chunks, vectors = self.page(url, text)
+        scores = vectors @ self.embedder.embed([question])[0]
+        chosen = []
+        used = 0
+        for i in np.argsort(-scores, kind="stable"):
+            if used + len(chunks[i]) > max_chars:
+                continue
+            chosen.append(i)
+            used += len(chunks[i]) + 2
+        if not chosen:
+            return text[:max_chars]
+        # Keep page order so the summarizer reads the text as written
+        return "\n\n".join(chunks[i] for i in sorted(chosen))
+
+    def stats(self) -> dict:
+        return {
+            "embedder": self.embedder.name,
+            "pages_embedded": self.pages_embedded,
+            "chunks_embedded": self.chunks_embedded,
+            "pages_reused": self.pages_reused,
+            "cache": self.cache.stats(),
+        }
@@ -0,0 +1,256 @@
+"""State shared by the worker processes of the app.
+
+Run with several workers (see gunicorn.conf.py), every process has its own
+memory, so what they must agree on goes through a shared backend: the
+session secret, claims on in-flight work (`SingleFlight`), the rate limit
+buckets of each API key (ra_ratelimit) and, with Redis, the cache tier
+behind the in-process LRU. STATE_URL picks the backend:
+
+- unset or sqlite:///path: `SQLiteState`, a key-value table in a SQLite
+  file (CACHE_DIR/state.sqlite3 by default) that every worker on the node
+  opens. The SQLite caches and the job store are shared the same way.
+- redis://host:port/db (or rediss://, unix://): `RedisState`, for workers
+  on several nodes. Needs the redis package, which is not in
+  requirements.txt.
+- memory://: `MemoryState`, a dict in this process, for a single worker.
+
+Values are strings with an optional TTL in seconds. Besides get, set and
+delete, backends have `add` (set unless the key exists, the claim
+primitive), `update` (an atomic read-modify-write, whose TTL may be a
+function of the new value) and `clear` (delete by prefix). `RedisState` takes any client with redis-py's get, set, delete
+and scan_iter, so a local stand-in can play the server in tests and
+benchmarks.
+
+The calls are synchronous and may wait for a lock another process holds
+(SQLite's busy timeout, `RedisState.update`'s lock key), so async callers
+run them in a thread.
+"""
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import uuid
+
+from ra_cache import CACHE_DIR
+
+STATE_URL = os.environ.get("STATE_URL", "")
+
+
+def _ttl(ttl, value):
+    """`ttl`, or what it returns for `value` if it is a function"""
+    return ttl(value) if callable(ttl) else ttl
+
+
+class MemoryState:
+    """One process only"""
+
+    distributed = False
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key, now: float):
+        item = self._data.get(key)
+        if item is not None and item[1] is not None and item[1] <= now:
+            del self._data[key]
+            return None
+        return item
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._live(key, time.time())
+        return item[0] if item is not None else None
+
+    def set(self, key: str, value: str, ttl: float = None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    def add(self, key: str, value: str, ttl: float = None) -> bool:
+        now = time.time()
+        with self._lock:
+            if self._live(key, now) is not None:
+                return False
+            self._data[key] = (value, now + ttl if ttl else None)
+            return True
+
+    def update(self, key: str, fn, ttl: float = None):
+        """`fn(value)` gets the current value or None and returns (new value, result);
+        `ttl` may be a function of the new value"""
+        now = time.time()
+        with self._lock:
+            item = self._live(key, now)
+            value, result = fn(item[0] if item is not None else None)
+            ttl = _ttl(ttl, value)
+            self._data[key] = (value, now + ttl if ttl else None)
+        return result
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self, prefix: str = ""):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+
+class SQLiteState:
+    """Shared by every process that opens the same file"""
+
+    distributed = False
+    # Expired rows are deleted every this many writes
+    PURGE_EVERY = 1000
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+
+    def _get(self, key: str, now: float):
+        row = self._conn.execute(
+            "SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, now)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def _put(self, key: str, value: str, ttl: float, now: float):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, now + ttl if ttl else None),
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self._conn.execute("DELETE FROM state WHERE expires_at <= ?", (now,))
+
+    def get(self, key: str):
+        with self._lock:
+            return self._get(key, time.time())
+
+    def set(self, key: str, value: str, ttl: float = None):
+        with self._lock:
+            self._put(key, value, ttl, time.time())
+
+    def add(self, key: str, value: str, ttl: float = None) -> bool:
+        return self.update(key, lambda current: (value, True) if current is None else (current, False), ttl)
+
+    def update(self, key: str, fn, ttl: float = None):
+        """`fn(value)` gets the current value or None and returns (new value, result);
+        `ttl` may be a function of the new value"""
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so no other process
+            # changes the row between the read and the write
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                current = self._get(key, now)
+                value, result = fn(current)
+                if value is not current:
+                    self._put(key, value, _ttl(ttl, value), now)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return result
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM state WHERE key = ?", (key,))
+
+    def clear(self, prefix: str = ""):
+        with self._lock:
+            self._conn.execute("DELETE FROM state WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+
+
+class RedisState:
+    """Keys live in Redis under `prefix`.
+
+    `update` holds a short lock key (SET NX PX) around the read and the
+    write rather than running a Lua script, so it needs nothing beyond
+    plain commands from the server.
+    """
+
+    distributed = True
+
+    def __init__(self, client, prefix: str = "ra:", lock_timeout: float = 2.0):
+        self.client = client
+        self.prefix = prefix
+        self.lock_timeout = lock_timeout
+        self.lock_waits = 0
+
+    @staticmethod
+    def _ms(ttl: float):
+        return max(1, int(ttl * 1000)) if ttl else None
+
+    def get(self, key: str):
+        value = self.client.get(self.prefix + key)
+        return value.decode() if isinstance(value, bytes) else value
+
+    def set(self, key: str, value: str, ttl: float = None):
+        self.client.set(self.prefix + key, value, px=self._ms(ttl))
+
+    def add(self, key: str, value: str, ttl: float = None) -> bool:
+        return bool(self.client.set(self.prefix + key, value, px=self._ms(ttl), nx=True))
+
+    def update(self, key: str, fn, ttl: float = None):
+        """`fn(value)` gets the current value or None and returns (new value, result);
+        `ttl` may be a function of the new value"""
+        lock = f"{self.prefix}lock:{key}"
+        token = uuid.uuid4().hex
+        delay = 0.0005
+        while not self.client.set(lock, token, px=self._ms(self.lock_timeout), nx=True):
+            self.lock_waits += 1
+            time.sleep(delay)
+            delay = min(delay * 2, 0.02)
+        try:
+            current = self.get(key)
+            value, result = fn(current)
+            if value is not current:
+                self.set(key, value, _ttl(ttl, value))
+        finally:
+            # Only release our own lock, it may have timed out and been taken
+            if self.get(f"lock:{key}") == token:
+                self.client.delete(lock)
+        return result
+
+    def delete(self, key: str):
+        self.client.delete(self.prefix + key)
+
+    def clear(self, prefix: str = ""):
+        keys = list(self.client.scan_iter(match=f"{self.prefix}{prefix}*"))
+        if keys:
+            self.client.delete(*keys)
+
+
+def open_state(url: str = STATE_URL):
+    """The backend for a STATE_URL"""
+    if not url:
+        return SQLiteState(os.path.join(CACHE_DIR, "state.sqlite3"))
+    if url.startswith("sqlite:///"):
+        return SQLiteState(url[len("sqlite:///"):])
+    if url.startswith("memory:"):
+        return MemoryState()
+    if url.startswith(("redis:", "rediss:", "unix:")):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("STATE_URL points to Redis, install the redis package") from None
+        return RedisState(redis.Redis.from_url(url))
+    raise ValueError(f"Unsupported STATE_URL {url!r}, expected sqlite:///, redis:// or memory://")
+
+
+def session_secret(state) -> str:
+    """SESSION_SECRET, or else a secret the first worker generates and
+    stores in `state` so that every worker signs sessions with it"""
+    secret = os.environ.get("SESSION_SECRET")
+    if secret:
+        return secret
+    state.add("session-secret", secrets.token_urlsafe(32))
+    return state.get("session-secret")
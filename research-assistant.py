@@ -298,48 +298,210 @@
 #     uvicorn.run(app, host="0.0.0.0", port=port)
 
 import os
+import re
 import json
+import math
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
 import secrets
-import markdown
-from fastapi import FastAPI, HTTPException, Request, Form, Depends
-from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, Request, Depends
+from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
-from fastapi.middleware.cors import CORSMiddleware
-import requests
-from bs4 import BeautifulSoup
-from langchain.prompts import ChatPromptTemplate, PromptTemplate
-from langchain.schema.output_parser import StrOutputParser
-from langchain.schema.runnable import RunnablePassthrough
-from langchain_community.utilities import DuckDuckGoSearchAPIWrapper
-from langchain_groq import ChatGroq
+# langchain_core directly: the `langchain` re-exports pull in the whole
+# package and cost most of a second at startup
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnablePassthrough, RunnableLambda, RunnableBranch
 from dotenv import load_dotenv
 import uvicorn
+from ra_fetch import get_fetcher
+from ra_extract import extract_text, make_extractor
+from ra_cache import SingleFlight, TieredCache, make_key
+from ra_jobs import JobQueue, QueueFull, owner_id
+from ra_models import STAGE_SETTINGS, ModelRouter, ModelSettings, configurable_models, stage_model
+from ra_context import TOKEN_BUDGET, pack_context
+from ra_retrieval import ChunkIndex
+from ra_metrics import current_trace, get_trace, llm_metrics, record, registry, start_trace, timed, traces
+from ra_metrics import fetch_bytes, fetch_responses
+from ra_langgraph import arun_report, astream_report, checkpoint_stats, section_limiter
+from ra_langgraph import warm_up as warm_up_sections
+from ra_report_cache import ReportCache
+from ra_gather import Hedger, gather_quorum
+from ra_render import MarkdownRenderer
+from ra_ratelimit import RATE_LIMIT, RateLimitScheduler, scheduled
+from ra_batch import BATCH_TEMPLATE, SUMMARY_BATCH, PageSummaries, SummaryBatcher, batch_stats
+from ra_batch import format_pages, match_summaries
+from ra_state import open_state, session_secret
+from ra_history import ReportHistory
 
 # Load environment variables from .env file (for local dev, optional in cloud)
 load_dotenv()
 
-# Initialize DuckDuckGo search
-ddg_search = DuckDuckGoSearchAPIWrapper()
+logger = logging.getLogger("research_assistant")
 
-def get_model(api_key: str):
+# DuckDuckGo search and the Groq client are imported on first use (or by
+# warm_up), which keeps importing this module fast
+ddg_search = None
+
+def get_search():
+    global ddg_search
+    if ddg_search is None:
+        from langchain_community.utilities import DuckDuckGoSearchAPIWrapper
+        ddg_search = DuckDuckGoSearchAPIWrapper()
+    return ddg_search
+
+# What the worker processes share (see ra_state and gunicorn.conf.py): the
+# session secret, rate limits and in-flight searches. The SQLite caches are
+# shared by the workers of a node anyway; with Redis they move there too
+shared_state = open_state()
+cache_store = shared_state if shared_state.distributed else None
+
+# Requests and tokens per minute per API key and model; every chat model
+# call waits for its share, report calls ahead of page summaries
+rate_limiter = RateLimitScheduler(state=shared_state)
+
+def key_rate_limits(api_key: str):
+    return rate_limiter.get(api_key) if RATE_LIMIT else None
+
+def get_http_client(api_key: str):
+    """The async HTTP client, and so the connection pool, of an API key's chat models"""
+    import groq
+
+    async def follow_rate_limits(response):
+        # Groq reports the key's token limit for the model and what is left
+        # on every response; the model is in the request
+        model = json.loads(response.request.content or b"{}").get("model")
+        if model:
+            await rate_limiter.get(api_key).budget(model).update(response.headers)
+
+    return groq.DefaultAsyncHttpxClient(event_hooks={"response": [follow_rate_limits]})
+
+def get_model(api_key: str, settings: ModelSettings = STAGE_SETTINGS["report"], http_client=None):
     if not api_key:
         raise ValueError("API key is required")
+    from langchain_groq import ChatGroq
+
     return ChatGroq(
         groq_api_key=api_key,
-        model_name="llama-3.3-70b-versatile",
-        temperature=0.7,
-        max_tokens=32768,
+        model_name=settings.model,
+        temperature=settings.temperature,
+        max_tokens=settings.max_tokens,
         top_p=1,
-        verbose=True
+        verbose=True,
+        http_async_client=http_client or get_http_client(api_key),
     )
 
+# One client per API key and model setting, reused across requests; every
+# stage gets the model configured for it in ra_models, and all of them use
+# the key's one HTTP client. The lambdas keep get_model patchable.
+model_router = ModelRouter(lambda api_key, settings, http_client: get_model(api_key, settings, http_client),
+                           http_client=lambda api_key: get_http_client(api_key))
+
+def configured_model(stage: str = None):
+    """Stands in for the model in chains that are built once and shared; the
+    actual models are passed per call in config["configurable"]. Async calls
+    wait for the API key's rate limit when the config has one"""
+
+    def invoke(x, config):
+        return stage_model(config, stage).invoke(x, config)
+
+    async def ainvoke(x, config):
+        model = stage_model(config, stage)
+        async with scheduled(config, stage, model, x) as call:
+            return call.used(await model.ainvoke(x, config))
+
+    return RunnableLambda(invoke, afunc=ainvoke)
+
+def model_runnable(model=None, stage: str = None):
+    """The model step of a chain; `stage` picks the routed model and tags its calls for the LLM metrics"""
+    runnable = model if model is not None else configured_model(stage)
+    return runnable.with_config(tags=[f"stage:{stage}"]) if stage else runnable
+
 RESULTS_PER_QUESTION = 3
 
+# Multi-query mode: how many generated queries and results per query a
+# request may ask for, and how many pages are summarized at once, across
+# every request of the worker
+MAX_QUERIES = 5
+MAX_RESULTS_PER_QUERY = 10
+SUMMARY_CONCURRENCY = int(os.environ.get("SUMMARY_CONCURRENCY", 16))
+_summary_limits = weakref.WeakKeyDictionary()
+
+def summary_limit():
+    """The SUMMARY_CONCURRENCY cap shared by the requests on this event loop"""
+    # A semaphore is bound to the loop it is first used on
+    loop = asyncio.get_running_loop()
+    limit = _summary_limits.get(loop)
+    if limit is None:
+        limit = _summary_limits[loop] = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+    return limit
+
+# The report is written once SUMMARY_QUORUM of the sources are summarized and
+# the rest had SUMMARY_GRACE more seconds, or after SUMMARY_DEADLINE seconds;
+# stragglers are cancelled. Page fetches slower than the recent p95 are hedged
+SUMMARY_QUORUM = float(os.environ.get("SUMMARY_QUORUM", 0.8))
+SUMMARY_GRACE = float(os.environ.get("SUMMARY_GRACE", 2.0))
+SUMMARY_DEADLINE = float(os.environ.get("SUMMARY_DEADLINE", 30))
+FETCH_HEDGE = int(os.environ.get("FETCH_HEDGE", 1))
+
+# Search results are cached by normalized query, and concurrent identical
+# queries share a single DuckDuckGo call, also across worker processes
+search_cache = TieredCache("search", ttl=float(os.environ.get("SEARCH_CACHE_TTL", 6 * 3600)), shared=cache_store)
+search_flight = SingleFlight(shared_state)
+search_upstream_calls = 0
+
+def normalize_query(query: str):
+    query = "".join(c if c.isalnum() else " " for c in query.casefold())
+    return " ".join(query.split())
+
+def search_cache_key(query: str, nums_results: int):
+    return make_key("search", normalize_query(query), nums_results)
+
+def _search_links(query: str, nums_results: int):
+    global search_upstream_calls
+    search_upstream_calls += 1
+    with timed("search_upstream"):
+        results = get_search().results(query, nums_results)
+    links = [r["link"] for r in results]
+    if links:
+        search_cache.set(search_cache_key(query, nums_results), links)
+    return links
+
 def webSearch(query: str, nums_results: int=RESULTS_PER_QUESTION):
-    results = ddg_search.results(query, nums_results)
-    return [r["link"] for r in results]
+    with timed("search") as span:
+        key = search_cache_key(query, nums_results)
+        cached = search_cache.get(key)
+        if cached is not None:
+            span["cached"] = True
+            return cached
+        return search_flight.do_sync(key, lambda: _search_links(query, nums_results),
+                                     lambda: search_cache.get(key))
+
+async def awebSearch(query: str, nums_results: int=RESULTS_PER_QUESTION):
+    with timed("search") as span:
+        key = search_cache_key(query, nums_results)
+        cached = await search_cache.aget(key)
+        if cached is not None:
+            span["cached"] = True
+            return cached
+        # DuckDuckGoSearchAPIWrapper has no async API, so keep it off the event loop
+        return await search_flight.do(key, lambda: asyncio.to_thread(_search_links, query, nums_results),
+                                      lambda: search_cache.aget(key))
+
+def search_stats():
+    stats = search_cache.stats()
+    stats["upstream_calls"] = search_upstream_calls
+    stats["coalesced"] = search_flight.coalesced
+    stats["coalesced_across_workers"] = search_flight.shared_coalesced
+    stats["upstream_calls_saved"] = stats["memory_hits"] + stats["disk_hits"] + search_flight.coalesced
+    return stats
 
 template = """{context} 
 -----------
@@ -351,36 +513,341 @@ if the question cannot be answered using the text, imply summarize the text. Inc
 def get_summarize_prompt():
     return ChatPromptTemplate.from_template(template=template)
 
+# Bump automatically whenever the summarize prompt changes
+PROMPT_VERSION = make_key(template)[:12]
+BATCH_PROMPT_VERSION = make_key(BATCH_TEMPLATE)[:12]
+
+# Only this many characters of each page reach the summarizer, picked from
+# up to PAGE_TEXT_MAX_CHARS of extracted text by chunk_index
+PAGE_CHAR_BUDGET = 5000
+PAGE_TEXT_MAX_CHARS = int(os.environ.get("PAGE_TEXT_MAX_CHARS", 50000))
+
+# Extracted page text is keyed by URL, summaries by URL, question, prompt and model
+page_cache = TieredCache("pages", ttl=float(os.environ.get("PAGE_CACHE_TTL", 24 * 3600)), memory_entries=256,
+                         shared=cache_store)
+summary_cache = TieredCache("summaries", ttl=float(os.environ.get("SUMMARY_CACHE_TTL", 7 * 24 * 3600)),
+                            shared=cache_store)
+chunk_index = ChunkIndex()
+
+def page_cache_key(url: str):
+    return make_key("page", url, PAGE_TEXT_MAX_CHARS)
+
+def summary_cache_key(url: str, question: str, model_name: str, version: str = PROMPT_VERSION):
+    return make_key("summary", url, question, version, chunk_index.version, model_name)
+
+def get_model_name(model):
+    return getattr(model, "model_name", None) or type(model).__name__
+
+def html_to_text(html: str):
+    return extract_text(html, max_chars=PAGE_TEXT_MAX_CHARS)
+
+class TimedExtractor:
+    """Feeds an extractor of the EXTRACTOR engine and adds up the time spent parsing.
+
+    Parsing happens while the page streams in, so this is how the parse
+    time is told apart from the download time.
+    """
+
+    def __init__(self, max_chars: int):
+        self.extractor = make_extractor(max_chars=max_chars)
+        self.seconds = 0.0
+
+    @property
+    def incremental(self) -> bool:
+        return self.extractor.incremental
+
+    def feed(self, chunk: str) -> bool:
+        start = time.perf_counter()
+        try:
+            return self.extractor.feed(chunk)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def text(self) -> str:
+        start = time.perf_counter()
+        self.extractor.close()
+        text = self.extractor.text()
+        self.seconds += time.perf_counter() - start
+        return text
+
+def record_fetch(url: str, start: float, page=None, parse_seconds: float = 0.0, error: Exception = None):
+    elapsed = time.perf_counter() - start
+    if error is not None:
+        logger.warning("Failed to fetch %s: %s", url, error)
+        fetch_responses.inc(status="error")
+    else:
+        fetch_bytes.inc(page.bytes_read)
+        fetch_responses.inc(status=page.status_code)
+    record("fetch", start, elapsed - parse_seconds, error is not None, url=url)
+    if parse_seconds:
+        record("parse", start, parse_seconds, url=url)
+
 def scrapeText(url: str):
+    cached = page_cache.get(page_cache_key(url))
+    if cached is not None:
+        return cached
+    start = time.perf_counter()
+    try:
+        # Parse while downloading and stop reading once the budget is filled
+        extractor = TimedExtractor(PAGE_TEXT_MAX_CHARS)
+        page = get_fetcher().fetch_sync(url, on_text=extractor.feed)
+        if page.status_code == 200:
+            text = extractor.text()
+            if not text:
+                parse_start = time.perf_counter()
+                text = html_to_text(page.text)
+                extractor.seconds += time.perf_counter() - parse_start
+            record_fetch(url, start, page, extractor.seconds)
+            page_cache.set(page_cache_key(url), text)
+            return text
+        else:
+            record_fetch(url, start, page, extractor.seconds)
+            return f"Failed to retrieve webpage: Status code {page.status_code}"
+    except Exception as e:
+        record_fetch(url, start, error=e)
+        return f"Failed to retrieve the webpage: {e}"
+
+fetch_hedger = Hedger()
+
+async def _afetch_page(url: str):
+    extractor = TimedExtractor(PAGE_TEXT_MAX_CHARS)
+    page = await get_fetcher().fetch(url, on_text=extractor.feed)
+    return page, extractor
+
+async def ascrapeText(url: str):
+    cached = await page_cache.aget(page_cache_key(url))
+    if cached is not None:
+        return cached
+    start = time.perf_counter()
     try:
-        response = requests.get(url=url)
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, "html.parser")
-            page_text = soup.get_text(separator=" ", strip=True)
-            return page_text
+        if FETCH_HEDGE:
+            page, extractor = await fetch_hedger.run(lambda: _afetch_page(url))
+        else:
+            page, extractor = await _afetch_page(url)
+        if page.status_code == 200:
+            if extractor.incremental:
+                text = extractor.text()
+            else:
+                # The whole page is parsed now, CPU bound like the fallback
+                text = await asyncio.to_thread(extractor.text)
+            if not text:
+                # BeautifulSoup fallback is CPU bound, run it in a worker thread
+                parse_start = time.perf_counter()
+                text = await asyncio.to_thread(html_to_text, page.text)
+                extractor.seconds += time.perf_counter() - parse_start
+            record_fetch(url, start, page, extractor.seconds)
+            await page_cache.aset(page_cache_key(url), text)
+            return text
         else:
-            return f"Failed to retrieve webpage: Status code {response.status_code}"
+            record_fetch(url, start, page, extractor.seconds)
+            return f"Failed to retrieve webpage: Status code {page.status_code}"
     except Exception as e:
-        print(e)
+        record_fetch(url, start, error=e)
         return f"Failed to retrieve the webpage: {e}"
 
-def get_scrape_and_summarize_chain(model):
+def select_context(question: str, url: str, text: str):
+    if is_failed_scrape(text):
+        return text
+    with timed("retrieve"):
+        return chunk_index.select(question, url, text, PAGE_CHAR_BUDGET)
+
+def _scrape_context(x):
+    return select_context(x["question"], x["url"], scrapeText(x["url"]))
+
+async def _ascrape_context(x):
+    text = await ascrapeText(x["url"])
+    # Chunking and embedding are CPU bound, keep them off the event loop
+    return await asyncio.to_thread(select_context, x["question"], x["url"], text)
+
+def normalize_url(url: str):
+    parts = urlsplit(url)
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ""))
+
+def merge_urls(url_lists):
+    """Interleave the result lists so every query's top hits come first, dropping duplicates"""
+    seen = set()
+    urls = []
+    for rank in range(max((len(l) for l in url_lists), default=0)):
+        for l in url_lists:
+            if rank < len(l) and normalize_url(l[rank]) not in seen:
+                seen.add(normalize_url(l[rank]))
+                urls.append(l[rank])
+    return urls
+
+def multiSearch(queries, nums_results: int=RESULTS_PER_QUESTION):
+    with ThreadPoolExecutor(max_workers=max(1, len(queries))) as executor:
+        return merge_urls(list(executor.map(lambda q: webSearch(q, nums_results), queries)))
+
+async def amultiSearch(queries, nums_results: int=RESULTS_PER_QUESTION):
+    results = await asyncio.gather(*(awebSearch(q, nums_results) for q in queries))
+    return merge_urls(results)
+
+def _web_search(x):
+    return webSearch(x["question"], x.get("results_per_query", RESULTS_PER_QUESTION))
+
+async def _aweb_search(x):
+    return await awebSearch(x["question"], x.get("results_per_query", RESULTS_PER_QUESTION))
+
+def _multi_search(x):
+    return multiSearch(x["queries"], x.get("results_per_query", RESULTS_PER_QUESTION))
+
+async def _amulti_search(x):
+    return await amultiSearch(x["queries"], x.get("results_per_query", RESULTS_PER_QUESTION))
+
+def is_failed_scrape(text: str):
+    return text.startswith(("Failed to retrieve webpage", "Failed to retrieve the webpage"))
+
+def cached_summary(summarize, model=None, stage: str = "summarize", version: str = PROMPT_VERSION,
+                   on_hit=None):
+    """Look up the summary cache before running `summarize`; `on_hit()` is called on a hit"""
+
+    def run(x, config):
+        with timed("summarize") as span:
+            model_name = get_model_name(model if model is not None else stage_model(config, stage))
+            key = summary_cache_key(x["url"], x["question"], model_name, version)
+            cached = summary_cache.get(key)
+            if cached is not None:
+                span["cached"] = True
+                if on_hit is not None:
+                    on_hit()
+                return cached
+            summary = summarize.invoke(x, config)
+            if not is_failed_scrape(x["context"]):
+                summary_cache.set(key, summary)
+            return summary
+
+    async def arun(x, config):
+        with timed("summarize") as span:
+            model_name = get_model_name(model if model is not None else stage_model(config, stage))
+            key = summary_cache_key(x["url"], x["question"], model_name, version)
+            cached = await summary_cache.aget(key)
+            if cached is not None:
+                span["cached"] = True
+                if on_hit is not None:
+                    on_hit()
+                return cached
+            summary = await summarize.ainvoke(x, config)
+            if not is_failed_scrape(x["context"]):
+                await summary_cache.aset(key, summary)
+            return summary
+
+    return RunnableLambda(run, afunc=arun)
+
+def get_page_summary_chain(model=None):
+    return get_summarize_prompt() | model_runnable(model, "summarize") | StrOutputParser()
+
+def get_summary_chain(model=None):
+    return cached_summary(get_page_summary_chain(model), model)
+
+def get_batch_summary_prompt():
+    return ChatPromptTemplate.from_template(template=BATCH_TEMPLATE)
+
+def get_batch_summary_chain(model=None):
+    """Summaries of several pages for one question from one structured output call,
+    None for the pages the model left out"""
+    prompt = get_batch_summary_prompt()
+
+    def prompt_input(pages):
+        return {"pages": format_pages(pages), "count": len(pages), "question": pages[0]["question"]}
+
+    def structured(chat_model):
+        return chat_model.with_structured_output(PageSummaries, include_raw=True).with_config(tags=["stage:batch"])
+
+    def run(pages, config):
+        chat_model = model if model is not None else stage_model(config, "batch")
+        result = structured(chat_model).invoke(prompt.invoke(prompt_input(pages)), config)
+        return match_summaries(result["parsed"], len(pages))
+
+    async def arun(pages, config):
+        chat_model = model if model is not None else stage_model(config, "batch")
+        messages = await prompt.ainvoke(prompt_input(pages))
+        async with scheduled(config, "batch", chat_model, messages) as call:
+            result = await structured(chat_model).ainvoke(messages, config)
+            call.used(result["raw"])
+        return match_summaries(result["parsed"], len(pages))
+
+    return RunnableLambda(run, afunc=arun)
+
+def format_summary(x):
+    return f"URL: {x['url']} \n\nSummary: {x['summary']}"
+
+def get_scrape_and_summarize_chain(model=None):
     return RunnablePassthrough.assign(
-        summary = RunnablePassthrough.assign(
-        context = lambda x: scrapeText(x["url"])[:5000]
-    ) | get_summarize_prompt() | model | StrOutputParser()
-    ) | (lambda x: f"URL: {x['url']} \n\nSummary: {x['summary']}")
+        context = RunnableLambda(_scrape_context, afunc=_ascrape_context)
+    ) | RunnablePassthrough.assign(
+        summary = get_summary_chain(model)
+    ) | format_summary
+
+def page_summarizer(model, config, expected: int):
+    """`summarize(x)` for the `expected` pages of one request, batched unless
+    SUMMARY_BATCH is off, and the batcher to close once the request is done"""
+    if model is None:
+        summary, page_summary, batch_summary = summary_chain, page_summary_chain, batch_summary_chain
+    else:
+        summary, page_summary, batch_summary = (
+            get_summary_chain(model), get_page_summary_chain(model), get_batch_summary_chain(model))
+    if not SUMMARY_BATCH or expected < 2:
+        return lambda x: summary.ainvoke(x, config), None
+    batcher = SummaryBatcher(
+        lambda pages: batch_summary.ainvoke(pages, config),
+        lambda x: page_summary.ainvoke(x, config),
+        expected,
+    )
+    batched = cached_summary(RunnableLambda(batcher.summarize), model, "batch", BATCH_PROMPT_VERSION,
+                             on_hit=batcher.skip)
+    return lambda x: batched.ainvoke(x, config), batcher
+
+gather_stats = {"runs": 0, "sources": 0, "dropped": 0, "failed": 0}
+
+async def gather_summaries(calls):
+    """Run the per-URL coroutine functions `calls`, leaving out stragglers and failures"""
+    quorum = max(1, math.ceil(len(calls) * SUMMARY_QUORUM))
+    with timed("gather") as span:
+        results, stats = await gather_quorum(calls, quorum, SUMMARY_DEADLINE, SUMMARY_GRACE)
+        span.update(dropped=stats["dropped"], failed=stats["failed"])
+    gather_stats["runs"] += 1
+    gather_stats["sources"] += stats["total"]
+    gather_stats["dropped"] += stats["dropped"]
+    gather_stats["failed"] += stats["failed"]
+    return [r for r in results if r is not None], stats
+
+def get_summarize_urls_chain(model=None):
+    """Scrape and summarize each URL; the async path batches pages (see ra_batch)
+    and does not wait for stragglers"""
+    chain = get_scrape_and_summarize_chain(model)
+
+    def run(inputs, config):
+        return chain.batch(inputs, config)
 
-def get_web_search_chain(model):
+    async def arun(inputs, config):
+        limit = summary_limit()
+        summarize_page, batcher = page_summarizer(model, config, len(inputs))
+
+        async def summarize(x):
+            async with limit:
+                x = {**x, "context": await _ascrape_context(x)}
+                return format_summary({**x, "summary": await summarize_page(x)})
+
+        try:
+            summaries, _ = await gather_summaries([lambda x=x: summarize(x) for x in inputs])
+        finally:
+            if batcher is not None:
+                batcher.close()
+        return summaries
+
+    return RunnableLambda(run, afunc=arun)
+
+def get_web_search_chain(model=None):
     return RunnablePassthrough.assign(
-        urls = lambda x: webSearch(x["question"])
-    )| (lambda x: [{"question": x["question"], "url": u} for u in x["urls"]]) | get_scrape_and_summarize_chain(model).map()
+        urls = RunnableLambda(_web_search, afunc=_aweb_search)
+    )| (lambda x: [{"question": x["question"], "url": u} for u in x["urls"]]) | get_summarize_urls_chain(model)
 
 SEARCH_PROMPT = ChatPromptTemplate.from_messages(
     [
         (
             "user",
-            "Write 3 google search queries to search online that are form an"
+            "Write {num_queries} google search queries to search online that are form an"
             "objective opinion from the following: {question}\n"
             "You must respond with a list of strings in the following format"
             '["query1", "query2", "query3"]',
@@ -388,8 +855,37 @@ SEARCH_PROMPT = ChatPromptTemplate.from_messages(
     ]
 )
 
-def get_search_question_chain(model):
-    return SEARCH_PROMPT | model | StrOutputParser() | json.loads
+def parse_search_queries(text: str):
+    # Models sometimes wrap the list in prose or a code fence
+    match = re.search(r"\[.*\]", text, re.DOTALL)
+    try:
+        queries = json.loads(match.group(0) if match else text)
+    except ValueError:
+        return []
+    return [q for q in queries if isinstance(q, str) and q.strip()] if isinstance(queries, list) else []
+
+def get_search_question_chain(model=None):
+    return SEARCH_PROMPT | model_runnable(model, "plan") | StrOutputParser() | parse_search_queries
+
+def _pick_queries(x):
+    # Fall back to the raw question if the model gave us nothing usable
+    return x["queries"][: x["num_queries"]] or [x["question"]]
+
+def get_multi_query_search_chain(model=None):
+    """Search several generated queries at once and summarize the union of their results"""
+    return RunnablePassthrough.assign(
+        queries = get_search_question_chain(model)
+    ) | RunnablePassthrough.assign(
+        queries = _pick_queries
+    ) | RunnablePassthrough.assign(
+        urls = RunnableLambda(_multi_search, afunc=_amulti_search)
+    ) | (lambda x: [{"question": x["question"], "url": u} for u in x["urls"]]) | get_summarize_urls_chain(model)
+
+def get_research_search_chain(model=None):
+    return RunnableBranch(
+        (lambda x: x.get("num_queries", 1) > 1, get_multi_query_search_chain(model)),
+        get_web_search_chain(model),
+    ).with_config(max_concurrency=SUMMARY_CONCURRENCY)
 
 WRITER_SYSTEM_TEMPLATE = "You are an AI critical thinker research assistant. Your sole purpose is to write well written, critically acclaimed, objective and structured reports on given text."
 
@@ -415,16 +911,134 @@ def get_prompt():
         ]
     )
 
-def collapse_lists(list_of_lists):
-    content = []
-    for l in list_of_lists:
-        content.append("\n\n".join(l))
-    return "\n\n".join(content)
+# Set RECORD_RUNS to a .jsonl path to save the summaries of each run, see benchmarks/bench_context.py
+RECORD_RUNS = os.environ.get("RECORD_RUNS")
+record_lock = threading.Lock()
+context_stats = {"runs": 0, "tokens_before": 0, "tokens_after": 0, "duplicates_removed": 0}
+
+def summary_sources(summaries):
+    """Split format_summary output into (header, summary) pairs"""
+    sources = []
+    for summary in summaries:
+        header, sep, text = summary.partition("\n\nSummary: ")
+        sources.append((header + sep, text) if sep else ("", summary))
+    return sources
+
+def summary_urls(summaries):
+    """format_summary output as {"url", "summary"} dicts"""
+    return [{"url": header.removeprefix("URL: ").strip(), "summary": text}
+            for header, text in summary_sources(summaries)]
+
+def pack_summaries(question: str, summaries, budget: int = TOKEN_BUDGET):
+    """Fit the per-URL summaries into the report prompt's token budget"""
+    if RECORD_RUNS:
+        with record_lock, open(RECORD_RUNS, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"question": question, "summaries": summaries}) + "\n")
+    with timed("pack"):
+        packed, stats = pack_context(question, summary_sources(summaries), budget)
+    context_stats["runs"] += 1
+    for name in ("tokens_before", "tokens_after", "duplicates_removed"):
+        context_stats[name] += stats[name]
+    return packed
 
-def get_chain(model):
+def get_chain(model=None):
     return RunnablePassthrough.assign(
-        research_summary = get_web_search_chain(model) | collapse_lists
-    ) | get_prompt() | model | StrOutputParser()
+        summaries = get_research_search_chain(model)
+    ) | RunnablePassthrough.assign(
+        research_summary = lambda x: pack_summaries(x["question"], x["summaries"])
+    ) | get_prompt() | model_runnable(model, "report") | StrOutputParser()
+
+def get_sourced_chain(model=None):
+    """get_chain returning {"summaries": [...], "report": "..."}, so the sources can go in the history"""
+    return RunnablePassthrough.assign(
+        summaries = get_research_search_chain(model)
+    ) | RunnablePassthrough.assign(
+        report = RunnablePassthrough.assign(
+            research_summary = lambda x: pack_summaries(x["question"], x["summaries"])
+        ) | get_prompt() | model_runnable(model, "report") | StrOutputParser()
+    )
+
+# Built once; pass the model at invoke time with model_config(model)
+research_chain = get_chain()
+research_sourced_chain = get_sourced_chain()
+summary_chain = get_summary_chain()
+page_summary_chain = get_page_summary_chain()
+batch_summary_chain = get_batch_summary_chain()
+search_question_chain = get_search_question_chain()
+
+def model_config(model, rate_limits=None):
+    """Run config for the shared chains; `model` is a chat model or a {stage: model} dict,
+    `rate_limits` the API key's budget from `key_rate_limits`"""
+    configurable = configurable_models(model)
+    if rate_limits is not None:
+        configurable["rate_limits"] = rate_limits
+    return {"configurable": configurable, "callbacks": [llm_metrics]}
+
+async def astream_research(model, question: str, num_queries: int = 1,
+                           results_per_query: int = RESULTS_PER_QUESTION, rate_limits=None):
+    """Run the research pipeline, yielding (event, data) pairs as it goes.
+
+    Progress events are sent while searching, fetching and summarizing, a
+    sources event has the per-URL summaries, then the report is streamed
+    token by token. `model` is a chat model or a {stage: model} dict from
+    `model_router`.
+    """
+    config = model_config(model, rate_limits)
+    if num_queries > 1:
+        yield "progress", {"stage": "planning"}
+        queries = await search_question_chain.ainvoke(
+            {"question": question, "num_queries": num_queries}, config=config
+        )
+        queries = _pick_queries({"question": question, "queries": queries, "num_queries": num_queries})
+    else:
+        queries = [question]
+    yield "progress", {"stage": "searching", "queries": queries}
+    urls = await amultiSearch(queries, results_per_query)
+    total = len(urls)
+    yield "progress", {"stage": "searched", "urls": urls}
+
+    events = asyncio.Queue()
+    limit = summary_limit()
+    summarize_page, batcher = page_summarizer(None, config, total)
+
+    async def scrape_and_summarize(url):
+        async with limit:
+            x = {"question": question, "url": url}
+            x["context"] = await _ascrape_context(x)
+            events.put_nowait("fetched")
+            x["summary"] = await summarize_page(x)
+            events.put_nowait("summarized")
+            return format_summary(x)
+
+    gathering = asyncio.create_task(gather_summaries([lambda u=u: scrape_and_summarize(u) for u in urls]))
+    gathering.add_done_callback(lambda _: events.put_nowait(None))
+    try:
+        counts = {"fetched": 0, "summarized": 0}
+        while (event := await events.get()) is not None:
+            counts[event] += 1
+            yield "progress", {"stage": event, "done": counts[event], "total": total}
+        summaries, stats = gathering.result()
+    finally:
+        gathering.cancel()
+        if batcher is not None:
+            batcher.close()
+
+    # For the history, not sent to the client
+    yield "sources", {"sources": summary_urls(summaries)}
+    yield "progress", {"stage": "writing", "sources": stats["succeeded"], "dropped": stats["dropped"]}
+    # Deduplicating and ranking the passages is CPU-bound, keep it off the loop
+    research_summary = await asyncio.to_thread(pack_summaries, question, summaries)
+    messages = await get_prompt().ainvoke({"question": question, "research_summary": research_summary})
+    report_model = stage_model(config, "report")
+    async with scheduled(config, "report", report_model, messages) as call:
+        async for chunk in report_model.astream(messages, config={"callbacks": [llm_metrics], "tags": ["stage:report"]}):
+            call.used(chunk)
+            if chunk.content:
+                yield "token", {"text": chunk.content}
+    yield "done", {}
+
+def sse_event(event: str, data: dict):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 # FastAPI app setup
 app = FastAPI(
@@ -433,8 +1047,9 @@ app = FastAPI(
     description="An AI-powered research assistant that generates detailed reports based on web searches",
 )
 
-# Add session middleware
-app.add_middleware(SessionMiddleware, secret_key=secrets.token_urlsafe(32), session_cookie="research_session", max_age=3600)
+# Add session middleware. Every worker must sign sessions with the same
+# secret: SESSION_SECRET, or one generated once and kept in shared_state
+app.add_middleware(SessionMiddleware, secret_key=session_secret(shared_state), session_cookie="research_session", max_age=3600)
 
 # Define directories with absolute paths (assumes they exist in deployment)
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -444,9 +1059,155 @@ templates_dir = os.path.join(BASE_DIR, "templates")
 # Set up Jinja2 templates
 templates = Jinja2Templates(directory=templates_dir)
 
+# Reports are rendered to HTML in worker threads, with recent results cached
+renderer = MarkdownRenderer()
+
 # Serve static files
 app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
+# "search" writes the report from web search results, "sections" has the
+# LangGraph orchestrator plan sections and write them in parallel
+ENGINES = ("search", "sections")
+
+def report_thread_id(api_key: str, question: str):
+    # Asking the same question again resumes a sectioned report that failed
+    return make_key("report", owner_id(api_key), question)
+
+# Finished reports, looked up by normalized question. Reports are shared
+# across users, but only between requests that would write them the same
+# way, and a hit never shows whose question it was
+report_cache = ReportCache()
+
+def report_scope(engine: str, model, num_queries: int = 1, results_per_query: int = RESULTS_PER_QUESTION):
+    if isinstance(model, dict):
+        model_names = {stage: get_model_name(m) for stage, m in model.items()}
+    else:
+        model_names = get_model_name(model)
+    # The sectioned engine doesn't search
+    search = (num_queries, results_per_query) if engine == "search" else None
+    return make_key("report", engine, model_names, search, template, RESEARCH_REPORT_TEMPLATE)
+
+async def cached_stream(question: str, scope: str, stream, fresh: bool = False):
+    """Answer from the report cache, or pass `stream` through and cache the report it writes"""
+    if not fresh:
+        hit = await report_cache.alookup(question, scope)
+        if hit is not None:
+            await stream.aclose()
+            current_trace.get().attrs["cached"] = hit["id"]
+            yield "progress", {"stage": "cached", "created_at": hit["created_at"]}
+            yield "token", {"text": hit["report"]}
+            yield "done", {"cached": True}
+            return
+    parts = []
+    async for event, data in stream:
+        if event == "token":
+            parts.append(data["text"])
+        elif event == "done" and parts:
+            await report_cache.astore(question, scope, "".join(parts))
+        yield event, data
+
+# Every report a user gets is archived for them, see ra_history
+HISTORY = int(os.environ.get("HISTORY", 1))
+HISTORY_PAGE_SIZE = 10
+report_history = ReportHistory()
+
+async def archive_report(api_key: str, question: str, report: str, engine: str, sources=()):
+    """Add a report to the user's history; returns its id, or None if that failed"""
+    if not HISTORY:
+        return None
+    try:
+        return await report_history.aadd(owner_id(api_key), question, report, engine, sources)
+    except Exception:
+        # The user has the report either way
+        logger.exception("Archiving the report failed")
+        return None
+
+async def archived_stream(api_key: str, question: str, engine: str, stream):
+    """Pass `stream` through, minus its sources event, and archive the report it writes"""
+    parts, sources = [], []
+    async for event, data in stream:
+        if event == "sources":
+            sources = data["sources"]
+            continue
+        if event == "token":
+            parts.append(data["text"])
+        elif event == "done" and parts:
+            entry_id = await archive_report(api_key, question, "".join(parts), engine, sources)
+            if entry_id is not None:
+                data = {**data, "history_id": entry_id}
+        yield event, data
+
+async def run_research_job(question: str, api_key: str, num_queries: int = 1,
+                           results_per_query: int = RESULTS_PER_QUESTION, engine: str = "search",
+                           fresh: bool = False):
+    model = model_router.get(api_key)
+    rate_limits = key_rate_limits(api_key)
+    scope = report_scope(engine, model, num_queries, results_per_query)
+    with start_trace("job", engine=engine, num_queries=num_queries, results_per_query=results_per_query) as trace:
+        if not fresh:
+            hit = await report_cache.alookup(question, scope)
+            if hit is not None:
+                trace.attrs["cached"] = hit["id"]
+                await archive_report(api_key, question, hit["report"], engine)
+                return hit["report"]
+        sources = []
+        if engine == "sections":
+            report = await arun_report(question, model, thread_id=report_thread_id(api_key, question),
+                                       rate_limits=rate_limits, state=shared_state)
+        else:
+            result = await research_sourced_chain.ainvoke(
+                {"question": question, "num_queries": num_queries, "results_per_query": results_per_query},
+                config=model_config(model, rate_limits),
+            )
+            report, sources = result["report"], summary_urls(result["summaries"])
+        if not report:
+            # Never cached or archived, the next try runs the research again
+            raise RuntimeError("The research produced no report")
+        await report_cache.astore(question, scope, report)
+        await archive_report(api_key, question, report, engine, sources)
+        return report
+
+research_jobs = JobQueue(
+    run_research_job,
+    workers=int(os.environ.get("JOB_WORKERS", 4)),
+    max_queued=int(os.environ.get("JOB_MAX_QUEUED", 100)),
+    state=shared_state,
+)
+
+WARM_UP = int(os.environ.get("WARM_UP", 1))
+warm_up_task = None
+
+def _warm_up_imports():
+    get_search()
+    import langchain_groq  # noqa: F401
+    warm_up_sections()
+    chunk_index.embedder.embed(["warm up"])
+
+async def warm_up():
+    """Load the lazily imported dependencies before the first request needs them"""
+    start = time.perf_counter()
+    try:
+        await asyncio.to_thread(_warm_up_imports)
+        await renderer.arender("# Warm up\n\n| a | b |\n|---|---|\n| 1 | 2 |")
+    except Exception:
+        logger.exception("Warm-up failed, the first requests will load what is missing")
+        return
+    logger.info("Warmed up in %.2fs", time.perf_counter() - start)
+
+@app.on_event("startup")
+async def start_jobs():
+    global warm_up_task
+    await research_jobs.start()
+    if WARM_UP:
+        # In the background: the server answers requests while it runs
+        warm_up_task = asyncio.create_task(warm_up())
+
+@app.on_event("shutdown")
+async def close_fetcher():
+    await research_jobs.stop()
+    await get_fetcher().aclose()
+    renderer.shutdown()
+
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     return templates.TemplateResponse("api_key.html", {"request": request})
@@ -460,7 +1221,7 @@ async def set_api_key(request: Request):
     
     # Store the API key in the session
     request.session["api_key"] = api_key
-    return templates.TemplateResponse("research.html", {"request": request})
+    return templates.TemplateResponse("research.html", {"request": request, "history": await history_view(api_key)})
 
 @app.get("/logout")
 async def logout(request: Request):
@@ -468,6 +1229,32 @@ async def logout(request: Request):
     request.session.clear()
     return RedirectResponse(url="/", status_code=303)
 
+def wants_json(request: Request):
+    return "application/json" in request.headers.get("accept", "")
+
+def parse_int_field(form_data, name: str, default: int, low: int, high: int):
+    value = form_data.get(name) or default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"{name} must be a number")
+    if not low <= value <= high:
+        raise HTTPException(status_code=400, detail=f"{name} must be between {low} and {high}")
+    return value
+
+def parse_research_options(form_data):
+    engine = form_data.get("engine") or "search"
+    if engine not in ENGINES:
+        raise HTTPException(status_code=400, detail=f"engine must be one of {', '.join(ENGINES)}")
+    return {
+        "num_queries": parse_int_field(form_data, "num_queries", 1, 1, MAX_QUERIES),
+        "results_per_query": parse_int_field(
+            form_data, "results_per_query", RESULTS_PER_QUESTION, 1, MAX_RESULTS_PER_QUERY
+        ),
+        "engine": engine,
+        "fresh": form_data.get("fresh") in ("1", "true", "on"),
+    }
+
 @app.post("/research")
 async def research(request: Request):
     # Get the API key from the session
@@ -480,44 +1267,270 @@ async def research(request: Request):
     if not question:
         raise HTTPException(status_code=400, detail="Question is required")
 
+    options = parse_research_options(form_data)
+
+    # Hand the report off to the background workers
     try:
-        # Get the model with the API key from session
-        model = get_model(api_key)
-        
-        # Create the final chain
-        final_chain = get_chain(model)
-        
-        # Run the chain
-        result = final_chain.invoke({"question": question})
-        
-        # Convert markdown to HTML
-        result_html = markdown.markdown(
-            result, 
-            extensions=['fenced_code', 'tables', 'nl2br']
+        job_id = await research_jobs.submit(question, api_key, options)
+    except QueueFull as e:
+        if wants_json(request):
+            return JSONResponse({"detail": str(e)}, status_code=429, headers={"Retry-After": "30"})
+        return templates.TemplateResponse(
+            "research.html",
+            {
+                "request": request,
+                "error": str(e),
+                "question": question
+            },
+            status_code=429,
+            headers={"Retry-After": "30"},
         )
-        
+
+    if wants_json(request):
+        return JSONResponse({"job_id": job_id, "status_url": f"/jobs/{job_id}"}, status_code=202)
+    return RedirectResponse(url=f"/research?job={job_id}", status_code=303)
+
+@app.get("/jobs/{job_id}")
+async def job_status(request: Request, job_id: str, wait: float = 0):
+    api_key = request.session.get("api_key")
+    if not api_key:
+        raise HTTPException(status_code=401, detail="API key not found in session")
+
+    # Long poll: hold the request until the job finishes or `wait` seconds pass
+    if wait > 0 and await research_jobs.get(job_id, api_key) is not None:
+        await research_jobs.wait(job_id, timeout=min(wait, 60))
+
+    job = await research_jobs.get(job_id, api_key)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JSONResponse(job)
+
+@app.get("/history")
+async def list_history(request: Request, q: str = "", limit: int = 20, offset: int = 0):
+    api_key = request.session.get("api_key")
+    if not api_key:
+        raise HTTPException(status_code=401, detail="API key not found in session")
+
+    # Newest first, or the best matches for `q`
+    limit, offset = max(1, min(limit, 100)), max(0, offset)
+    if q.strip():
+        page = await report_history.asearch(owner_id(api_key), q, limit, offset)
+    else:
+        page = await report_history.alist(owner_id(api_key), limit, offset)
+    return JSONResponse(page)
+
+@app.get("/history/{entry_id}")
+async def history_entry(request: Request, entry_id: str):
+    api_key = request.session.get("api_key")
+    if not api_key:
+        raise HTTPException(status_code=401, detail="API key not found in session")
+
+    entry = await report_history.aget(entry_id, owner_id(api_key))
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Report not found")
+    return JSONResponse(entry)
+
+async def history_view(api_key: str, query: str = "", page: int = 1):
+    """Template context for a page of the user's past research"""
+    page = max(1, page)
+    offset = (page - 1) * HISTORY_PAGE_SIZE
+    if query.strip():
+        result = await report_history.asearch(owner_id(api_key), query, HISTORY_PAGE_SIZE, offset)
+    else:
+        result = await report_history.alist(owner_id(api_key), HISTORY_PAGE_SIZE, offset)
+    entries = [{**entry, "created": time.strftime("%Y-%m-%d %H:%M UTC", time.gmtime(entry["created_at"]))}
+               for entry in result["entries"]]
+    return {"query": query, "page": page, "pages": max(1, math.ceil(result["total"] / HISTORY_PAGE_SIZE)),
+            "total": result["total"], "entries": entries}
+
+@app.post("/research/stream")
+async def research_stream(request: Request):
+    api_key = request.session.get("api_key")
+    if not api_key:
+        raise HTTPException(status_code=401, detail="API key not found in session")
+
+    form_data = await request.form()
+    question = form_data.get("question")
+    if not question:
+        raise HTTPException(status_code=400, detail="Question is required")
+
+    options = parse_research_options(form_data)
+    model = model_router.get(api_key)
+    trace_attrs = dict(options)
+    engine = options.pop("engine")
+    fresh = options.pop("fresh")
+    rate_limits = key_rate_limits(api_key)
+    if engine == "sections":
+        stream = astream_report(question, model, thread_id=report_thread_id(api_key, question),
+                                rate_limits=rate_limits, state=shared_state)
+    else:
+        stream = astream_research(model, question, **options, rate_limits=rate_limits)
+    stream = cached_stream(question, report_scope(engine, model, **options), stream, fresh)
+    stream = archived_stream(api_key, question, engine, stream)
+
+    async def events():
+        with start_trace("stream", **trace_attrs):
+            try:
+                report = []
+                async for event, data in stream:
+                    if event == "token":
+                        report.append(data["text"])
+                    elif event == "done":
+                        # The client swaps the streamed text for the rendered report
+                        with timed("render"):
+                            data = {**data, "html": await renderer.arender("".join(report))}
+                    yield sse_event(event, data)
+            except Exception as e:
+                logger.exception("Research stream failed")
+                current_trace.get().error = repr(e)
+                yield sse_event("error", {"message": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Ask proxies not to buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/stats")
+async def stats():
+    # These read SQLite or the shared state, off the event loop like the other history calls
+    report_cache_stats, rate_limit_stats, history_stats = await asyncio.gather(
+        asyncio.to_thread(report_cache.stats),
+        asyncio.to_thread(rate_limiter.stats),
+        asyncio.to_thread(report_history.stats),
+    )
+    return JSONResponse({
+        "page_cache": page_cache.stats(),
+        "summary_cache": summary_cache.stats(),
+        "search": search_stats(),
+        "jobs": research_jobs.stats(),
+        "model_pool": model_router.stats(),
+        "context": context_stats,
+        "retrieval": chunk_index.stats(),
+        "sections": {**section_limiter.stats(), **checkpoint_stats},
+        "report_cache": report_cache_stats,
+        "gather": {**gather_stats, "hedging": fetch_hedger.stats()},
+        "batching": batch_stats,
+        "render": renderer.stats(),
+        "rate_limits": rate_limit_stats,
+        "history": history_stats,
+    })
+
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+def require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled, set ADMIN_TOKEN to enable them")
+    token = request.headers.get("authorization", "").removeprefix("Bearer ")
+    if not secrets.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.get("/admin/report-cache", dependencies=[Depends(require_admin)])
+async def list_cached_reports(limit: int = 100):
+    cache_stats, entries = await asyncio.gather(
+        asyncio.to_thread(report_cache.stats), asyncio.to_thread(report_cache.entries, limit))
+    return JSONResponse({"stats": cache_stats, "entries": entries})
+
+@app.delete("/admin/report-cache", dependencies=[Depends(require_admin)])
+async def invalidate_cached_reports(id: str = None, question: str = None):
+    """Drop one cached report by id, the reports for `question` and its rewordings, or with neither, all"""
+    removed = await asyncio.to_thread(report_cache.invalidate, id, question)
+    return JSONResponse({"removed": removed})
+
+cache_lookups = registry.gauge(
+    "research_cache_lookups", "Cache lookups since start, by cache and result", ["cache", "result"])
+jobs_gauge = registry.gauge("research_jobs", "Research jobs by state", ["state"])
+section_limit_gauge = registry.gauge("research_section_concurrency_limit", "Current section worker limit")
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics"""
+    caches = {"pages": page_cache, "summaries": summary_cache, "search": search_cache, "chunks": chunk_index.cache}
+    for name, cache in caches.items():
+        cache_stats = cache.stats()
+        for result in ("memory_hits", "disk_hits", "misses"):
+            cache_lookups.set(cache_stats[result], cache=name, result=result)
+    job_stats = research_jobs.stats()
+    for state in ("queue_depth", "running", "completed", "failed", "rejected"):
+        jobs_gauge.set(job_stats[state], state=state)
+    section_limit_gauge.set(section_limiter.stats()["limit"])
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+# Traces hold every URL a request fetched, so they are for admins only
+@app.get("/traces", dependencies=[Depends(require_admin)])
+async def list_traces():
+    """The most recent request traces, newest first"""
+    return JSONResponse([trace.summary() for trace in reversed(traces)])
+
+@app.get("/traces/{trace_id}", dependencies=[Depends(require_admin)])
+async def trace_detail(trace_id: str):
+    trace = get_trace(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return JSONResponse(trace.to_dict())
+
+@app.get("/research", response_class=HTMLResponse)
+async def research_page(request: Request, job: str = None, report: str = None, q: str = "", page: int = 1):
+    api_key = request.session.get("api_key")
+    if not api_key:
+        return templates.TemplateResponse("research.html", {"request": request})
+
+    if report:
+        # A report from the history: a disk read, no pipeline run
+        entry = await report_history.aget(report, owner_id(api_key))
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Report not found")
+        with timed("render"):
+            result_html = await renderer.arender(entry["report"])
         return templates.TemplateResponse(
             "research.html",
             {
                 "request": request,
-                "result": result,
+                "result": entry["report"],
                 "result_html": result_html,
-                "question": question
+                "question": entry["question"],
+                "sources": entry["sources"],
+                "archived": time.strftime("%Y-%m-%d %H:%M UTC", time.gmtime(entry["created_at"])),
             }
         )
-    except Exception as e:
+    if not job:
+        return templates.TemplateResponse("research.html", {"request": request, "history": await history_view(api_key, q, page)})
+
+    job = await research_jobs.get(job, api_key)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if job["status"] == "done":
+        # Convert markdown to HTML
+        with timed("render"):
+            result_html = await renderer.arender(job["result"])
         return templates.TemplateResponse(
             "research.html",
             {
                 "request": request,
-                "error": str(e),
-                "question": question
+                "result": job["result"],
+                "result_html": result_html,
+                "question": job["question"]
             }
         )
-
-@app.get("/research", response_class=HTMLResponse)
-async def research_page(request: Request):
-    return templates.TemplateResponse("research.html", {"request": request})
+    if job["status"] == "failed":
+        return templates.TemplateResponse(
+            "research.html",
+            {
+                "request": request,
+                "error": job["error"],
+                "question": job["question"]
+            }
+        )
+    return templates.TemplateResponse(
+        "research.html",
+        {
+            "request": request,
+            "job": job,
+            "question": job["question"]
+        }
+    )
 
 if __name__ == "__main__":
     # Use environment variable for port (required for cloud platforms like Render)
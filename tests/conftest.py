@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+# The benchmarks' stand-ins for Groq and the web (stubs.py) serve the tests too
+for path in (ROOT_DIR, os.path.join(ROOT_DIR, "benchmarks")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
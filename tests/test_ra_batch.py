@@ -0,0 +1,41 @@
+import asyncio
+
+from ra_batch import SummaryBatcher
+
+
+def test_pages_left_out_of_the_batch_answer_are_summarized_one_by_one():
+    batches = []
+    singles = []
+
+    async def summarize_batch(pages):
+        batches.append([x["url"] for x in pages])
+        # The model skipped the second page
+        return [f"batched {x['url']}" if i != 1 else None for i, x in enumerate(pages)]
+
+    async def summarize_page(x):
+        singles.append(x["url"])
+        return f"single {x['url']}"
+
+    async def main():
+        batcher = SummaryBatcher(summarize_batch, summarize_page, expected=3, linger=1)
+        pages = [{"url": f"page{n}", "context": "Some page text."} for n in range(3)]
+        return await asyncio.gather(*(batcher.summarize(x) for x in pages))
+
+    assert asyncio.run(main()) == ["batched page0", "single page1", "batched page2"]
+    assert batches == [["page0", "page1", "page2"]]
+    assert singles == ["page1"]
+
+
+def test_a_failed_batch_falls_back_for_every_page():
+    async def summarize_batch(pages):
+        raise ValueError("malformed structured output")
+
+    async def summarize_page(x):
+        return f"single {x['url']}"
+
+    async def main():
+        batcher = SummaryBatcher(summarize_batch, summarize_page, expected=2, linger=1)
+        pages = [{"url": f"page{n}", "context": "Some page text."} for n in range(2)]
+        return await asyncio.gather(*(batcher.summarize(x) for x in pages))
+
+    assert asyncio.run(main()) == ["single page0", "single page1"]
@@ -0,0 +1,73 @@
+import asyncio
+
+from ra_cache import SingleFlight
+
+
+def test_followers_get_the_result_when_the_leader_is_cancelled():
+    async def main():
+        flight = SingleFlight()
+        release = asyncio.Event()
+        calls = 0
+
+        async def fn():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return "links"
+
+        leader = asyncio.create_task(flight.do("key", fn))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("key", fn))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await follower == "links"
+        assert leader.cancelled()
+        assert calls == 1
+        assert flight.coalesced == 1
+
+    asyncio.run(main())
+
+
+def test_call_is_cancelled_once_every_caller_left():
+    async def main():
+        flight = SingleFlight()
+        started = asyncio.Event()
+        cancelled = False
+
+        async def fn():
+            nonlocal cancelled
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+
+        callers = [asyncio.create_task(flight.do("key", fn)) for _ in range(2)]
+        await started.wait()
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert cancelled
+        # A new caller starts a new call
+        assert await flight.do("key", lambda: asyncio.sleep(0, "again")) == "again"
+
+    asyncio.run(main())
+
+
+def test_errors_reach_every_caller():
+    async def main():
+        flight = SingleFlight()
+
+        async def fn():
+            await asyncio.sleep(0.01)
+            raise ValueError("search failed")
+
+        results = await asyncio.gather(*(flight.do("key", fn) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+        assert flight.coalesced == 2
+
+    asyncio.run(main())
@@ -0,0 +1,27 @@
+import asyncio
+
+from ra_clients import ModelPool
+
+
+class Client:
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self.closed = False
+
+    async def aclose(self):
+        self.closed = True
+
+
+def test_evicted_clients_are_closed():
+    async def main():
+        pool = ModelPool(Client, max_size=1, close=lambda client: client.aclose(), close_delay=0)
+        first = pool.get("a")
+        second = pool.get("b")
+        await asyncio.sleep(0.01)
+        assert first.closed
+        assert not second.closed
+        pool.clear()
+        await asyncio.sleep(0.01)
+        assert second.closed
+
+    asyncio.run(main())
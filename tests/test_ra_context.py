@@ -0,0 +1,34 @@
+from ra_context import count_tokens, pack_context
+
+FACT = "Green tea contains catechins, which are antioxidants that may lower the risk of heart disease."
+
+
+def filler(topic: str, count: int) -> str:
+    return "\n\n".join(f"Paragraph {n} is about {topic} and says nothing of note, number {n}." for n in range(count))
+
+
+def test_near_duplicate_passages_are_kept_once():
+    sources = [
+        ("Source: https://a.example\n", FACT),
+        # The same passage syndicated with a different last word
+        ("Source: https://b.example\n", FACT.replace("disease.", "disease!")),
+        ("Source: https://c.example\n", "Matcha is powdered green tea."),
+    ]
+    packed, stats = pack_context("benefits of green tea", sources)
+    assert stats["duplicates_removed"] == 1
+    assert packed.count("catechins") == 1
+    assert "Matcha" in packed
+
+
+def test_the_budget_is_respected_and_relevant_passages_win():
+    sources = [
+        ("Source: https://a.example\n", filler("the weather", 40) + "\n\n" + FACT),
+        ("Source: https://b.example\n", filler("football", 40)),
+    ]
+    packed, stats = pack_context("green tea catechins heart disease", sources, budget=200)
+    assert stats["tokens_before"] > 200
+    assert count_tokens(packed) <= 200
+    assert stats["passages_kept"] < stats["passages"]
+    assert "catechins" in packed
+    # Grouped by source, in source order
+    assert packed.startswith("Source: https://a.example")
@@ -0,0 +1,30 @@
+import pytest
+
+from ra_extract import DocumentExtractor, StreamingExtractor, make_extractor
+
+PAGE = "<html><body><nav>Menu</nav><main><p>Green tea has catechins.</p></main></body></html>"
+
+
+def feed(extractor, html):
+    for i in range(0, len(html), 16):
+        extractor.feed(html[i:i + 16])
+    extractor.close()
+    return extractor.text()
+
+
+def test_the_stream_engine_parses_as_the_page_arrives():
+    extractor = make_extractor("stream")
+    assert isinstance(extractor, StreamingExtractor)
+    assert feed(extractor, PAGE) == "Green tea has catechins."
+
+
+def test_a_document_engine_parses_the_whole_page():
+    extractor = make_extractor("soup", max_chars=100)
+    assert isinstance(extractor, DocumentExtractor)
+    assert not extractor.incremental
+    assert "Green tea has catechins." in feed(extractor, PAGE)
+
+
+def test_an_unknown_engine_is_refused():
+    with pytest.raises(ValueError):
+        make_extractor("lxml")
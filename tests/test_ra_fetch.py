@@ -0,0 +1,32 @@
+import asyncio
+import threading
+
+from ra_fetch import HostLimits
+
+
+def test_host_limits_cap_each_host_and_forget_idle_ones():
+    limits = HostLimits(lambda: asyncio.Semaphore(2))
+    running = {"a": 0, "b": 0}
+    peak = {"a": 0, "b": 0}
+
+    async def fetch(host):
+        async with limits.hold(host):
+            running[host] += 1
+            peak[host] = max(peak[host], running[host])
+            await asyncio.sleep(0.01)
+            running[host] -= 1
+
+    async def main():
+        await asyncio.gather(*(fetch(host) for host in ["a", "b"] * 5))
+
+    asyncio.run(main())
+    assert peak == {"a": 2, "b": 2}
+    assert len(limits) == 0
+
+
+def test_sync_host_limits_forget_idle_hosts():
+    limits = HostLimits(lambda: threading.BoundedSemaphore(1))
+    for n in range(100):
+        with limits.hold_sync(f"host{n}.example.com"):
+            assert len(limits) == 1
+    assert len(limits) == 0
@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+from ra_gather import Hedger, gather_quorum
+
+
+def cancelled_call():
+    async def call():
+        # What awaiting a SingleFlight task that its leader cancelled raises
+        raise asyncio.CancelledError()
+
+    return call
+
+
+def test_a_cancelled_call_counts_as_failed():
+    async def ok():
+        return "summary"
+
+    results, stats = asyncio.run(gather_quorum([cancelled_call(), ok], quorum=2))
+    assert results == [None, "summary"]
+    assert stats["failed"] == 1
+    assert stats["succeeded"] == 1
+
+
+def test_every_call_cancelled_raises():
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(gather_quorum([cancelled_call(), cancelled_call()], quorum=1))
+
+
+def test_hedger_takes_the_hedge_when_the_first_call_is_cancelled():
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            await asyncio.sleep(0.05)
+            raise asyncio.CancelledError()
+        await asyncio.sleep(0.1)
+        return "page"
+
+    hedger = Hedger(initial_delay=0.01)
+    assert asyncio.run(hedger.run(call)) == "page"
+    assert hedger.hedged == 1
@@ -0,0 +1,37 @@
+from ra_history import ReportHistory
+
+REPORT = "# Solid-state batteries\n\n" + "Solid-state batteries use a solid electrolyte. " * 50
+SOURCES = [{"url": "https://example.com/battery", "summary": "A solid electrolyte replaces the liquid one."}]
+
+
+def test_reports_round_trip_compressed(tmp_path):
+    history = ReportHistory(str(tmp_path / "history.sqlite3"))
+    entry_id = history.add("alice", "How do solid-state batteries work?", REPORT, "search", SOURCES)
+    entry = history.get(entry_id, "alice")
+    assert entry["report"] == REPORT
+    assert entry["sources"] == SOURCES
+    assert entry["question"] == "How do solid-state batteries work?"
+    stats = history.stats()
+    assert stats["stored_bytes"] < stats["bytes"]
+
+
+def test_owners_only_see_their_own_reports(tmp_path):
+    history = ReportHistory(str(tmp_path / "history.sqlite3"))
+    entry_id = history.add("alice", "How do solid-state batteries work?", REPORT)
+    history.add("bob", "Who invented the lithium-ion battery?", "John Goodenough and others.")
+    assert history.get(entry_id, "bob") is None
+    assert history.list("bob")["total"] == 1
+    assert history.search("bob", "batteries")["entries"][0]["question"].startswith("Who invented")
+    assert history.search("bob", "electrolyte")["total"] == 0
+
+
+def test_search_matches_stemmed_words_in_the_report_and_sources(tmp_path):
+    history = ReportHistory(str(tmp_path / "history.sqlite3"))
+    history.add("alice", "How do solid-state batteries work?", REPORT, "search", SOURCES)
+    history.add("alice", "What is green tea?", "A tea made from unoxidized leaves.")
+    # "battery" matches "batteries" after Porter stemming
+    result = history.search("alice", "battery electrolyte")
+    assert [e["question"] for e in result["entries"]] == ["How do solid-state batteries work?"]
+    assert history.search("alice", "liquid")["total"] == 1
+    # Quoted, so query syntax in user input is just words
+    assert history.search("alice", 'tea" OR "battery')["total"] == 0
@@ -0,0 +1,80 @@
+import asyncio
+
+from ra_jobs import DONE, FAILED, QUEUED, JobQueue, JobStore
+
+
+def test_job_cancelled_from_inside_fails_and_the_worker_goes_on(tmp_path):
+    async def run_job(question, api_key):
+        if question == "cancelled":
+            # What a shared call that was cancelled elsewhere raises
+            raise asyncio.CancelledError()
+        return f"report on {question}"
+
+    async def main():
+        queue = JobQueue(run_job, workers=1, store=JobStore(str(tmp_path / "jobs.sqlite3")))
+        await queue.start()
+        try:
+            first = await queue.submit("cancelled", "key")
+            second = await queue.submit("tea", "key")
+            await asyncio.wait_for(queue.wait(second), 5)
+            assert (await queue.get(first, "key"))["status"] == FAILED
+            job = await queue.get(second, "key")
+            assert job["status"] == DONE
+            assert job["result"] == "report on tea"
+            assert not any(task.done() for task in queue._tasks)
+        finally:
+            await queue.stop()
+
+    asyncio.run(main())
+
+
+def test_stop_puts_the_running_job_back_in_the_queue(tmp_path):
+    started = None
+
+    async def run_job(question, api_key):
+        started.set()
+        await asyncio.sleep(10)
+
+    async def main():
+        nonlocal started
+        started = asyncio.Event()
+        queue = JobQueue(run_job, workers=1, store=JobStore(str(tmp_path / "jobs.sqlite3")))
+        await queue.start()
+        job_id = await queue.submit("tea", "key")
+        await started.wait()
+        await queue.stop()
+        assert queue.store.get(job_id)["status"] == QUEUED
+
+    asyncio.run(main())
+
+
+def test_a_wait_that_times_out_forgets_its_event(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    # Queued by another worker process, which notifies nobody here
+    store.insert("job", "owner", "tea")
+
+    async def main():
+        queue = JobQueue(None, workers=0, store=store, poll=0.01)
+        await queue.wait("job", timeout=0.05)
+        assert queue._finished == {}
+
+    asyncio.run(main())
+
+
+def test_a_job_missing_from_the_store_is_skipped(tmp_path):
+    async def run_job(question, api_key):
+        return f"report on {question}"
+
+    async def main():
+        queue = JobQueue(run_job, workers=1, store=JobStore(str(tmp_path / "jobs.sqlite3")))
+        await queue.start()
+        try:
+            queue._queue.put_nowait("missing")
+            job_id = await queue.submit("tea", "key")
+            await asyncio.wait_for(queue.wait(job_id), 5)
+            assert (await queue.get(job_id, "key"))["status"] == DONE
+            assert not any(task.done() for task in queue._tasks)
+        finally:
+            await queue.stop()
+
+    asyncio.run(main())
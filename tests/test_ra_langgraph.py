@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+import stubs
+import ra_langgraph
+from ra_langgraph import EmptyPlan, arun_report, astream_report
+
+
+@pytest.fixture(autouse=True)
+def checkpoint_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(ra_langgraph, "CHECKPOINT_DB", str(tmp_path / "checkpoints.sqlite3"))
+
+
+def test_an_empty_plan_fails_instead_of_returning_no_report():
+    model = stubs.FakeChatModel(latency=0, sections=0)
+    with pytest.raises(EmptyPlan):
+        asyncio.run(arun_report("topic", model))
+    with pytest.raises(EmptyPlan):
+        asyncio.run(arun_report("topic", model, thread_id="thread"))
+
+
+def test_an_empty_plan_fails_the_stream():
+    async def main():
+        return [event async for event, _ in astream_report("topic", stubs.FakeChatModel(latency=0, sections=0))]
+
+    with pytest.raises(EmptyPlan):
+        asyncio.run(main())
+
+
+class FlakyChatModel(stubs.FakeChatModel):
+    """Fails the section named `fail_section` once, last, and keeps the prompts of the sections it writes"""
+
+    fail_section: str = ""
+    written: list = []
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = messages[-1].content
+        if self.fail_section and self.fail_section in prompt:
+            self.fail_section = ""
+            # After the other sections are written, as in bench_resume.py
+            await asyncio.sleep(0.1)
+            raise RuntimeError("section failed")
+        self.written.append(prompt)
+        return await super()._agenerate(messages, stop, run_manager, **kwargs)
+
+
+def test_resuming_writes_only_the_missing_sections():
+    model = FlakyChatModel(latency=0, sections=4, fail_section="Section 3 ", written=[])
+    with pytest.raises(RuntimeError):
+        asyncio.run(arun_report("topic", model, thread_id="thread"))
+    assert len(model.written) == 3
+    model.written = []
+    report = asyncio.run(arun_report("topic", model, thread_id="thread"))
+    assert len(model.written) == 1
+    assert "Section 3 " in model.written[0]
+    assert report.count(model.response) == 4
@@ -0,0 +1,55 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from ra_ratelimit import ModelBudget, SharedTokenBucket, TokenBucket
+from ra_state import MemoryState, SQLiteState
+
+
+class ThreadRecordingState(MemoryState):
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+
+    def update(self, key, fn, ttl=None):
+        self.threads.add(threading.get_ident())
+        return super().update(key, fn, ttl)
+
+
+def test_shared_budget_writes_run_off_the_event_loop():
+    state = ThreadRecordingState()
+    budget = ModelBudget(rpm=100, tpm=10000, state=state, name="key:model")
+
+    async def main():
+        await budget.acquire(100)
+        await budget.update({"x-ratelimit-remaining-tokens": "500"})
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(main())
+    assert state.threads
+    assert loop_thread not in state.threads
+    assert budget.header_updates == 1
+    assert budget.tokens.available() < 1000
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_a_shorter_pause_keeps_the_longer_one(tmp_path, backend):
+    state = MemoryState() if backend == "memory" else SQLiteState(str(tmp_path / "state.sqlite3"))
+    budget = ModelBudget(state=state, name="key:model")
+    budget.pause(30)
+    budget.pause(1)
+    time.sleep(1.1)
+    assert state.get("key:model:paused") is not None
+    assert budget._paused(time.monotonic()) > 25
+
+
+def test_local_and_shared_buckets_take_the_same():
+    local = TokenBucket(100)
+    shared = SharedTokenBucket(MemoryState(), "tokens", 100)
+    for bucket in (local, shared):
+        # Bigger than the bucket: waits for it to be full, then takes all of it
+        assert bucket.take(150, time.monotonic()) == 0.0
+        assert bucket.available(time.monotonic()) < -49
+        assert bucket.take(10, time.monotonic()) > 0
@@ -0,0 +1,38 @@
+import pytest
+
+from ra_report_cache import ReportCache, question_key
+
+
+@pytest.mark.parametrize("first, second", [
+    ("What is the trade relationship between the US and Canada?",
+     "What is the trade relationship between the US and Mexico?"),
+    ("What are the benefits of green tea?", "What are the risks of green tea?"),
+    ("Is nuclear power a good energy source?", "Is solar power a good energy source?"),
+    ("How many cars did Tesla sell in 2023?", "How many cars did Tesla sell in 2024?"),
+    ("How did the economy do in the 1990s?", "How did the economy do in 1990?"),
+    ("Did Germany invade France?", "Did France invade Germany?"),
+    ("Are cats smarter than dogs?", "Are dogs smarter than cats?"),
+    ("How do I convert Celsius to Fahrenheit?", "How do I convert Fahrenheit to Celsius?"),
+    ("Is Python faster than Java?", "Is Java faster than Python?"),
+])
+def test_different_questions_do_not_match(first, second):
+    assert question_key(first) != question_key(second)
+
+
+@pytest.mark.parametrize("first, second", [
+    ("What are the benefits of green tea?", "benefits of green tea"),
+    ("What are the benefits of green tea?", "What is the benefit of green tea"),
+    ("How many cars did Tesla sell in 2023?", "how many cars did Tesla sell in 2023"),
+])
+def test_rewordings_match(first, second):
+    assert question_key(first) == question_key(second)
+
+
+def test_hits_are_scoped_and_do_not_carry_the_question(tmp_path):
+    cache = ReportCache(str(tmp_path / "reports.sqlite3"))
+    cache.store("What are the benefits of green tea?", "scope", "report")
+    hit = cache.lookup("benefits of green tea", "scope")
+    assert hit["report"] == "report"
+    assert "question" not in hit
+    assert cache.lookup("benefits of green tea", "other scope") is None
+    assert cache.lookup("risks of green tea", "scope") is None
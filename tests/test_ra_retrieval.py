@@ -0,0 +1,27 @@
+from ra_cache import TieredCache
+from ra_retrieval import ChunkIndex, HashingEmbedder
+
+
+def index(tmp_path):
+    return ChunkIndex(HashingEmbedder(), TieredCache("chunks", cache_dir=str(tmp_path)))
+
+
+def page():
+    sentences = [f"Sentence {n} is about the history of the town hall." for n in range(60)]
+    sentences[10] = "Solar panels convert sunlight into electricity with photovoltaic cells."
+    sentences[45] = "Solar panel efficiency has improved, converting more sunlight into electricity."
+    return " ".join(sentences)
+
+
+def test_select_keeps_the_relevant_chunks_in_page_order(tmp_path):
+    text = page()
+    selected = index(tmp_path).select("How do solar panels convert sunlight into electricity?",
+                                      "https://example.com", text, max_chars=2100)
+    assert len(selected) <= 2100
+    first = selected.index("Solar panels convert")
+    second = selected.index("Solar panel efficiency")
+    assert first < second
+
+
+def test_a_page_within_budget_is_returned_whole(tmp_path):
+    assert index(tmp_path).select("question", "https://example.com", "Short page.", 1000) == "Short page."